@@ -0,0 +1,48 @@
+"""Classify an NDJSON file of emails offline, e.g. to re-classify mailbox history.
+
+Usage:
+    python -m app.cli.classify_stream [--rules config/email_rules.json] [INPUT] [-o OUTPUT]
+
+INPUT and OUTPUT default to stdin/stdout. Each output line mirrors an
+EmailClassifyBatchItem; totals and throughput are printed to stderr.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from app.services.email_classifier import EmailClassifier
+from app.services.ndjson_stream import CHUNK_SIZE, DEFAULT_MAX_LINE_BYTES, NdjsonClassificationStream
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Classify NDJSON emails with the Tier 1 rules")
+    parser.add_argument("input", nargs="?", type=Path, help="NDJSON input file (default: stdin)")
+    parser.add_argument("-o", "--output", type=Path, help="NDJSON output file (default: stdout)")
+    parser.add_argument("--rules", type=Path, help="Rules file (default: config/email_rules.json)")
+    parser.add_argument("--max-line-bytes", type=int, default=DEFAULT_MAX_LINE_BYTES)
+    args = parser.parse_args(argv)
+
+    classifier = EmailClassifier(rules_path=args.rules)
+    stream = NdjsonClassificationStream(classifier, max_line_bytes=args.max_line_bytes)
+
+    source = open(args.input, "rb") if args.input else sys.stdin.buffer
+    sink = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        chunks = iter(lambda: source.read(CHUNK_SIZE), b"")
+        for output in stream.classify_lines(chunks):
+            sink.write(output)
+        sink.flush()
+    finally:
+        if args.input:
+            source.close()
+        if args.output:
+            sink.close()
+
+    print(json.dumps(stream.summary()), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
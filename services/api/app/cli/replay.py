@@ -0,0 +1,261 @@
+"""Replay an NDJSON archive of emails against two rulesets and report what changes.
+
+Usage:
+    python -m app.cli.replay --candidate NEW_RULES [--current config/email_rules.json]
+        [INPUT] [-o REPORT] [--workers N] [--chunk-size N] [--samples N]
+
+Records are read in the main process and classified in chunks by a pool of
+worker processes, each of which compiles both rulesets once. The JSON
+report holds a category transition matrix (current -> candidate), sample
+emails for every changed category and for action-only changes, and the
+throughput of each ruleset; a one-line summary goes to stderr.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from pydantic import ValidationError
+
+from app.models.email import EmailClassifyRequest, EmailClassifyResponse
+from app.services.email_classifier import EmailClassifier
+from app.services.ndjson_stream import CHUNK_SIZE, DEFAULT_MAX_LINE_BYTES, read_lines
+from app.services.ruleset import CompiledRuleset, RulesetError, parse_ruleset
+
+# Set by _init_worker in every pool process (or once for an in-process run)
+_worker: tuple[EmailClassifier, CompiledRuleset, CompiledRuleset] | None = None
+
+
+def load_ruleset(path: Path) -> CompiledRuleset:
+    """Compile a rules file, resolving values_file references next to it. Raises RulesetError."""
+    try:
+        raw = path.read_bytes()
+    except OSError as e:
+        raise RulesetError(f"Cannot read {path}: {e}") from e
+    return parse_ruleset(raw, base_dir=path.parent)
+
+
+def _init_worker(current: Path, candidate: Path) -> None:
+    global _worker
+    classifier = EmailClassifier(rules_path=current)
+    _worker = (classifier, load_ruleset(current), load_ruleset(candidate))
+
+
+def _outcome(result: EmailClassifyResponse) -> dict:
+    return {
+        "category": result.category.value,
+        "priority": result.priority.value,
+        "actions": [a.value for a in result.actions],
+        "reasoning": result.reasoning,
+    }
+
+
+def _sample(
+    index: int, email: EmailClassifyRequest, current: EmailClassifyResponse, candidate: EmailClassifyResponse
+) -> dict:
+    return {
+        "index": index,
+        "message_id": email.message_id,
+        "from_address": email.from_address,
+        "subject": email.subject,
+        "current": _outcome(current),
+        "candidate": _outcome(candidate),
+    }
+
+
+def replay_chunk(start: int, lines: list[bytes | None], samples: int) -> dict:
+    """Classify one chunk with both rulesets. Runs in a worker process."""
+    classifier, current, candidate = _worker
+    transitions: Counter = Counter()
+    changed: dict[str, list[dict]] = {}
+    action_changes: list[dict] = []
+    action_changed = 0
+    errors = 0
+    timings = [0.0, 0.0]
+    perf_counter = time.perf_counter
+
+    for offset, line in enumerate(lines):
+        if line is None:
+            errors += 1
+            continue
+        try:
+            email = EmailClassifyRequest.model_validate_json(line)
+        except ValidationError:
+            errors += 1
+            continue
+        started = perf_counter()
+        before = classifier.classify(email, dry_run=True, ruleset=current)
+        middle = perf_counter()
+        after = classifier.classify(email, dry_run=True, ruleset=candidate)
+        timings[0] += middle - started
+        timings[1] += perf_counter() - middle
+
+        key = (before.category.value, after.category.value)
+        transitions[key] += 1
+        if key[0] != key[1]:
+            bucket = changed.setdefault(f"{key[0]} -> {key[1]}", [])
+            if len(bucket) < samples:
+                bucket.append(_sample(start + offset, email, before, after))
+        elif before.actions != after.actions:
+            action_changed += 1
+            if len(action_changes) < samples:
+                action_changes.append(_sample(start + offset, email, before, after))
+
+    return {
+        "transitions": transitions,
+        "changed": changed,
+        "action_changed": action_changed,
+        "action_changes": action_changes,
+        "errors": errors,
+        "timings": timings,
+    }
+
+
+class ReplayReport:
+    """Merges chunk results; samples keep the lowest record indexes, so the
+    report does not depend on the order in which chunks finish."""
+
+    def __init__(self, current: CompiledRuleset, candidate: CompiledRuleset, samples: int):
+        self.versions = (current.version, candidate.version)
+        self.samples = samples
+        self.transitions: Counter = Counter()
+        self.changed: dict[str, list[dict]] = {}
+        self.action_changed = 0
+        self.action_changes: list[dict] = []
+        self.errors = 0
+        self.timings = [0.0, 0.0]
+        self._started = time.perf_counter()
+
+    def add(self, chunk: dict) -> None:
+        self.transitions.update(chunk["transitions"])
+        for transition, samples in chunk["changed"].items():
+            self.changed[transition] = self._lowest(self.changed.get(transition, []) + samples)
+        self.action_changed += chunk["action_changed"]
+        self.action_changes = self._lowest(self.action_changes + chunk["action_changes"])
+        self.errors += chunk["errors"]
+        self.timings = [a + b for a, b in zip(self.timings, chunk["timings"])]
+
+    def _lowest(self, samples: list[dict]) -> list[dict]:
+        return sorted(samples, key=lambda s: s["index"])[: self.samples]
+
+    def to_dict(self) -> dict:
+        elapsed = time.perf_counter() - self._started
+        records = sum(self.transitions.values())
+        matrix: dict[str, dict[str, int]] = {}
+        for (before, after), count in sorted(self.transitions.items()):
+            matrix.setdefault(before, {})[after] = count
+        changes = [
+            {"from": before, "to": after, "count": count, "samples": self.changed[f"{before} -> {after}"]}
+            for (before, after), count in self.transitions.most_common()
+            if before != after
+        ]
+        return {
+            "records": records,
+            "errors": self.errors,
+            "category_changed": sum(c["count"] for c in changes),
+            "actions_changed": self.action_changed,
+            "elapsed_seconds": round(elapsed, 3),
+            "emails_per_second": round(records / elapsed, 1) if elapsed else 0.0,
+            "rulesets": {
+                name: {
+                    "version": version,
+                    "cpu_seconds": round(seconds, 3),
+                    # Per core: classification time only, without parsing
+                    "emails_per_second": round(records / seconds, 1) if seconds else 0.0,
+                }
+                for name, version, seconds in zip(("current", "candidate"), self.versions, self.timings)
+            },
+            "matrix": matrix,
+            "changes": changes,
+            "action_changes": self.action_changes,
+        }
+
+
+def chunked(lines: Iterable[bytes | None], size: int) -> Iterator[tuple[int, list[bytes | None]]]:
+    start = 0
+    chunk: list[bytes | None] = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield start, chunk
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+
+def replay(
+    lines: Iterable[bytes | None],
+    current: Path,
+    candidate: Path,
+    report: ReplayReport,
+    workers: int,
+    chunk_size: int,
+) -> None:
+    chunks = chunked(lines, chunk_size)
+    if workers <= 1:
+        _init_worker(current, candidate)
+        for start, chunk in chunks:
+            report.add(replay_chunk(start, chunk, report.samples))
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(current, candidate)) as pool:
+        # A few chunks per worker in flight: enough to keep every core busy
+        # without reading the whole archive into memory
+        pending: deque[Future] = deque()
+        for start, chunk in chunks:
+            pending.append(pool.submit(replay_chunk, start, chunk, report.samples))
+            if len(pending) >= workers * 2:
+                report.add(pending.popleft().result())
+        while pending:
+            report.add(pending.popleft().result())
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two rulesets on an NDJSON email archive")
+    parser.add_argument("input", nargs="?", type=Path, help="NDJSON input file (default: stdin)")
+    parser.add_argument("-o", "--output", type=Path, help="JSON report file (default: stdout)")
+    parser.add_argument("--current", type=Path, help="Rules in production (default: config/email_rules.json)")
+    parser.add_argument("--candidate", type=Path, required=True, help="Changed rules file to compare")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes (1: no pool)")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=5, help="Sample emails kept per transition")
+    parser.add_argument("--max-line-bytes", type=int, default=DEFAULT_MAX_LINE_BYTES)
+    args = parser.parse_args(argv)
+
+    current_path = args.current or EmailClassifier().rules_path
+    try:
+        current, candidate = load_ruleset(current_path), load_ruleset(args.candidate)
+    except RulesetError as e:
+        print(f"Invalid ruleset: {e}", file=sys.stderr)
+        return 2
+
+    report = ReplayReport(current, candidate, args.samples)
+    source = open(args.input, "rb") if args.input else sys.stdin.buffer
+    try:
+        chunks = iter(lambda: source.read(CHUNK_SIZE), b"")
+        lines = read_lines(chunks, args.max_line_bytes)
+        replay(lines, current_path, args.candidate, report, args.workers, args.chunk_size)
+    finally:
+        if args.input:
+            source.close()
+
+    result = report.to_dict()
+    output = json.dumps(result, indent=2, ensure_ascii=False) + "\n"
+    if args.output:
+        args.output.write_text(output)
+    else:
+        sys.stdout.write(output)
+    summary_keys = ("records", "errors", "category_changed", "actions_changed", "elapsed_seconds", "emails_per_second")
+    print(json.dumps({key: result[key] for key in summary_keys}), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,84 @@ class Settings(BaseSettings):
     REDIS_URL: str = "redis://redis:6379/0"
     TELEGRAM_BOT_TOKEN: str
     ENVIRONMENT: str = "development"
+    RULES_RELOAD_INTERVAL_SECONDS: float = 2.0
+    # Directory shared by all uvicorn workers (WEB_CONCURRENCY > 1): rules are
+    # compiled once and every worker serves the same revision. Empty: per worker.
+    RULES_SNAPSHOT_DIR: str = ""
+    CLASSIFY_BATCH_MAX_SIZE: int = 5000
+    CLASSIFY_CACHE_ENABLED: bool = True
+    CLASSIFY_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    RULE_PROFILING_ENABLED: bool = False
+    # Per-phase durations of every response in a Server-Timing header
+    SERVER_TIMING_ENABLED: bool = True
+    NEAR_DUPLICATE_ENABLED: bool = True
+    NEAR_DUPLICATE_WINDOW_SECONDS: float = 6 * 3600
+    NEAR_DUPLICATE_MAX_ENTRIES: int = 50000
+    NEAR_DUPLICATE_MAX_DISTANCE: int = 3
+    KNN_ENABLED: bool = True
+    KNN_INDEX_DIR: str = "/app/data/knn"
+    KNN_DIM: int = 256
+    KNN_K: int = 7
+    KNN_MIN_SIMILARITY: float = 0.6
+    KNN_SAVE_INTERVAL_SECONDS: float = 60.0
+    # Server-side mail polling (replaces the n8n Outlook triggers when enabled).
+    # Refresh tokens come from a one-time delegated login of each mailbox.
+    GRAPH_POLL_ENABLED: bool = False
+    GRAPH_CLIENT_ID: str = ""
+    GRAPH_CLIENT_SECRET: str = ""
+    GRAPH_BUSINESS_REFRESH_TOKEN: str = ""
+    GRAPH_FAMILY_REFRESH_TOKEN: str = ""
+    GRAPH_TOKEN_URL: str = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
+    GRAPH_BASE_URL: str = "https://graph.microsoft.com/v1.0"
+    GRAPH_STATE_PATH: str = "/app/data/graph_state.json"
+    GRAPH_POLL_INTERVAL_SECONDS: float = 60.0
+    GRAPH_PAGE_SIZE: int = 50
+    GRAPH_INITIAL_SYNC_HOURS: float = 24.0
+    GRAPH_SEEN_HOURS: float = 168.0
+    # Rules from a Baserow table instead of email_rules.json (which stays the
+    # fallback until the first successful fetch)
+    BASEROW_RULES_ENABLED: bool = False
+    BASEROW_URL: str = "http://baserow"
+    BASEROW_TOKEN: str = ""
+    BASEROW_RULES_TABLE_ID: int = 0
+    BASEROW_RULES_SNAPSHOT_PATH: str = "/app/data/baserow_rules.json"
+    BASEROW_REFRESH_INTERVAL_SECONDS: float = 60.0
+    # Known-correspondent index for the sender_known and sender_seen_count_gte
+    # rule conditions: a Bloom filter sized for CAPACITY senders per worker
+    # (about 600 KB at the defaults) plus per-sender counters in Redis
+    SENDER_HISTORY_ENABLED: bool = True
+    SENDER_HISTORY_CAPACITY: int = 500000
+    SENDER_HISTORY_ERROR_RATE: float = 0.01
+    SENDER_HISTORY_TTL_SECONDS: int = 400 * 24 * 3600
+    SENDER_HISTORY_SYNC_INTERVAL_SECONDS: float = 60.0
+    # POST /email/ingest queues emails in a Redis Stream; INGEST_CONSUMERS
+    # workers per process classify them (0: only accept, e.g. when another
+    # container runs the consumers). Retries wait INGEST_CLAIM_IDLE_SECONDS.
+    INGEST_ENABLED: bool = True
+    INGEST_CONSUMERS: int = 2
+    INGEST_MAX_LENGTH: int = 100000
+    INGEST_MAX_DELIVERIES: int = 5
+    INGEST_CLAIM_IDLE_SECONDS: float = 60.0
+    PERSIST_CLASSIFICATIONS: bool = True
+    PERSIST_BATCH_SIZE: int = 500
+    PERSIST_FLUSH_INTERVAL_SECONDS: float = 2.0
+    PERSIST_MAX_PENDING: int = 20000
+    POSTGRES_POOL_MAX_SIZE: int = 10
+    REDIS_POOL_MAX_SIZE: int = 20
+    REDIS_SOCKET_TIMEOUT_SECONDS: float = 0.5
+    POOL_ACQUIRE_TIMEOUT_SECONDS: float = 5.0
+    POOL_PROBE_INTERVAL_SECONDS: float = 15.0
+    POOL_DRAIN_TIMEOUT_SECONDS: float = 10.0
+    # When enabled, the API sends notify_telegram results itself; remove the
+    # "Send Telegram" node from the n8n workflow to avoid duplicates. One
+    # worker sends for all (Redis lease); the rates apply to the deployment.
+    TELEGRAM_NOTIFY_ENABLED: bool = False
+    TELEGRAM_CHAT_ID: str = ""
+    TELEGRAM_API_BASE: str = "https://api.telegram.org"
+    TELEGRAM_PER_CHAT_RATE: float = 1.0
+    TELEGRAM_GLOBAL_RATE: float = 30.0
+    TELEGRAM_BURST_THRESHOLD: int = 5
+    TELEGRAM_BURST_WINDOW_SECONDS: float = 60.0
 
 
 settings = Settings()
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, TypeVar
+
+import psycopg2
+import psycopg2.extensions
+from redis.asyncio import BlockingConnectionPool, Redis
+
+from app.config import Settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became free within the acquire timeout."""
+
+
+@dataclass
+class ProbeResult:
+    ok: bool
+    latency_ms: float | None
+    checked_at: datetime
+    error: str | None = None
+
+
+class PostgresPool:
+    """Bounded pool of psycopg2 connections with an async interface.
+
+    psycopg2 is blocking, so connections are opened and used in worker
+    threads; the pool itself lives on the event loop. Connections are opened
+    lazily, reused while healthy and discarded after errors.
+    """
+
+    def __init__(self, dsn: str, max_size: int = 10, acquire_timeout: float = 5.0):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.in_use = 0
+        self._idle: list[Any] = []
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._closing = False
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Any]:
+        if self._closing:
+            raise PoolTimeout("Postgres pool is shutting down")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No Postgres connection free within {self.acquire_timeout}s") from None
+        self.in_use += 1
+        conn = None
+        try:
+            conn = self._idle.pop() if self._idle else await asyncio.to_thread(self._connect)
+            yield conn
+        except BaseException:
+            if conn is not None:
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if self._reusable(conn) and not self._closing:
+                    self._idle.append(conn)
+                else:
+                    self._discard(conn)
+            self.in_use -= 1
+            self._semaphore.release()
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run fn(conn, *args) in a worker thread on a pooled connection."""
+        async with self.connection() as conn:
+            return await asyncio.to_thread(fn, conn, *args)
+
+    async def probe(self) -> None:
+        await self.run(_select_one)
+
+    async def close(self, drain_timeout: float) -> None:
+        """Stop handing out connections, wait for borrowed ones, then close all."""
+        self._closing = True
+        await _wait_until(lambda: self.in_use == 0, drain_timeout)
+        if self.in_use:
+            logger.warning("Closing Postgres pool with %d connections still in use", self.in_use)
+        while self._idle:
+            self._discard(self._idle.pop())
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connect_timeout=5)
+
+    @staticmethod
+    def _reusable(conn) -> bool:
+        return (
+            not conn.closed
+            and conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        )
+
+    @staticmethod
+    def _discard(conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+class RedisPool:
+    """Shared redis.asyncio client over a bounded, blocking connection pool."""
+
+    def __init__(self, url: str, max_size: int = 20, acquire_timeout: float = 5.0, socket_timeout: float = 0.5):
+        self.url = url
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.socket_timeout = socket_timeout
+        self._blocking: list[Redis] = []
+        self.pool = BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_size,
+            timeout=acquire_timeout,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_timeout,
+        )
+        self.client = Redis(connection_pool=self.pool)
+
+    @property
+    def in_use(self) -> int:
+        return len(getattr(self.pool, "_in_use_connections", ()))
+
+    def blocking_client(self, block_seconds: float, max_connections: int) -> Redis:
+        """Client for commands that block server-side (XREADGROUP BLOCK), on its own connections.
+
+        Its socket timeout outlasts the block; on the shared pool the read
+        would time out first, and it would hold shared connections while idle.
+        """
+        pool = BlockingConnectionPool.from_url(
+            self.url,
+            max_connections=max(1, max_connections),
+            timeout=self.acquire_timeout,
+            socket_timeout=block_seconds + self.socket_timeout,
+            socket_connect_timeout=self.socket_timeout,
+        )
+        client = Redis(connection_pool=pool)
+        self._blocking.append(client)
+        return client
+
+    async def probe(self) -> None:
+        await self.client.ping()
+
+    async def close(self, drain_timeout: float) -> None:
+        await _wait_until(lambda: self.in_use == 0, drain_timeout)
+        await self.client.aclose()
+        await self.pool.disconnect()
+        for client in self._blocking:
+            await client.aclose()
+            await client.connection_pool.disconnect()
+        self._blocking = []
+
+
+class ConnectionPools:
+    """Postgres and Redis pools shared by the whole app, created in the lifespan.
+
+    The lifespan hands the clients to the services that use them: ingest
+    consumers, pollers and the classification writer run outside requests,
+    where FastAPI dependencies do not reach.
+
+    A background task probes each backend periodically; health() only reads
+    the cached results, so Docker healthchecks never open connections.
+    """
+
+    def __init__(
+        self,
+        postgres: PostgresPool,
+        redis: RedisPool,
+        probe_interval: float = 15.0,
+        probe_timeout: float = 2.0,
+        drain_timeout: float = 10.0,
+    ):
+        self.postgres = postgres
+        self.redis = redis
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.drain_timeout = drain_timeout
+        self.probes: dict[str, ProbeResult] = {}
+        self._probe_task: asyncio.Task | None = None
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "ConnectionPools":
+        return cls(
+            postgres=PostgresPool(
+                settings.DATABASE_URL,
+                max_size=settings.POSTGRES_POOL_MAX_SIZE,
+                acquire_timeout=settings.POOL_ACQUIRE_TIMEOUT_SECONDS,
+            ),
+            redis=RedisPool(
+                settings.REDIS_URL,
+                max_size=settings.REDIS_POOL_MAX_SIZE,
+                acquire_timeout=settings.POOL_ACQUIRE_TIMEOUT_SECONDS,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+            ),
+            probe_interval=settings.POOL_PROBE_INTERVAL_SECONDS,
+            drain_timeout=settings.POOL_DRAIN_TIMEOUT_SECONDS,
+        )
+
+    async def start(self) -> None:
+        self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        await asyncio.gather(
+            self.postgres.close(self.drain_timeout),
+            self.redis.close(self.drain_timeout),
+        )
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(
+            self._probe("postgres", self.postgres.probe),
+            self._probe("redis", self.redis.probe),
+        )
+
+    def health(self) -> dict:
+        """Cached probe results plus current pool usage. Performs no I/O."""
+        result = {}
+        for name, pool in (("postgres", self.postgres), ("redis", self.redis)):
+            probe = self.probes.get(name)
+            result[name] = {
+                "ok": probe.ok if probe else None,
+                "latency_ms": probe.latency_ms if probe else None,
+                "checked_at": probe.checked_at.isoformat() if probe else None,
+                "error": probe.error if probe else None,
+                "in_use": pool.in_use,
+                "max_size": pool.max_size,
+                "saturation": round(pool.in_use / pool.max_size, 3) if pool.max_size else 0.0,
+            }
+        return result
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.probe_interval)
+
+    async def _probe(self, name: str, probe: Callable[[], Any]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe(), self.probe_timeout)
+        except Exception as e:
+            if self.probes.get(name, None) is None or self.probes[name].ok:
+                logger.warning("%s health probe failed: %s", name, e)
+            self.probes[name] = ProbeResult(
+                ok=False, latency_ms=None, checked_at=datetime.now(timezone.utc), error=str(e) or type(e).__name__
+            )
+            return
+        self.probes[name] = ProbeResult(
+            ok=True,
+            latency_ms=round((time.perf_counter() - started) * 1000, 2),
+            checked_at=datetime.now(timezone.utc),
+        )
+
+
+def _select_one(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    conn.rollback()
+
+
+async def _wait_until(condition: Callable[[], bool], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
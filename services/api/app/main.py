@@ -1,19 +1,173 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+import httpx
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.config import Settings
-from app.routers import email
+from app.config import settings
+from app.connections import ConnectionPools
+from app.metrics import CONTENT_TYPE, MetricsMiddleware, render_metrics
+from app.models.email import EmailAccount
+from app.profiling import ProfilingMiddleware
+from app.routers import admin, email
+from app.services.baserow_rules import BaserowRuleProvider
+from app.services.classification_store import PostgresClassificationSink
+from app.services.ingest_queue import DEFAULT_BLOCK_MS, IngestQueue, IngestWorkerPool
+from app.services.graph_poller import (
+    GraphMailbox,
+    GraphMailPoller,
+    GraphStateStore,
+    GraphTokenProvider,
+)
+from app.services.telegram_dispatcher import TelegramClient, TelegramDispatcher
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 
-app = FastAPI(title="Life Manager API", version="0.1.0")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Rules are compiled once at import; these tasks only swap in edited versions
+    rule_provider = None
+    if settings.BASEROW_RULES_ENABLED:
+        rule_provider = BaserowRuleProvider(
+            email.classifier,
+            httpx.AsyncClient(timeout=10.0),
+            settings.BASEROW_URL,
+            settings.BASEROW_TOKEN,
+            settings.BASEROW_RULES_TABLE_ID,
+            settings.BASEROW_RULES_SNAPSHOT_PATH,
+            interval=settings.BASEROW_REFRESH_INTERVAL_SECONDS,
+        )
+        await rule_provider.start()
+        rules_watcher = None
+    else:
+        rules_watcher = asyncio.create_task(
+            email.classifier.watch(settings.RULES_RELOAD_INTERVAL_SECONDS)
+        )
+    knn_autosave = None
+    if email.classifier.knn is not None:
+        knn_autosave = asyncio.create_task(
+            email.classifier.knn.autosave(settings.KNN_SAVE_INTERVAL_SECONDS)
+        )
+    pools = ConnectionPools.from_settings(settings)
+    await pools.start()
+    app.state.pools = pools
+    if settings.CLASSIFY_CACHE_ENABLED:
+        email.cache.client = pools.redis.client
+    sender_history = email.classifier.sender_history
+    if sender_history is not None:
+        sender_history.client = pools.redis.client
+        await sender_history.start()
+    if settings.PERSIST_CLASSIFICATIONS:
+        email.writer.sink = PostgresClassificationSink(pools.postgres)
+        await email.writer.start()
+    if settings.TELEGRAM_NOTIFY_ENABLED and settings.TELEGRAM_CHAT_ID:
+        email.notifier = TelegramDispatcher(
+            TelegramClient(settings.TELEGRAM_BOT_TOKEN, settings.TELEGRAM_API_BASE),
+            settings.TELEGRAM_CHAT_ID,
+            per_chat_rate=settings.TELEGRAM_PER_CHAT_RATE,
+            global_rate=settings.TELEGRAM_GLOBAL_RATE,
+            burst_threshold=settings.TELEGRAM_BURST_THRESHOLD,
+            burst_window=settings.TELEGRAM_BURST_WINDOW_SECONDS,
+            redis=pools.redis.client,
+        )
+        await email.notifier.start()
+    ingest_workers = None
+    if settings.INGEST_ENABLED:
+        email.ingest = IngestQueue(
+            pools.redis.client,
+            max_length=settings.INGEST_MAX_LENGTH,
+            read_client=pools.redis.blocking_client(DEFAULT_BLOCK_MS / 1000, settings.INGEST_CONSUMERS),
+        )
+        if settings.INGEST_CONSUMERS > 0:
+            ingest_workers = IngestWorkerPool(
+                email.ingest,
+                email.classify_one,
+                consumers=settings.INGEST_CONSUMERS,
+                claim_idle=settings.INGEST_CLAIM_IDLE_SECONDS,
+                max_deliveries=settings.INGEST_MAX_DELIVERIES,
+            )
+            await ingest_workers.start()
+    graph_poller = _graph_poller() if settings.GRAPH_POLL_ENABLED else None
+    if graph_poller is not None:
+        await graph_poller.start()
+    yield
+    if graph_poller is not None:
+        await graph_poller.stop()
+    # Unfinished entries stay pending in the stream and are claimed after a restart
+    if ingest_workers is not None:
+        await ingest_workers.stop()
+    email.ingest = None
+    if email.notifier is not None:
+        await email.notifier.stop()
+        email.notifier = None
+    # Flush buffered rows while the pools are still open, then drain them
+    await email.writer.stop()
+    if sender_history is not None:
+        await sender_history.stop()
+        sender_history.client = None
+    if rule_provider is not None:
+        await rule_provider.stop()
+    if rules_watcher is not None:
+        rules_watcher.cancel()
+    if knn_autosave is not None:
+        knn_autosave.cancel()
+        try:
+            await asyncio.to_thread(email.classifier.knn.save)
+        except OSError as e:
+            logger.error("Could not save kNN index: %s", e)
+    email.cache.client = None
+    app.state.pools = None
+    await pools.stop()
+
+
+def _graph_poller() -> GraphMailPoller | None:
+    refresh_tokens = {
+        EmailAccount.BUSINESS: settings.GRAPH_BUSINESS_REFRESH_TOKEN,
+        EmailAccount.FAMILY: settings.GRAPH_FAMILY_REFRESH_TOKEN,
+    }
+    state = GraphStateStore(settings.GRAPH_STATE_PATH)
+    http = httpx.AsyncClient(timeout=30.0)
+    mailboxes = [
+        GraphMailbox(
+            account,
+            GraphTokenProvider(
+                http,
+                settings.GRAPH_TOKEN_URL,
+                settings.GRAPH_CLIENT_ID,
+                settings.GRAPH_CLIENT_SECRET,
+                account,
+                refresh_token,
+                state,
+            ),
+        )
+        for account, refresh_token in refresh_tokens.items()
+        if refresh_token or state.get(account, "refresh_token")
+    ]
+    if not mailboxes:
+        logger.error("GRAPH_POLL_ENABLED is set but no mailbox has a refresh token")
+        return None
+    return GraphMailPoller(
+        mailboxes,
+        state,
+        email.classify_polled,
+        http,
+        graph_base=settings.GRAPH_BASE_URL,
+        interval=settings.GRAPH_POLL_INTERVAL_SECONDS,
+        page_size=settings.GRAPH_PAGE_SIZE,
+        initial_sync_hours=settings.GRAPH_INITIAL_SYNC_HOURS,
+        seen_hours=settings.GRAPH_SEEN_HOURS,
+    )
+
 
-settings = Settings()
+app = FastAPI(title="Life Manager API", version="0.1.0", lifespan=lifespan)
 
 if settings.ENVIRONMENT == "development":
     app.add_middleware(
@@ -24,17 +178,33 @@ if settings.ENVIRONMENT == "development":
         allow_headers=["*"],
     )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware, server_timing=settings.SERVER_TIMING_ENABLED)
+
 # Register routers
 app.include_router(email.router)
+app.include_router(admin.router)
 
 
 @app.get("/health")
-async def health():
-    return {
+async def health(request: Request):
+    result = {
         "status": "ok",
         "version": "0.1.0",
         "environment": settings.ENVIRONMENT,
     }
+    # Cached results of the background probe; the check itself never touches a backend
+    pools = getattr(request.app.state, "pools", None)
+    if pools is not None:
+        result["pools"] = pools.health()
+        if any(p["ok"] is False for p in result["pools"].values()):
+            result["status"] = "degraded"
+    return result
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
 
 
 @app.get("/")
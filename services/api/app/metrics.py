@@ -0,0 +1,156 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to a directory that is
+# emptied on container start; every worker then writes its samples there and
+# /metrics aggregates them, whichever worker answers the scrape.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Classification is sub-millisecond, so the default HTTP buckets are too coarse
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "lm_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+CLASSIFICATION_DURATION = Histogram(
+    "lm_classification_duration_seconds",
+    "Time spent evaluating rules for one email",
+    buckets=FAST_BUCKETS,
+)
+CLASSIFICATIONS = Counter(
+    "lm_classifications_total",
+    "Classified emails by resulting category and rule",
+    ["category", "rule"],
+)
+RULES_RELOADS = Counter(
+    "lm_rules_reloads_total",
+    "Rule file (re)loads by outcome (loaded, rejected)",
+    ["result"],
+)
+RULES_FETCHES = Counter(
+    "lm_rules_fetches_total",
+    "Baserow rule table fetches by outcome (loaded, unchanged, rejected, failed)",
+    ["result"],
+)
+RULES_LOAD_DURATION = Histogram(
+    "lm_rules_load_duration_seconds",
+    "Time spent parsing and compiling a rules file",
+    buckets=FAST_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "lm_cache_requests_total",
+    "Cache lookups by cache name and result (hit, miss, error)",
+    ["cache", "result"],
+)
+PERSISTENCE_ROWS = Counter(
+    "lm_persistence_rows_total",
+    "Classification rows handed to the database writer by outcome (written, dropped)",
+    ["result"],
+)
+PERSISTENCE_FLUSH_DURATION = Histogram(
+    "lm_persistence_flush_duration_seconds",
+    "Time to write one batch of classification rows",
+)
+SENDER_HISTORY_UPDATES = Counter(
+    "lm_sender_history_updates_total",
+    "Sender history updates written to Redis by outcome (written, dropped)",
+    ["result"],
+)
+TELEGRAM_MESSAGES = Counter(
+    "lm_telegram_messages_total",
+    "Telegram notifications by outcome (sent, coalesced, dropped, failed)",
+    ["result"],
+)
+GRAPH_MESSAGES = Counter(
+    "lm_graph_messages_total",
+    "Emails fetched by the Microsoft Graph delta poller",
+    ["account"],
+)
+INGEST_MESSAGES = Counter(
+    "lm_ingest_messages_total",
+    "Emails from the ingest stream by outcome (queued, classified, failed, retried, dead_lettered)",
+    ["result"],
+)
+# Queue gauges describe the shared stream: every worker reports the same
+# figures, so the multiprocess aggregate is their maximum
+INGEST_QUEUE_DEPTH = Gauge(
+    "lm_ingest_queue_depth",
+    "Emails in the ingest stream (not yet read or not yet acknowledged)",
+    multiprocess_mode="max",
+)
+INGEST_PENDING = Gauge(
+    "lm_ingest_pending",
+    "Ingested emails read by a consumer but not yet acknowledged",
+    multiprocess_mode="max",
+)
+INGEST_LAG = Gauge(
+    "lm_ingest_consumer_lag",
+    "Ingested emails not yet delivered to any consumer",
+    multiprocess_mode="max",
+)
+INGEST_OLDEST_AGE = Gauge(
+    "lm_ingest_oldest_age_seconds",
+    "Age of the oldest email still in the ingest stream",
+    multiprocess_mode="max",
+)
+INGEST_DEAD_LETTERS = Gauge(
+    "lm_ingest_dead_letters",
+    "Emails in the ingest dead-letter stream",
+    multiprocess_mode="max",
+)
+
+
+def render_metrics() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """Record request latency per route template (not raw path, to bound label cardinality)."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            ).observe(time.perf_counter() - started)
@@ -0,0 +1,15 @@
+from pydantic import BaseModel, Field
+
+
+class ProfileRequest(BaseModel):
+    requests: int = Field(..., ge=1, le=100000, description="Number of upcoming requests to profile")
+    interval_ms: float = Field(1.0, ge=0.1, le=100.0, description="Sampling interval")
+
+
+class ProfileStatus(BaseModel):
+    requested: int = Field(..., description="Requests the profiler was armed for")
+    completed: int = Field(..., description="Profiled requests that finished")
+    remaining: int = Field(..., description="Requests still to be picked up")
+    samples: int = Field(..., description="Stack samples collected so far")
+    interval_ms: float
+    done: bool
@@ -15,6 +15,11 @@ class EmailImportance(str, Enum):
     HIGH = "high"
 
 
+class EmailBodyType(str, Enum):
+    TEXT = "text"
+    HTML = "html"
+
+
 class EmailPriority(str, Enum):
     LOW = "low"
     MEDIUM = "medium"
@@ -41,6 +46,14 @@ class EmailClassifyRequest(BaseModel):
     from_name: str = Field("", description="Sender display name")
     subject: str = Field("", description="Email subject line")
     body_preview: str = Field("", description="First ~255 characters of email body")
+    body: str = Field(
+        "",
+        description="Full email body, only read by rules on the body field "
+        "(for large bodies use POST /classify/upload, which streams it)",
+    )
+    body_content_type: EmailBodyType = Field(
+        EmailBodyType.TEXT, description="Format of body, like Graph's body.contentType"
+    )
     received_at: datetime | None = Field(None, description="When the email was received")
     has_attachments: bool = Field(False, description="Whether email has attachments")
     importance: EmailImportance = Field(
@@ -73,11 +86,50 @@ class EmailClassifyResponse(BaseModel):
     actions: list[EmailAction]
     confidence: float = Field(..., ge=0.0, le=1.0)
     tier_used: int = Field(1, description="Classification tier (1=rules, 2=LLM)")
+    knn_used: bool = Field(
+        False, description="Whether no rule matched and the labels of the nearest labeled examples were used"
+    )
     reasoning: str = Field("", description="Why this classification was chosen")
     dry_run: bool = Field(False, description="Whether this was a test run")
+    cached: bool = Field(False, description="Whether this result was returned from the classification cache")
+    cluster_id: str | None = Field(None, description="Near-duplicate cluster of this email (SimHash of subject/body)")
+    duplicate_of: str | None = Field(
+        None,
+        description="message_id (or cluster_id) of the first recent email this one nearly duplicates",
+    )
+    ruleset_version: str = Field("", description="Content hash of the ruleset that produced this result")
+    ruleset_revision: int = Field(
+        0, description="Revision of that ruleset in the shared snapshot store, increasing with every change"
+    )
     email: EmailSummary = Field(default_factory=EmailSummary, description="Echo of input email fields")
 
 
+class EmailClassifyBatchItem(BaseModel):
+    index: int = Field(..., description="Position of the email in the request list")
+    result: EmailClassifyResponse | None = None
+    error: str | None = Field(None, description="Why this email could not be classified")
+
+
+class EmailClassifyBatchResponse(BaseModel):
+    results: list[EmailClassifyBatchItem]
+    total: int
+    failed: int
+
+
+class EmailIngestResponse(BaseModel):
+    id: str = Field(..., description="Entry id in the ingest stream")
+    queued: bool = True
+
+
+class EmailIngestStatus(BaseModel):
+    length: int = Field(..., description="Emails in the stream: not yet read or not yet acknowledged")
+    pending: int = Field(..., description="Read by a consumer but not yet acknowledged")
+    lag: int | None = Field(..., description="Not yet delivered to any consumer")
+    consumers: int
+    oldest_age_seconds: float = Field(..., description="Age of the oldest email still in the stream")
+    dead_letters: int
+
+
 class EmailRule(BaseModel):
     name: str
     category: EmailCategory
@@ -90,4 +142,53 @@ class EmailRule(BaseModel):
 class EmailRulesResponse(BaseModel):
     rules: list[EmailRule]
     total: int
-    source: str = Field("config_file", description="Where rules are loaded from")
+    source: str = Field(
+        "config_file", description="Where rules are loaded from (config_file, baserow, baserow_snapshot)"
+    )
+
+
+class EmailRuleConditionStats(BaseModel):
+    index: int
+    field: str
+    operator: str
+    evaluations: int
+    matches: int
+    total_ms: float = Field(..., description="Cumulative evaluation time, incl. the field's keyword scan")
+    avg_us: float
+
+
+class EmailRuleStats(BaseModel):
+    name: str
+    category: EmailCategory
+    evaluations: int
+    matches: int
+    first_matches: int = Field(..., description="How often this rule decided the classification")
+    total_ms: float
+    avg_us: float
+    conditions: list[EmailRuleConditionStats]
+
+
+class EmailRuleStatsResponse(BaseModel):
+    enabled: bool = Field(..., description="Whether rule profiling is currently recording")
+    ruleset_version: str
+    since: datetime = Field(..., description="When the counters were last reset")
+    emails: int = Field(..., description="Emails classified while profiling")
+    rules: list[EmailRuleStats]
+
+
+class EmailRuleProfilingRequest(BaseModel):
+    enabled: bool
+
+
+class EmailExample(BaseModel):
+    """A labeled email for the nearest-neighbour tier."""
+
+    email: EmailClassifyRequest
+    category: EmailCategory
+    priority: EmailPriority
+    actions: list[EmailAction] = Field(default_factory=lambda: [EmailAction.NOTIFY_TELEGRAM])
+
+
+class EmailExamplesResponse(BaseModel):
+    added: int
+    total: int = Field(..., description="Labeled examples in the index")
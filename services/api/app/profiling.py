@@ -0,0 +1,230 @@
+import functools
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Requests to these paths are never profiled (arming and reading the profile itself)
+EXCLUDED_PREFIXES = ("/api/v1/admin", "/metrics")
+# Name prefix of the default executor's threads, which run asyncio.to_thread work
+EXECUTOR_THREAD_PREFIX = "asyncio_"
+
+
+class RequestTimings:
+    """Phase durations of one request, reported in its Server-Timing header.
+
+    `validate` is the time from the request start to the endpoint body
+    (routing, body read, Pydantic validation); `serialize` the time from the
+    endpoint's return to the response start (response model validation and
+    JSON rendering). Endpoints add their own phases with phase().
+    """
+
+    __slots__ = ("started", "entered", "exited", "phases")
+
+    def __init__(self, started: float):
+        self.started = started
+        self.entered: float | None = None
+        self.exited: float | None = None
+        self.phases: dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def header(self, now: float) -> str:
+        parts = []
+        if self.entered is not None:
+            parts.append(("validate", self.entered - self.started))
+        parts.extend(self.phases.items())
+        if self.exited is not None:
+            parts.append(("serialize", now - self.exited))
+        parts.append(("total", now - self.started))
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in parts)
+
+
+_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block as a Server-Timing phase of the current request (no-op outside one)."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def timed_endpoint(func):
+    """Mark where an async endpoint starts and ends, separating validate and serialize."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        timings = _timings.get()
+        if timings is None:
+            return await func(*args, **kwargs)
+        timings.entered = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            timings.exited = time.perf_counter()
+
+    return wrapper
+
+
+class SamplingProfiler:
+    """Statistical profiler for the next N requests of this worker.
+
+    While a profiled request is in flight, a background thread snapshots
+    every `interval` seconds the stack of the thread serving it and of the
+    busy executor threads (asyncio.to_thread work); identical stacks are
+    counted and exported in collapsed format ("a;b;c 42" per line), which
+    flamegraph.pl and speedscope read directly. Samples of a thread waiting
+    for work (the event loop in select, an idle executor thread) are
+    skipped. The event loop runs every request, so samples also cover
+    concurrent unprofiled requests: the profile is process-wide while armed.
+    When not armed, the only cost per request is reading one attribute.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stopping: threading.Thread | None = None  # sampler told to stop, maybe still running
+        self._active: Counter = Counter()  # thread ident -> profiled requests in flight
+        self._stacks: Counter = Counter()
+        self.remaining = 0
+        self.requested = 0
+        self.completed = 0
+        self.samples = 0
+        self.interval = 0.001
+
+    @property
+    def armed(self) -> bool:
+        return self.remaining > 0
+
+    @property
+    def done(self) -> bool:
+        return self.requested > 0 and self.completed >= self.requested
+
+    def arm(self, requests: int, interval: float = 0.001) -> None:
+        """Profile the next `requests` requests, discarding any earlier profile."""
+        with self._lock:
+            self._stacks.clear()
+            self.remaining = requests
+            self.requested = requests
+            self.completed = 0
+            self.samples = 0
+            self.interval = interval
+
+    def begin(self) -> bool:
+        """Claim a slot for the current request. Returns False once all are taken."""
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self._active[threading.get_ident()] += 1
+            if self._thread is not None:
+                return True
+            previous, self._stopping = self._stopping, None
+            # A fresh event per sampler, so clearing it cannot revive the previous one
+            self._stop = threading.Event()
+            thread = self._thread = threading.Thread(
+                target=self._run, args=(self._stop,), name="sampling-profiler", daemon=True
+            )
+        if previous is not None:
+            # Exits within one interval; joined outside the lock it takes per sample
+            previous.join()
+        thread.start()
+        return True
+
+    def end(self) -> None:
+        with self._lock:
+            ident = threading.get_ident()
+            self._active[ident] -= 1
+            if self._active[ident] <= 0:
+                del self._active[ident]
+            self.completed += 1
+            if not self._active and self._thread is not None:
+                # Sampling restarts with the next profiled request
+                self._stop.set()
+                self._stopping, self._thread = self._thread, None
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def _run(self, stop: threading.Event) -> None:
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            executors = [t.ident for t in threading.enumerate() if t.name.startswith(EXECUTOR_THREAD_PREFIX)]
+            with self._lock:
+                if stop.is_set():
+                    return
+                for ident in {*self._active, *executors}:
+                    frame = frames.get(ident)
+                    if frame is not None and not _waiting(frame):
+                        self._stacks[_collapse(frame)] += 1
+                        self.samples += 1
+
+
+def _waiting(frame) -> bool:
+    """Whether the innermost frame is a thread waiting for work rather than doing it."""
+    module = frame.f_globals.get("__name__")
+    return module == "selectors" or (module == "concurrent.futures.thread" and frame.f_code.co_name == "_worker")
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+profiler = SamplingProfiler()
+
+
+class ProfilingMiddleware:
+    """Add a Server-Timing header to every response and feed armed requests to the profiler."""
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True, profiler: SamplingProfiler = profiler):
+        self.app = app
+        self.server_timing = server_timing
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not (self.server_timing or self.profiler.armed):
+            await self.app(scope, receive, send)
+            return
+
+        profiled = (
+            self.profiler.armed
+            and not scope["path"].startswith(EXCLUDED_PREFIXES)
+            and self.profiler.begin()
+        )
+        timings = RequestTimings(time.perf_counter()) if self.server_timing else None
+
+        async def send_wrapper(message: Message) -> None:
+            if timings is not None and message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.header(time.perf_counter()))
+            await send(message)
+
+        token = _timings.set(timings)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            if profiled:
+                self.profiler.end()
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.models.admin import ProfileRequest, ProfileStatus
+from app.profiling import profiler
+
+router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
+
+
+def _status() -> ProfileStatus:
+    return ProfileStatus(
+        requested=profiler.requested,
+        completed=profiler.completed,
+        remaining=profiler.remaining,
+        samples=profiler.samples,
+        interval_ms=profiler.interval * 1000,
+        done=profiler.done,
+    )
+
+
+@router.post("/profile", response_model=ProfileStatus)
+async def start_profile(request: ProfileRequest):
+    """Arm the sampling profiler for the next N requests of this worker.
+
+    Any earlier profile is discarded. Fetch the result with GET /profile.
+    Sampling covers the event loop and asyncio.to_thread work while an armed
+    request is in flight, so concurrent requests show up in the profile too;
+    arm it on a worker without other traffic to profile one endpoint alone.
+    """
+    profiler.arm(request.requests, request.interval_ms / 1000)
+    return _status()
+
+
+@router.get("/profile/status", response_model=ProfileStatus)
+async def profile_status():
+    return _status()
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def get_profile():
+    """Aggregated stacks in collapsed format ("frame;frame;frame count" per line).
+
+    Feed the text to flamegraph.pl or open it in speedscope. Partial while
+    profiled requests are still outstanding (see X-Profile-Done).
+    """
+    if not profiler.requested:
+        raise HTTPException(status_code=404, detail="Profiler was never armed; POST /api/v1/admin/profile first")
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={
+            "X-Profile-Done": str(profiler.done).lower(),
+            "X-Profile-Samples": str(profiler.samples),
+        },
+    )
@@ -1,31 +1,150 @@
+import asyncio
 import logging
+from typing import Annotated, Any, Iterator
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Body, HTTPException, Query, Request
+from fastapi.responses import Response
+from pydantic import ValidationError
+from redis.exceptions import RedisError
+from starlette.types import Receive, Scope, Send
 
+from app.config import settings
+from app.metrics import INGEST_MESSAGES
+from app.profiling import phase, timed_endpoint
 from app.models.email import (
+    EmailAction,
+    EmailBodyType,
+    EmailClassifyBatchItem,
+    EmailClassifyBatchResponse,
     EmailClassifyRequest,
     EmailClassifyResponse,
+    EmailExample,
+    EmailExamplesResponse,
+    EmailIngestResponse,
+    EmailIngestStatus,
+    EmailRuleProfilingRequest,
     EmailRulesResponse,
+    EmailRuleStatsResponse,
 )
+from app.services.body_scan import BodyScan, scan_body
+from app.services.classification_cache import ClassificationCache
+from app.services.classification_store import ClassificationWriter
 from app.services.email_classifier import EmailClassifier
+from app.services.ingest_queue import IngestQueue, IngestQueueFull
+from app.services.ndjson_stream import (
+    NdjsonClassificationStream,
+    format_validation_error,
+    summary_line,
+)
+from app.services.knn_index import KnnIndex
+from app.services.near_duplicates import NearDuplicateIndex
+from app.services.ruleset import CompiledRuleset, EmailContext
+from app.services.ruleset_snapshot import RulesetSnapshotStore
+from app.services.sender_history import BloomFilter, SenderHistory, SenderStats
+from app.services.telegram_dispatcher import TelegramDispatcher
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1/email", tags=["email"])
 
-classifier = EmailClassifier()
+classifier = EmailClassifier(
+    near_duplicates=NearDuplicateIndex(
+        window_seconds=settings.NEAR_DUPLICATE_WINDOW_SECONDS,
+        max_entries=settings.NEAR_DUPLICATE_MAX_ENTRIES,
+        max_distance=settings.NEAR_DUPLICATE_MAX_DISTANCE,
+    )
+    if settings.NEAR_DUPLICATE_ENABLED
+    else None,
+    knn=KnnIndex(
+        settings.KNN_INDEX_DIR,
+        dim=settings.KNN_DIM,
+        k=settings.KNN_K,
+        min_similarity=settings.KNN_MIN_SIMILARITY,
+    ).load()
+    if settings.KNN_ENABLED
+    else None,
+    snapshots=RulesetSnapshotStore(settings.RULES_SNAPSHOT_DIR) if settings.RULES_SNAPSHOT_DIR else None,
+    keep_published=settings.BASEROW_RULES_ENABLED,
+    # Redis client is attached in the app lifespan; until then only the in-memory filter is kept
+    sender_history=SenderHistory(
+        BloomFilter.for_capacity(settings.SENDER_HISTORY_CAPACITY, settings.SENDER_HISTORY_ERROR_RATE),
+        ttl_seconds=settings.SENDER_HISTORY_TTL_SECONDS,
+        sync_interval=settings.SENDER_HISTORY_SYNC_INTERVAL_SECONDS,
+    )
+    if settings.SENDER_HISTORY_ENABLED
+    else None,
+)
+classifier.profiler.enabled = settings.RULE_PROFILING_ENABLED
+
+# Redis client is attached in the app lifespan; without one every lookup is a miss
+cache = ClassificationCache(ttl_seconds=settings.CLASSIFY_CACHE_TTL_SECONDS)
+
+# Started with a Postgres sink in the app lifespan; until then submit() is a no-op
+writer = ClassificationWriter(
+    batch_size=settings.PERSIST_BATCH_SIZE,
+    flush_interval=settings.PERSIST_FLUSH_INTERVAL_SECONDS,
+    max_pending=settings.PERSIST_MAX_PENDING,
+)
+
+# Set and started in the app lifespan when TELEGRAM_NOTIFY_ENABLED is true
+notifier: TelegramDispatcher | None = None
+
+# Set in the app lifespan when INGEST_ENABLED is true
+ingest: IngestQueue | None = None
 
 
 @router.post("/classify", response_model=EmailClassifyResponse)
+@timed_endpoint
 async def classify_email(email: EmailClassifyRequest):
-    """Classify an incoming email using Tier 1 (rule-based) classification."""
+    """Classify an incoming email using Tier 1 (rule-based) classification.
+
+    Repeated calls for the same message_id (n8n retries, trigger re-fires)
+    return the stored result with cached=true instead of being re-evaluated.
+    """
     logger.info(
         "Classifying email: from=%s subject='%s' account=%s",
         email.from_address,
         email.subject,
         email.account.value,
     )
-    result = classifier.classify(email)
+    return await classify_one(email)
+
+
+async def classify_one(
+    email: EmailClassifyRequest, body: Request | None = None, html_body: bool = False
+) -> EmailClassifyResponse:
+    """Cache lookup, classification, caching and dispatch of one email.
+
+    Shared by POST /classify, POST /classify/upload (whose request body is
+    the email body, read only as far as the rules need it) and the ingest
+    stream consumers.
+    """
+    ruleset = classifier.ruleset
+    # An uploaded body is not read yet, so without a message_id nothing tells two uploads apart
+    cache_key = cache.key_for(email, _cache_version(ruleset)) if body is None or email.message_id else None
+    if cache_key is not None:
+        with phase("cache"):
+            cached = await cache.get(cache_key)
+        if cached is not None:
+            logger.info("Classification cache hit: category=%s key=%s", cached.category.value, cache_key)
+            return cached
+
+    sender = await _lookup_sender(email, ruleset)
+    scan = None
+    if body is not None and ruleset.scans_body:
+        scan = await _scan_body(body, EmailContext(email, ruleset, sender), html_body)
+    elif email.body and ruleset.scans_body:
+        # A JSON body can be megabytes long; scan it off the event loop like an upload
+        ctx = EmailContext(email, ruleset, sender)
+        with phase("body"):
+            scan = await asyncio.to_thread(scan_body, ctx, email.body, email.body_content_type == EmailBodyType.HTML)
+    with phase("rules"):
+        result = classifier.classify(email, ruleset=ruleset, sender=sender, body_scan=scan)
+    if cache_key is not None:
+        with phase("cache"):
+            await cache.set(cache_key, result)
+    with phase("dispatch"):
+        _dispatch(email, result, ruleset.version)
     logger.info(
         "Classification result: category=%s priority=%s actions=%s",
         result.category.value,
@@ -35,11 +154,274 @@ async def classify_email(email: EmailClassifyRequest):
     return result
 
 
+async def _scan_body(body: Request, ctx: EmailContext, html_body: bool) -> BodyScan:
+    scan = BodyScan(ctx, html_body)
+    with phase("body"):
+        if not scan.decided:
+            async for chunk in body.stream():
+                if await asyncio.to_thread(scan.feed, chunk):
+                    # The rest of the body cannot change the outcome
+                    break
+        scan.close()
+    if scan.stream.truncated:
+        logger.warning("Scanned only the first %d characters of the email body", scan.stream.chars)
+    return scan
+
+
+@router.post("/classify/upload", response_model=EmailClassifyResponse)
+@timed_endpoint
+async def classify_email_upload(request: Request, email: Annotated[EmailClassifyRequest, Query()]):
+    """Classify an email whose full body is the request body.
+
+    The other fields come as query parameters. The body (text/plain or
+    text/html; HTML is reduced to its text) is scanned for the body keyword
+    conditions while it arrives, in fixed memory, and only until the first
+    matching rule is certain. A body field in the query is ignored.
+    """
+    logger.info(
+        "Classifying uploaded email: from=%s subject='%s' account=%s",
+        email.from_address,
+        email.subject,
+        email.account.value,
+    )
+    html_body = "text/html" in request.headers.get("content-type", "")
+    return await classify_one(email, body=request, html_body=html_body)
+
+
+@router.post("/ingest", response_model=EmailIngestResponse, status_code=202)
+async def ingest_email(email: EmailClassifyRequest):
+    """Queue an email for classification and return without waiting for it.
+
+    The email is appended to a Redis Stream and classified, persisted and
+    notified by the ingest consumers like POST /classify would; it survives
+    API restarts. Answers 503 when the queue is full or Redis is unavailable,
+    so the caller retries instead of losing the email.
+    """
+    if ingest is None:
+        raise HTTPException(status_code=409, detail="Ingest queue is disabled (INGEST_ENABLED)")
+    try:
+        entry_id = await ingest.append(email)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RedisError as e:
+        logger.error("Could not queue email from %s: %s", email.from_address, e)
+        raise HTTPException(status_code=503, detail="Ingest queue unavailable")
+    INGEST_MESSAGES.labels(result="queued").inc()
+    logger.info("Queued email: from=%s subject='%s' id=%s", email.from_address, email.subject, entry_id)
+    return EmailIngestResponse(id=entry_id)
+
+
+@router.get("/ingest/status", response_model=EmailIngestStatus)
+async def get_ingest_status():
+    """Backlog of the ingest stream: queue depth, consumer lag and dead letters."""
+    if ingest is None:
+        raise HTTPException(status_code=409, detail="Ingest queue is disabled (INGEST_ENABLED)")
+    try:
+        return EmailIngestStatus(**await ingest.stats())
+    except RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Ingest queue unavailable: {e}")
+
+
+def _cache_version(ruleset: CompiledRuleset) -> str:
+    """Ruleset version plus the revision of the labeled examples, which decide
+    unmatched emails too; workers that share a revision share cached verdicts."""
+    if classifier.knn is None:
+        return ruleset.version
+    return f"{ruleset.version}.{classifier.knn.revision}"
+
+
+async def _lookup_sender(email: EmailClassifyRequest, ruleset: CompiledRuleset) -> SenderStats | None:
+    """Sender counters from Redis, when a rule needs them (membership alone needs no lookup)."""
+    if classifier.sender_history is None or not ruleset.uses_sender_counts:
+        return None
+    with phase("sender"):
+        return await classifier.sender_history.lookup(email)
+
+
+async def _lookup_senders(
+    emails: list[EmailClassifyRequest], ruleset: CompiledRuleset
+) -> list[SenderStats | None]:
+    """_lookup_sender for many emails in one pipelined round trip."""
+    if classifier.sender_history is None or not ruleset.uses_sender_counts or not emails:
+        return [None] * len(emails)
+    with phase("sender"):
+        return await classifier.sender_history.lookup_many(emails)
+
+
+def _record(email: EmailClassifyRequest, result: EmailClassifyResponse, ruleset_version: str) -> None:
+    writer.submit(email, result, ruleset_version)
+    if classifier.sender_history is not None:
+        classifier.sender_history.record(email, result.category)
+
+
+def _dispatch(email: EmailClassifyRequest, result: EmailClassifyResponse, ruleset_version: str) -> None:
+    """Persist and notify a freshly classified email (cache hits are redeliveries and skip this)."""
+    _record(email, result, ruleset_version)
+    if notifier is not None and EmailAction.NOTIFY_TELEGRAM in result.actions:
+        notifier.submit(email, result)
+
+
+async def classify_polled(emails: list[EmailClassifyRequest]) -> None:
+    """Handle a batch from the server-side Graph poller like POST /classify would,
+    minus the HTTP round trip per email."""
+    ruleset = classifier.ruleset
+    fresh = []
+    for email in emails:
+        cache_key = cache.key_for(email, _cache_version(ruleset))
+        if await cache.get(cache_key) is None:
+            fresh.append((email, cache_key))
+    senders = await _lookup_senders([email for email, _ in fresh], ruleset)
+    results = await asyncio.to_thread(
+        lambda: [
+            classifier.classify(email, ruleset=ruleset, sender=sender)
+            for (email, _), sender in zip(fresh, senders)
+        ]
+    )
+    for (email, cache_key), result in zip(fresh, results):
+        await cache.set(cache_key, result)
+        _dispatch(email, result, ruleset.version)
+    logger.info("Classified %d polled emails (%d already known)", len(fresh), len(emails) - len(fresh))
+
+
+@router.post("/classify/batch", response_model=EmailClassifyBatchResponse)
+@timed_endpoint
+async def classify_email_batch(
+    emails: list[Any] = Body(
+        ..., description="List of EmailClassifyRequest objects, classified in order"
+    ),
+):
+    """Classify many emails in one request (e.g. to drain an n8n backlog).
+
+    All emails are evaluated against the same ruleset snapshot. An email that
+    fails validation or classification gets an error entry instead of failing
+    the whole batch.
+    """
+    if len(emails) > settings.CLASSIFY_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(emails)} > {settings.CLASSIFY_BATCH_MAX_SIZE}",
+        )
+    ruleset = classifier.ruleset
+    with phase("parse"):
+        parsed = await asyncio.to_thread(_validate_batch, emails)
+    senders = await _lookup_senders([e for e in parsed if isinstance(e, EmailClassifyRequest)], ruleset)
+    with phase("classify"):
+        results, classified = await asyncio.to_thread(_classify_batch, parsed, iter(senders), ruleset)
+    for email, result in classified:
+        _record(email, result, ruleset.version)
+    failed = sum(1 for item in results if item.error is not None)
+    logger.info("Classified batch: total=%d failed=%d", len(results), failed)
+    return EmailClassifyBatchResponse(results=results, total=len(results), failed=failed)
+
+
+def _validate_batch(emails: list[Any]) -> list[EmailClassifyRequest | str]:
+    """Each email validated, or the error that replaces its result."""
+    parsed: list[EmailClassifyRequest | str] = []
+    for raw in emails:
+        try:
+            parsed.append(EmailClassifyRequest.model_validate(raw))
+        except ValidationError as e:
+            parsed.append(format_validation_error(e))
+    return parsed
+
+
+def _classify_batch(
+    parsed: list[EmailClassifyRequest | str], senders: Iterator[SenderStats | None], ruleset: CompiledRuleset
+) -> tuple[list[EmailClassifyBatchItem], list[tuple[EmailClassifyRequest, EmailClassifyResponse]]]:
+    """Classify the validated emails; senders yields one entry per email in order."""
+    results = []
+    classified = []
+    for index, email in enumerate(parsed):
+        if isinstance(email, str):
+            results.append(EmailClassifyBatchItem(index=index, error=email))
+            continue
+        sender = next(senders)
+        try:
+            # Backlog mail must not evict the live near-duplicate clusters
+            result = classifier.classify(email, ruleset=ruleset, sender=sender, record=False)
+        except Exception as e:
+            logger.exception("Batch item %d failed", index)
+            results.append(EmailClassifyBatchItem(index=index, error=f"Classification failed: {e}"))
+        else:
+            results.append(EmailClassifyBatchItem(index=index, result=result))
+            classified.append((email, result))
+    return results, classified
+
+
+class _NdjsonClassificationResponse(Response):
+    """Streams classification results while the request body is still arriving.
+
+    StreamingResponse cannot be used here: it may consume request messages to
+    watch for disconnects, racing the body reader.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def __init__(self, stream: NdjsonClassificationStream):
+        # Like StreamingResponse: no body attribute, so no Content-Length header
+        self.stream = stream
+        self.status_code = 200
+        self.background = None
+        self.init_headers()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers}
+        )
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                logger.warning("Client disconnected after %d streamed emails", self.stream.processed)
+                return
+            more_body = message.get("more_body", False)
+            output = await self._classify(message.get("body", b""))
+            if output:
+                await send({"type": "http.response.body", "body": output, "more_body": True})
+
+        output = await self._classify(None)
+        summary = self.stream.summary()
+        logger.info(
+            "Classified stream: processed=%d failed=%d rate=%.1f/s",
+            summary["processed"],
+            summary["failed"],
+            summary["emails_per_second"],
+        )
+        await send(
+            {"type": "http.response.body", "body": output + summary_line(summary)}
+        )
+
+    async def _classify(self, chunk: bytes | None) -> bytes:
+        """Parse, look up senders on the event loop, then classify the lines of a chunk."""
+        parsed = await asyncio.to_thread(self.stream.parse, chunk)
+        emails = [line for line in parsed if isinstance(line, EmailClassifyRequest)]
+        if not emails:
+            return self.stream.classify(parsed)
+        found = iter(await _lookup_senders(emails, self.stream.ruleset))
+        senders = [next(found) if isinstance(line, EmailClassifyRequest) else None for line in parsed]
+        return await asyncio.to_thread(self.stream.classify, parsed, senders)
+
+
+@router.post("/classify/stream", response_class=_NdjsonClassificationResponse)
+async def classify_email_stream():
+    """Classify newline-delimited JSON emails and stream NDJSON results back.
+
+    Meant for backfills: the request body is consumed chunk by chunk, so memory
+    stays bounded regardless of input size. Each output line has the shape of
+    an EmailClassifyBatchItem; the last line is a {"summary": ...} object with
+    totals and throughput.
+    """
+    return _NdjsonClassificationResponse(NdjsonClassificationStream(classifier))
+
+
 @router.post("/test-classify", response_model=EmailClassifyResponse)
 async def test_classify_email(email: EmailClassifyRequest):
     """Classify an email in dry-run mode. Logs only, no actions triggered."""
     logger.info("DRY RUN - Classifying email: from=%s subject='%s'", email.from_address, email.subject)
-    result = classifier.classify(email, dry_run=True)
+    # Same sender counters as POST /classify, so sender_seen_count_gte rules can be checked here
+    ruleset = classifier.ruleset
+    sender = await _lookup_sender(email, ruleset)
+    result = classifier.classify(email, dry_run=True, ruleset=ruleset, sender=sender)
     logger.info(
         "DRY RUN - Result: category=%s priority=%s",
         result.category.value,
@@ -48,6 +430,22 @@ async def test_classify_email(email: EmailClassifyRequest):
     return result
 
 
+@router.post("/examples", response_model=EmailExamplesResponse)
+async def add_examples(examples: list[EmailExample]):
+    """Add labeled emails to the nearest-neighbour tier (e.g. corrected classifications).
+
+    Emails that match no rule are labeled like their most similar examples.
+    New examples are used immediately by this worker; they are written to
+    disk periodically, and the other workers pick them up from there.
+    """
+    if classifier.knn is None:
+        raise HTTPException(status_code=409, detail="Nearest-neighbour tier is disabled (KNN_ENABLED)")
+    for example in examples:
+        classifier.knn.add(example.email, example.category, example.priority, example.actions)
+    logger.info("Added %d labeled examples (%d total)", len(examples), len(classifier.knn))
+    return EmailExamplesResponse(added=len(examples), total=len(classifier.knn))
+
+
 @router.get("/rules", response_model=EmailRulesResponse)
 async def get_rules():
     """Return the current email classification rules (for debugging/transparency)."""
@@ -55,5 +453,29 @@ async def get_rules():
     return EmailRulesResponse(
         rules=rules,
         total=len(rules),
-        source="config_file",
+        source=classifier.ruleset.source,
     )
+
+
+@router.get("/rules/stats", response_model=EmailRuleStatsResponse)
+async def get_rule_stats():
+    """Per-rule and per-condition evaluation counts, match counts and timings.
+
+    Counters are only recorded while profiling is enabled (PUT /rules/stats/profiling).
+    """
+    return classifier.profiler.snapshot(classifier.ruleset)
+
+
+@router.put("/rules/stats/profiling", response_model=EmailRuleStatsResponse)
+async def set_rule_profiling(request: EmailRuleProfilingRequest):
+    """Turn rule profiling on or off. Existing counters are kept."""
+    classifier.profiler.enabled = request.enabled
+    logger.info("Rule profiling %s", "enabled" if request.enabled else "disabled")
+    return classifier.profiler.snapshot(classifier.ruleset)
+
+
+@router.delete("/rules/stats", response_model=EmailRuleStatsResponse)
+async def reset_rule_stats():
+    """Reset all rule profiling counters."""
+    classifier.profiler.reset(classifier.ruleset.version)
+    return classifier.profiler.snapshot(classifier.ruleset)
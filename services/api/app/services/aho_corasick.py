@@ -0,0 +1,113 @@
+from collections import deque
+from typing import Generic, Hashable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T", bound=Hashable)
+
+
+class AhoCorasick(Generic[T]):
+    """Multi-pattern substring matcher.
+
+    Every pattern carries a payload; scanning a text yields the payload of each
+    occurrence in a single pass, independent of how many patterns are loaded.
+    Matching is exact – callers lowercase patterns and text themselves.
+    """
+
+    __slots__ = ("_goto", "_fail", "_out", "_always", "pattern_count")
+
+    def __init__(self, patterns: Iterable[tuple[str, T]]):
+        goto: list[dict[str, int]] = [{}]
+        out: list[list[T]] = [[]]
+        always: list[T] = []
+        count = 0
+
+        for pattern, payload in patterns:
+            count += 1
+            if not pattern:
+                # The empty string is contained in every text
+                always.append(payload)
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append(payload)
+
+        # Breadth-first construction of failure links; a node's outputs include
+        # those of its failure target, which is always shallower.
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt].extend(out[fail[nxt]])
+
+        self._goto = goto
+        self._fail = fail
+        self._out = [tuple(o) for o in out]
+        self._always = tuple(always)
+        self.pattern_count = count
+
+    def iter_matches(self, text: str) -> Iterator[T]:
+        """Yield the payload of every pattern occurrence in text."""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+
+        yield from self._always
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield from out[node]
+
+    def stream(self) -> "AhoCorasickStream[T]":
+        """A scanner for text that arrives in pieces."""
+        return AhoCorasickStream(self)
+
+
+class AhoCorasickStream(Generic[T]):
+    """Scans a text fed in chunks, as if it were one string.
+
+    The automaton state carries over between chunks, so an occurrence split
+    across a chunk boundary is found without keeping any earlier text.
+    """
+
+    __slots__ = ("automaton", "node", "_started")
+
+    def __init__(self, automaton: AhoCorasick[T]):
+        self.automaton = automaton
+        self.node = 0
+        self._started = False
+
+    def feed(self, text: str) -> list[T]:
+        """Payloads of the occurrences that end in this chunk."""
+        automaton = self.automaton
+        goto = automaton._goto
+        fail = automaton._fail
+        out = automaton._out
+
+        matches: list[T] = []
+        if not self._started:
+            matches.extend(automaton._always)
+            self._started = True
+        node = self.node
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                matches.extend(out[node])
+        self.node = node
+        return matches
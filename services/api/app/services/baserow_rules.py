@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import httpx
+
+from app.metrics import RULES_FETCHES
+from app.services.email_classifier import file_signature
+from app.services.ruleset import CompiledRuleset, RulesetError, compile_ruleset, ruleset_version
+
+if TYPE_CHECKING:
+    from app.services.email_classifier import EmailClassifier
+
+logger = logging.getLogger(__name__)
+
+SOURCE = "baserow"
+SNAPSHOT_SOURCE = "baserow_snapshot"
+PAGE_SIZE = 200
+
+
+class BaserowError(Exception):
+    """Raised when the rules table cannot be fetched."""
+
+
+def row_to_rule(row: dict) -> dict | None:
+    """Map a Baserow row to a rules-file entry; None for rows switched off.
+
+    Expected columns: name, category, priority, actions, conditions (JSON
+    text with match_type and rules), optional description and active.
+    Select fields arrive as {"value": ...} objects, text fields as strings.
+    """
+    if row.get("active") is False:
+        return None
+    conditions = row.get("conditions") or "{}"
+    if isinstance(conditions, str):
+        try:
+            conditions = json.loads(conditions)
+        except json.JSONDecodeError as e:
+            raise RulesetError(f"Row {row.get('id')}: conditions are not valid JSON: {e}") from e
+    actions = row.get("actions") or []
+    if isinstance(actions, str):
+        actions = [a.strip() for a in actions.split(",") if a.strip()]
+    return {
+        "name": _select_value(row.get("name")),
+        "category": _select_value(row.get("category")),
+        "priority": _select_value(row.get("priority")),
+        "actions": [_select_value(a) for a in actions],
+        "conditions": conditions,
+        "description": _select_value(row.get("description")) or "",
+    }
+
+
+def _select_value(value):
+    return value.get("value") if isinstance(value, dict) else value
+
+
+def document_version(document: dict) -> str:
+    """Content hash of a rules document, independent of key order and whitespace."""
+    return ruleset_version(json.dumps(document, sort_keys=True, separators=(",", ":")).encode())
+
+
+class BaserowRuleProvider:
+    """Keeps the classifier's rules in sync with a Baserow table.
+
+    A background task pages through the table every `interval` seconds and
+    publishes a new compiled snapshot only when the content changed, so
+    classification never waits for Baserow. Every published snapshot is
+    also written to `snapshot_path`; on start it is published before the
+    first fetch, so a restart while Baserow is down keeps the last good
+    rules. Until either exists, the classifier keeps the rules file.
+    """
+
+    def __init__(
+        self,
+        classifier: "EmailClassifier",
+        http: httpx.AsyncClient,
+        base_url: str,
+        token: str,
+        table_id: int,
+        snapshot_path: str | Path,
+        interval: float = 60.0,
+    ):
+        self.classifier = classifier
+        self.http = http
+        self.url = f"{base_url.rstrip('/')}/api/database/rows/table/{table_id}/"
+        self.token = token
+        self.snapshot_path = Path(snapshot_path)
+        self.interval = interval
+        self._etag: str | None = None
+        # Document hash and values_file signatures the active Baserow ruleset was compiled from.
+        # Its version cannot be compared instead: it also covers the values_file contents.
+        self._compiled_from: tuple[str, tuple] | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        # Compiling reads values files and publishing waits for the snapshot lock
+        await asyncio.to_thread(self.load_snapshot)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.http.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Refreshing rules from Baserow failed")
+            await asyncio.sleep(self.interval)
+
+    def load_snapshot(self) -> bool:
+        """Publish the snapshot saved by an earlier run. Returns True if published."""
+        try:
+            document = json.loads(self.snapshot_path.read_bytes())
+            ruleset = self._compile(document, SNAPSHOT_SOURCE)
+        except FileNotFoundError:
+            return False
+        except (OSError, json.JSONDecodeError, RulesetError) as e:
+            logger.error("Ignoring Baserow rules snapshot %s: %s", self.snapshot_path, e)
+            return False
+        return self.classifier.publish(ruleset)
+
+    async def refresh(self) -> bool:
+        """Fetch the table and publish it if it changed. Returns True if published."""
+        try:
+            rows = await self._fetch_rows()
+        except (httpx.HTTPError, BaserowError, ValueError) as e:
+            RULES_FETCHES.labels(result="failed").inc()
+            logger.warning(
+                "Could not fetch rules from Baserow, keeping ruleset %s: %s", self.classifier.ruleset.version, e
+            )
+            return False
+        if rows is None:
+            RULES_FETCHES.labels(result="unchanged").inc()
+            return False
+
+        try:
+            rules = [rule for rule in map(row_to_rule, rows) if rule is not None]
+            document = {"rules": rules}
+            ruleset = await asyncio.to_thread(self._compile_if_changed, document)
+        except RulesetError as e:
+            RULES_FETCHES.labels(result="rejected").inc()
+            logger.error("Baserow rules rejected, keeping ruleset %s: %s", self.classifier.ruleset.version, e)
+            return False
+        if ruleset is None:
+            RULES_FETCHES.labels(result="unchanged").inc()
+            return False
+
+        RULES_FETCHES.labels(result="loaded").inc()
+        published = await asyncio.to_thread(self.classifier.publish, ruleset)
+        self._compiled_from = self._origin(document, ruleset)
+        try:
+            await asyncio.to_thread(self._save_snapshot, document)
+        except OSError as e:
+            logger.error("Could not save Baserow rules snapshot %s: %s", self.snapshot_path, e)
+        return published
+
+    async def _fetch_rows(self) -> list[dict] | None:
+        """All rows in table order, or None if the server reports no change."""
+        headers = {"Authorization": f"Token {self.token}"}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        response = await self.http.get(
+            self.url, params={"user_field_names": "true", "size": PAGE_SIZE}, headers=headers
+        )
+        if response.status_code == 304:
+            return None
+        etag = response.headers.get("ETag")
+
+        rows: list[dict] = []
+        headers.pop("If-None-Match", None)
+        while True:
+            if response.status_code != 200:
+                raise BaserowError(f"Baserow answered {response.status_code}: {response.text[:200]}")
+            page = response.json()
+            rows.extend(page.get("results", []))
+            next_url = page.get("next")
+            if not next_url:
+                break
+            response = await self.http.get(next_url, headers=headers)
+        self._etag = etag
+        return rows
+
+    def _compile_if_changed(self, document: dict) -> CompiledRuleset | None:
+        """The compiled document, or None if the active ruleset came from the same one."""
+        current = self.classifier.ruleset
+        if current.source == SOURCE and self._compiled_from == self._origin(document, current):
+            return None
+        return self._compile(document, SOURCE)
+
+    def _compile(self, document: dict, source: str) -> CompiledRuleset:
+        return compile_ruleset(
+            document,
+            version=document_version({"rules": document.get("rules", [])}),
+            base_dir=self.classifier.rules_path.parent,
+            source=source,
+        )
+
+    @staticmethod
+    def _origin(document: dict, ruleset: CompiledRuleset) -> tuple[str, tuple]:
+        return document_version(document), tuple(map(file_signature, ruleset.value_files))
+
+    def _save_snapshot(self, document: dict) -> None:
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.snapshot_path.with_name(f".{self.snapshot_path.name}.tmp")
+        tmp.write_text(json.dumps(document, indent=2, ensure_ascii=False))
+        os.replace(tmp, self.snapshot_path)
@@ -0,0 +1,282 @@
+import codecs
+import html
+import re
+from typing import TYPE_CHECKING, Iterator
+
+from app.services.aho_corasick import AhoCorasick
+
+if TYPE_CHECKING:
+    from app.services.ruleset import CompiledCondition, CompiledRule, EmailContext
+
+# Rule field for the full email body. Only keyword conditions may use it:
+# they are answered from a streaming scan instead of the whole body in memory.
+BODY_FIELD = "body"
+
+# Characters handed to the scanner at a time when the body is already a string
+CHUNK_CHARS = 64 * 1024
+# Bodies are scanned up to this many characters of text; the rest is ignored
+MAX_SCAN_CHARS = 8 * 1024 * 1024
+# Longest tag or entity held back while waiting for its end; longer ones are dropped
+MAX_MARKUP_CHARS = 4096
+
+# Tags whose start or end separates words ("<p>Rechnung</p><p>fällig")
+_BLOCK_TAGS = frozenset(
+    "address article blockquote br dd div dl dt footer h1 h2 h3 h4 h5 h6 header hr li ol p pre "
+    "section table tbody td tfoot th thead tr ul".split()
+)
+_TAG_NAME_RE = re.compile(r"\s*(/?)\s*([a-zA-Z][a-zA-Z0-9]*)")
+_SKIP_END_RE = {
+    "-->": re.compile(r"-->"),
+    "script": re.compile(r"</script", re.IGNORECASE),
+    "style": re.compile(r"</style", re.IGNORECASE),
+    ">": re.compile(r">"),
+}
+# Length of the longest end marker minus one: a marker split across chunks is
+# found if this many characters are kept
+_SKIP_CARRY = {"-->": 2, "script": 7, "style": 6, ">": 0}
+_PARTIAL_ENTITY_RE = re.compile(r"&#?[a-zA-Z0-9]{0,31}$")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class HtmlTextStream:
+    """Turns HTML fed in chunks into text: tags, comments, <script> and <style>
+    contents are dropped and entities decoded.
+
+    Only an unfinished tag or entity at the end of a chunk is held back, and
+    at most MAX_MARKUP_CHARS of it, so memory does not grow with the input.
+    """
+
+    def __init__(self):
+        self._carry = ""
+        self._skip: str | None = None  # key of _SKIP_END_RE while inside a skipped section
+
+    def feed(self, text: str) -> str:
+        text = self._carry + text
+        self._carry = ""
+        out: list[str] = []
+        pos = 0
+        n = len(text)
+        while pos < n:
+            if self._skip is not None:
+                found = _SKIP_END_RE[self._skip].search(text, pos)
+                if found is None:
+                    keep = _SKIP_CARRY[self._skip]
+                    self._carry = text[max(pos, n - keep) :] if keep else ""
+                    return "".join(out)
+                # After "</script" the rest of the end tag still has to go
+                self._skip = ">" if self._skip in ("script", "style") else None
+                pos = found.end()
+                continue
+
+            lt = text.find("<", pos)
+            if lt == -1:
+                out.append(self._text(text[pos:], final=False))
+                break
+            out.append(self._text(text[pos:lt], final=True))
+            pos = self._markup(text, lt, out)
+            if pos < 0:
+                break
+        return "".join(out)
+
+    def close(self) -> str:
+        """Text still held back at the end of the document."""
+        carry, self._carry = self._carry, ""
+        return html.unescape(carry) if self._skip is None and not carry.startswith("<") else ""
+
+    def _text(self, segment: str, final: bool) -> str:
+        if not final:
+            partial = _PARTIAL_ENTITY_RE.search(segment)
+            if partial is not None:
+                self._carry = segment[partial.start() :]
+                segment = segment[: partial.start()]
+        return html.unescape(segment) if "&" in segment else segment
+
+    def _markup(self, text: str, lt: int, out: list[str]) -> int:
+        """Handle the markup starting at text[lt]. Returns where text continues,
+        or -1 when the rest of the chunk was held back or dropped."""
+        n = len(text)
+        if text.startswith("<!--", lt):
+            self._skip = "-->"
+            return lt + 4
+        if n - lt < 4 and "<!--".startswith(text[lt:]):
+            self._carry = text[lt:]
+            return -1
+        if lt + 1 < n and not (text[lt + 1].isalpha() or text[lt + 1] in "/!?"):
+            out.append("<")  # "a < b" is text
+            return lt + 1
+        gt = text.find(">", lt + 1)
+        if gt == -1:
+            if n - lt > MAX_MARKUP_CHARS:
+                self._skip = ">"
+                out.append(" ")
+            else:
+                self._carry = text[lt:]
+            return -1
+
+        tag = _TAG_NAME_RE.match(text, lt + 1, gt)
+        if tag is not None:
+            name = tag.group(2).lower()
+            if not tag.group(1) and name in ("script", "style"):
+                self._skip = name
+            elif name in _BLOCK_TAGS:
+                out.append(" ")
+        return gt + 1
+
+
+class BodyStream:
+    """Keyword hits of an email body fed in chunks, in fixed memory.
+
+    Chunks may be bytes (decoded as UTF-8, also when a character is split
+    between chunks) or str. Whitespace runs count as one space, so a phrase
+    broken across lines still matches. Scanning stops after max_chars.
+    """
+
+    def __init__(
+        self,
+        automaton: AhoCorasick[tuple[tuple[int, int], int]] | None,
+        html_body: bool = False,
+        max_chars: int = MAX_SCAN_CHARS,
+    ):
+        self.hits: dict[tuple[int, int], int] = {}
+        self.chars = 0
+        self.max_chars = max_chars
+        self.truncated = False
+        self._matcher = automaton.stream() if automaton is not None else None
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._html = HtmlTextStream() if html_body else None
+        self._space = True  # last scanned character was whitespace
+
+    @property
+    def done(self) -> bool:
+        return self._matcher is None or self.truncated
+
+    def feed(self, chunk: str | bytes) -> bool:
+        """Scan the next part of the body. Returns True if it found a new keyword."""
+        if self.done:
+            return False
+        text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        if self._html is not None:
+            text = self._html.feed(text)
+        return self._scan(text)
+
+    def close(self) -> bool:
+        """Scan what decoder and HTML stripper still hold. Returns True on a new keyword."""
+        if self.done:
+            return False
+        text = self._decoder.decode(b"", final=True)
+        if self._html is not None:
+            text = self._html.feed(text) + self._html.close()
+        return self._scan(text)
+
+    def _scan(self, text: str) -> bool:
+        text = _WHITESPACE_RE.sub(" ", text)
+        if self._space and text.startswith(" "):
+            text = text[1:]
+        if not text:
+            return False
+        remaining = self.max_chars - self.chars
+        if len(text) >= remaining:
+            text = text[:remaining]
+            self.truncated = True
+        self.chars += len(text)
+        self._space = text.endswith(" ")
+
+        hits = self.hits
+        found = False
+        for key, value_index in self._matcher.feed(text.lower()):
+            previous = hits.get(key)
+            if previous is None:
+                found = True
+            if previous is None or value_index < previous:
+                hits[key] = value_index
+        return found
+
+
+def iter_chunks(text: str, size: int = CHUNK_CHARS) -> Iterator[str]:
+    for start in range(0, len(text), size):
+        yield text[start : start + size]
+
+
+def body_hits(
+    automaton: AhoCorasick[tuple[tuple[int, int], int]] | None, text: str, html_body: bool
+) -> dict[tuple[int, int], int]:
+    """Keyword hits of a whole body held as a string, scanned chunk by chunk."""
+    stream = BodyStream(automaton, html_body)
+    for chunk in iter_chunks(text):
+        stream.feed(chunk)
+        if stream.done:
+            break
+    stream.close()
+    return stream.hits
+
+
+class BodyScan:
+    """Reads an email body only as far as needed to know the first matching rule.
+
+    Before each chunk, rules are evaluated in order with body conditions
+    three-valued: a keyword seen so far makes contains_any true and
+    not_contains_any false for good, anything else is still unknown. Once the
+    first rule that is not certainly false is certainly true (or every rule is
+    certainly false), the rest of the body cannot change the outcome and
+    scanning stops. close() hands the hits to the context for the regular
+    first-match evaluation, which then reaches the same rule.
+    """
+
+    def __init__(self, ctx: "EmailContext", html_body: bool = False, max_chars: int = MAX_SCAN_CHARS):
+        self.ctx = ctx
+        self.stream = BodyStream(ctx.ruleset.automata.get(BODY_FIELD), html_body, max_chars)
+        self.decided = self._decide()
+
+    def feed(self, chunk: str | bytes) -> bool:
+        """Scan the next part of the body. Returns True once the outcome is decided."""
+        if not self.decided:
+            if self.stream.feed(chunk):
+                self.decided = self._decide()
+            if self.stream.done:
+                self.decided = True
+        return self.decided
+
+    def close(self) -> None:
+        if not self.decided:
+            self.stream.close()
+        self.decided = True
+        self.ctx.set_keyword_hits(BODY_FIELD, self.stream.hits)
+
+    def _decide(self) -> bool:
+        for rule in self.ctx.ruleset.rule_index.candidates(self.ctx):
+            state = self._rule_state(rule)
+            if state is None:
+                return False
+            if state:
+                return True
+        return True
+
+    def _rule_state(self, rule: "CompiledRule") -> bool | None:
+        if not rule.conditions:
+            return False
+        unknown = False
+        for cond in rule.conditions:
+            state = self._condition_state(cond)
+            if state is None:
+                unknown = True
+            elif state != rule.match_all:
+                # A false condition decides an "all" rule, a true one an "any" rule
+                return state
+        return None if unknown else rule.match_all
+
+    def _condition_state(self, cond: "CompiledCondition") -> bool | None:
+        if cond.field != BODY_FIELD:
+            return cond.match(self.ctx)[0]
+        if cond.key in self.stream.hits:
+            return cond.operator == "contains_any"
+        return None
+
+
+def scan_body(ctx: "EmailContext", text: str, html_body: bool) -> BodyScan:
+    """Scan a body held as a string until the first matching rule is decided."""
+    scan = BodyScan(ctx, html_body)
+    for chunk in iter_chunks(text):
+        if scan.feed(chunk):
+            break
+    scan.close()
+    return scan
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.models.email import EmailCategory, EmailClassifyRequest, EmailPriority
+from app.services.knn_index import CATEGORIES, PRIORITIES, KnnIndex
+from app.services.vectorizer import HashingVectorizer
+
+UNCATEGORIZED = CATEGORIES.index(EmailCategory.UNCATEGORIZED)
+MEDIUM = PRIORITIES.index(EmailPriority.MEDIUM)
+
+
+@dataclass
+class BatchScores:
+    """Per-email results as parallel arrays.
+
+    categories and priorities hold indexes into CATEGORIES / PRIORITIES
+    (the order of EmailCategory / EmailPriority); confidence is the cosine
+    similarity to the chosen category's centroid.
+    """
+
+    categories: np.ndarray
+    priorities: np.ndarray
+    confidence: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def category(self, i: int) -> EmailCategory:
+        return CATEGORIES[self.categories[i]]
+
+    def priority(self, i: int) -> EmailPriority:
+        return PRIORITIES[self.priorities[i]]
+
+
+class CentroidScorer:
+    """Scores many emails at once against one centroid per category.
+
+    Centroids are the normalised means of labeled example vectors, so a whole
+    batch is scored with one (n, dim) x (dim, categories) matrix product.
+    Categories without examples never win; emails whose best similarity is
+    below min_similarity are uncategorized. Each category's priority is the
+    one most of its examples carry.
+    """
+
+    def __init__(self, vectorizer: HashingVectorizer, min_similarity: float = 0.3):
+        self.vectorizer = vectorizer
+        self.min_similarity = min_similarity
+        self.centroids = np.zeros((len(CATEGORIES), vectorizer.dim), dtype=np.float32)
+        self.category_priorities = np.full(len(CATEGORIES), MEDIUM, dtype=np.int16)
+        self.example_counts = np.zeros(len(CATEGORIES), dtype=np.int64)
+
+    @classmethod
+    def from_index(cls, index: KnnIndex, min_similarity: float = 0.3) -> "CentroidScorer":
+        scorer = cls(index.vectorizer, min_similarity)
+        vectors, labels = index.examples()
+        scorer.fit(vectors, labels[:, 0], labels[:, 1])
+        return scorer
+
+    def fit(self, vectors: np.ndarray, categories: np.ndarray, priorities: np.ndarray) -> "CentroidScorer":
+        categories = np.asarray(categories, dtype=np.int64)
+        priorities = np.asarray(priorities, dtype=np.int64)
+        sums = np.zeros_like(self.centroids)
+        np.add.at(sums, categories, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        self.centroids = np.divide(sums, norms, out=np.zeros_like(sums), where=norms > 0)
+        self.example_counts = np.bincount(categories, minlength=len(CATEGORIES))
+
+        pairs = np.zeros((len(CATEGORIES), len(PRIORITIES)), dtype=np.int64)
+        np.add.at(pairs, (categories, priorities), 1)
+        self.category_priorities = np.where(
+            self.example_counts > 0, pairs.argmax(axis=1), MEDIUM
+        ).astype(np.int16)
+        return self
+
+    def score_vectors(self, vectors: np.ndarray) -> BatchScores:
+        similarities = vectors @ self.centroids.T
+        similarities[:, self.example_counts == 0] = -np.inf
+        best = similarities.argmax(axis=1)
+        confidence = similarities[np.arange(len(best)), best]
+
+        unknown = ~(confidence >= self.min_similarity)
+        categories = np.where(unknown, UNCATEGORIZED, best).astype(np.int16)
+        priorities = np.where(unknown, MEDIUM, self.category_priorities[best]).astype(np.int16)
+        confidence = np.where(unknown, 0.0, np.clip(confidence, 0.0, 1.0)).astype(np.float32)
+        return BatchScores(categories, priorities, confidence)
+
+    def score(self, emails: list[EmailClassifyRequest]) -> BatchScores:
+        return self.score_vectors(self.vectorizer.transform(emails))
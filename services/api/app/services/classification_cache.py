@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import time
+
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.metrics import CACHE_REQUESTS
+from app.models.email import EmailClassifyRequest, EmailClassifyResponse
+
+logger = logging.getLogger(__name__)
+
+
+class ClassificationCache:
+    """Redis-backed store of classification results, so repeated deliveries of
+    the same email return the original answer instead of being re-evaluated.
+
+    Keys combine the ruleset version with the Graph message_id (or a content
+    fingerprint when no id is sent), so a rules change naturally invalidates
+    old entries. Redis errors never fail a request: the cache reports a miss
+    and stays out of the way for a short backoff period.
+    """
+
+    def __init__(
+        self,
+        client: Redis | None = None,
+        ttl_seconds: int = 86400,
+        prefix: str = "lm:classify",
+        backoff_seconds: float = 30.0,
+    ):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.backoff_seconds = backoff_seconds
+        self._unavailable_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None and time.monotonic() >= self._unavailable_until
+
+    def key_for(self, email: EmailClassifyRequest, ruleset_version: str) -> str:
+        if email.message_id:
+            identity = f"msg:{email.account.value}:{email.message_id}"
+        else:
+            identity = f"fp:{fingerprint(email)}"
+        return f"{self.prefix}:{ruleset_version}:{identity}"
+
+    async def get(self, key: str) -> EmailClassifyResponse | None:
+        if not self.enabled:
+            return None
+        try:
+            raw = await self.client.get(key)
+        except RedisError as e:
+            CACHE_REQUESTS.labels(cache="classification", result="error").inc()
+            self._back_off(e)
+            return None
+        if raw is None:
+            CACHE_REQUESTS.labels(cache="classification", result="miss").inc()
+            return None
+        try:
+            response = EmailClassifyResponse.model_validate_json(raw)
+        except ValidationError:
+            # Written by an older API version with a different response shape
+            CACHE_REQUESTS.labels(cache="classification", result="miss").inc()
+            return None
+        CACHE_REQUESTS.labels(cache="classification", result="hit").inc()
+        return response.model_copy(update={"cached": True})
+
+    async def set(self, key: str, response: EmailClassifyResponse) -> None:
+        if not self.enabled:
+            return
+        try:
+            await self.client.set(key, response.model_dump_json(), ex=self.ttl_seconds)
+        except RedisError as e:
+            self._back_off(e)
+
+    def _back_off(self, error: Exception) -> None:
+        logger.warning(
+            "Classification cache unavailable, bypassing for %.0fs: %s", self.backoff_seconds, error
+        )
+        self._unavailable_until = time.monotonic() + self.backoff_seconds
+
+
+def fingerprint(email: EmailClassifyRequest) -> str:
+    """Stable hash of the fields that identify an email when no message_id is available."""
+    parts = (
+        email.account.value,
+        email.from_address.lower(),
+        email.subject,
+        email.body_preview,
+        email.received_at.isoformat() if email.received_at else "",
+    )
+    if email.body:
+        # Only when given, so keys of emails without a body stay as they were
+        parts += (email.body,)
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()[:32]
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Protocol
+
+from psycopg2.extras import execute_values
+
+from app.connections import PostgresPool
+from app.metrics import PERSISTENCE_FLUSH_DURATION, PERSISTENCE_ROWS
+from app.models.email import EmailClassifyRequest, EmailClassifyResponse
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS email_classifications (
+    id BIGSERIAL PRIMARY KEY,
+    classified_at TIMESTAMPTZ NOT NULL,
+    message_id TEXT NOT NULL,
+    account TEXT NOT NULL,
+    from_address TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    received_at TIMESTAMPTZ,
+    category TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    actions TEXT[] NOT NULL,
+    confidence REAL NOT NULL,
+    tier_used SMALLINT NOT NULL,
+    reasoning TEXT NOT NULL,
+    ruleset_version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS email_classifications_message_id_idx ON email_classifications (message_id);
+CREATE INDEX IF NOT EXISTS email_classifications_classified_at_idx ON email_classifications (classified_at);
+"""
+
+INSERT_SQL = """
+INSERT INTO email_classifications (
+    classified_at, message_id, account, from_address, subject, received_at,
+    category, priority, actions, confidence, tier_used, reasoning, ruleset_version
+) VALUES %s
+"""
+
+Row = tuple
+
+
+class ClassificationSink(Protocol):
+    async def write(self, rows: list[Row]) -> None: ...
+
+    async def close(self) -> None: ...
+
+
+class PostgresClassificationSink:
+    """Writes rows with one multi-row INSERT per batch on a pooled connection."""
+
+    def __init__(self, pool: PostgresPool):
+        self.pool = pool
+        self._schema_ready = False
+
+    async def write(self, rows: list[Row]) -> None:
+        if not self._schema_ready:
+            await self.pool.run(_create_table)
+            self._schema_ready = True
+        await self.pool.run(_insert_rows, rows)
+
+    async def close(self) -> None:
+        # Connections belong to the shared pool, which is drained separately
+        pass
+
+
+def _create_table(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(CREATE_TABLE_SQL)
+    conn.commit()
+
+
+def _insert_rows(conn, rows: list[Row]) -> None:
+    with conn.cursor() as cur:
+        execute_values(cur, INSERT_SQL, rows, page_size=len(rows))
+    conn.commit()
+
+
+def to_row(email: EmailClassifyRequest, result: EmailClassifyResponse, ruleset_version: str) -> Row:
+    return (
+        datetime.now(timezone.utc),
+        email.message_id,
+        email.account.value,
+        email.from_address,
+        email.subject,
+        email.received_at,
+        result.category.value,
+        result.priority.value,
+        [a.value for a in result.actions],
+        result.confidence,
+        result.tier_used,
+        result.reasoning,
+        ruleset_version,
+    )
+
+
+class ClassificationWriter:
+    """Buffers classification results in memory and flushes them to a sink in bulk.
+
+    submit() never blocks: rows are appended to a bounded buffer and a
+    background task flushes when batch_size rows are pending or every
+    flush_interval seconds. When the buffer is full (e.g. Postgres is down
+    for a while) new rows are dropped and counted rather than slowing
+    down requests. stop() flushes whatever is still buffered.
+    """
+
+    def __init__(
+        self,
+        sink: ClassificationSink | None = None,
+        batch_size: int = 500,
+        flush_interval: float = 2.0,
+        max_pending: int = 20000,
+        max_retries: int = 3,
+    ):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._pending: deque[Row] = deque()
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._closing = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def submit(self, email: EmailClassifyRequest, result: EmailClassifyResponse, ruleset_version: str) -> bool:
+        """Queue a result for persistence. Returns False if it was dropped."""
+        if not self.running or self._closing:
+            return False
+        if len(self._pending) >= self.max_pending:
+            PERSISTENCE_ROWS.labels(result="dropped").inc()
+            return False
+        self._pending.append(to_row(email, result, ruleset_version))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def start(self) -> None:
+        if self.sink is None:
+            raise RuntimeError("ClassificationWriter needs a sink before it can start")
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still buffered, then stop the background task."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self.sink is not None:
+            await self.sink.close()
+
+    async def _run(self) -> None:
+        while True:
+            if len(self._pending) < self.batch_size and not self._closing:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                await self._flush(batch)
+                if len(self._pending) < self.batch_size and not self._closing:
+                    break
+
+            if self._closing and not self._pending:
+                return
+
+    async def _flush(self, batch: list[Row]) -> None:
+        for attempt in range(1, self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                await self.sink.write(batch)
+            except Exception as e:
+                logger.warning(
+                    "Persisting %d classifications failed (attempt %d/%d): %s",
+                    len(batch),
+                    attempt,
+                    self.max_retries,
+                    e,
+                )
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(2 ** (attempt - 1), self.flush_interval * 5))
+                continue
+            PERSISTENCE_FLUSH_DURATION.observe(time.perf_counter() - started)
+            PERSISTENCE_ROWS.labels(result="written").inc(len(batch))
+            return
+
+        logger.error("Dropping %d classifications after %d failed attempts", len(batch), self.max_retries)
+        PERSISTENCE_ROWS.labels(result="dropped").inc(len(batch))
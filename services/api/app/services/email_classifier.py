@@ -1,9 +1,19 @@
-import json
+import asyncio
 import logging
+import time
 from pathlib import Path
+from typing import Callable
+
+from app.metrics import (
+    CLASSIFICATION_DURATION,
+    CLASSIFICATIONS,
+    RULES_LOAD_DURATION,
+    RULES_RELOADS,
+)
 
 from app.models.email import (
     EmailAction,
+    EmailBodyType,
     EmailCategory,
     EmailClassifyRequest,
     EmailClassifyResponse,
@@ -11,14 +21,41 @@ from app.models.email import (
     EmailRule,
     EmailSummary,
 )
+from app.services.body_scan import BodyScan, scan_body
+from app.services.knn_index import KnnIndex
+from app.services.near_duplicates import NearDuplicateIndex
+from app.services.rule_stats import RuleProfiler
+from app.services.ruleset_snapshot import RulesetSnapshotStore, SnapshotMeta
+from app.services.sender_history import SenderHistory, SenderStats
+from app.services.ruleset import (
+    CompiledCondition,
+    CompiledRule,
+    CompiledRuleset,
+    EmailContext,
+    FILE_SOURCE,
+    RulesetError,
+    parse_ruleset,
+    ruleset_version,
+)
 
 logger = logging.getLogger(__name__)
 
+# File signature recorded while the rules file is absent, so the error is logged once
+_MISSING = (-1, -1)
+
 
 class EmailClassifier:
     """Tier 1: Rule-based email classifier using configurable rules."""
 
-    def __init__(self, rules_path: str | Path | None = None):
+    def __init__(
+        self,
+        rules_path: str | Path | None = None,
+        near_duplicates: NearDuplicateIndex | None = None,
+        knn: KnnIndex | None = None,
+        snapshots: RulesetSnapshotStore | None = None,
+        sender_history: SenderHistory | None = None,
+        keep_published: bool = False,
+    ):
         if rules_path is None:
             # Default: look for config relative to project root
             rules_path = Path("/app/config/email_rules.json")
@@ -30,60 +67,259 @@ class EmailClassifier:
                     / "email_rules.json"
                 )
         self.rules_path = Path(rules_path)
-        self._rules: list[dict] | None = None
+        self.profiler = RuleProfiler()
+        self.near_duplicates = near_duplicates
+        self.knn = knn
+        self.snapshots = snapshots
+        # Adopt stored rulesets published from elsewhere (Baserow) while the rules file is unchanged
+        self.keep_published = keep_published
+        self.sender_history = sender_history
+        self._unusable_revision: int | None = None
+        self._ruleset = CompiledRuleset.empty()
+        self._file_signature: tuple | None = None
+        self.reload_if_changed()
+
+    @property
+    def ruleset(self) -> CompiledRuleset:
+        """The currently active compiled ruleset (swapped atomically on reload)."""
+        return self._ruleset
+
+    def reload_if_changed(self) -> bool:
+        """Recompile the rules if the file, or a values_file it references,
+        changed on disk. Returns True if swapped.
+
+        A file that fails to parse or validate is logged and ignored, so the
+        last good ruleset stays active. With a snapshot store, a ruleset a
+        sibling worker already compiled for the same files is loaded instead.
+        """
+        if self.snapshots is not None:
+            try:
+                return self._sync_snapshot()
+            except OSError as e:
+                logger.error("Ruleset snapshot store %s unusable, compiling locally: %s", self.snapshots.directory, e)
+        return self._reload_file()
+
+    def _sync_snapshot(self) -> bool:
+        swapped = self._load_snapshot(self.snapshots.meta())
+        if swapped is not None:
+            return swapped
+        # The store is behind the files on disk: one worker compiles, the
+        # others wait for the lock and then load its result
+        with self.snapshots.lock():
+            meta = self.snapshots.meta()
+            swapped = self._load_snapshot(meta)
+            if swapped is not None:
+                return swapped
+            swapped = self._reload_file()
+            self._ruleset = self.snapshots.publish(
+                self._ruleset,
+                self._signatures(self._ruleset.value_files),
+                replace=meta is not None and meta.revision == self._unusable_revision,
+            )
+            return swapped
+
+    def _load_snapshot(self, meta: SnapshotMeta | None) -> bool | None:
+        """Adopt the stored snapshot if it matches the files on disk.
+
+        Returns whether the active ruleset changed, or None if the store has
+        no usable snapshot for the current files.
+        """
+        if meta is None or meta.signature is None or meta.signature != self._signatures(meta.value_files):
+            return None
+        if meta.source != FILE_SOURCE and not self.keep_published:
+            return None
+        if meta.revision == self._ruleset.revision and meta.version == self._ruleset.version:
+            return False
+        try:
+            ruleset = self.snapshots.load(meta)
+        except Exception as e:
+            # e.g. pickled by an older release of this code
+            logger.warning("Ruleset snapshot revision %d unusable, recompiling: %s", meta.revision, e)
+            self._unusable_revision = meta.revision
+            return None
+        self._ruleset = ruleset
+        self._file_signature = meta.signature
+        RULES_RELOADS.labels(result="loaded").inc()
+        logger.info("Loaded ruleset %s revision %d from snapshot", ruleset.version, ruleset.revision)
+        return True
 
-    def _load_rules(self) -> list[dict]:
-        """Load rules from config file. Reloads on every call for hot-reload."""
+    def _signatures(self, value_files: tuple[Path, ...]) -> tuple[tuple[int, int], ...]:
+        return (file_signature(self.rules_path), *map(file_signature, value_files))
+
+    def _reload_file(self) -> bool:
         try:
-            with open(self.rules_path) as f:
-                data = json.load(f)
-            return data.get("rules", [])
+            stat = self.rules_path.stat()
         except FileNotFoundError:
-            logger.error("Rules file not found: %s", self.rules_path)
-            return []
-        except json.JSONDecodeError as e:
-            logger.error("Invalid JSON in rules file: %s", e)
-            return []
+            if self._file_signature != _MISSING:
+                logger.error("Rules file not found: %s", self.rules_path)
+                self._file_signature = _MISSING
+            return False
+
+        signature = ((stat.st_mtime_ns, stat.st_size), *map(file_signature, self._ruleset.value_files))
+        if signature == self._file_signature:
+            return False
+        self._file_signature = signature
+
+        try:
+            raw = self.rules_path.read_bytes()
+        except OSError as e:
+            logger.error("Could not read rules file %s: %s", self.rules_path, e)
+            return False
+
+        # Rulesets with values files carry a version over all files, so this
+        # shortcut only applies to self-contained rules files
+        version = ruleset_version(raw)
+        if version == self._ruleset.version:
+            return False
+
+        started = time.perf_counter()
+        try:
+            ruleset = parse_ruleset(raw, version, base_dir=self.rules_path.parent)
+        except RulesetError as e:
+            RULES_RELOADS.labels(result="rejected").inc()
+            logger.error(
+                "Rules file %s rejected, keeping ruleset %s: %s",
+                self.rules_path,
+                self._ruleset.version,
+                e,
+            )
+            return False
+
+        RULES_LOAD_DURATION.observe(time.perf_counter() - started)
+        if ruleset.version == self._ruleset.version:
+            return False
+        RULES_RELOADS.labels(result="loaded").inc()
+        self._ruleset = ruleset
+        logger.info("Loaded ruleset %s (%d rules) from %s", version, len(ruleset.rules), self.rules_path)
+        return True
+
+    def publish(self, ruleset: CompiledRuleset) -> bool:
+        """Swap in a ruleset compiled elsewhere (e.g. from Baserow). Returns True if swapped."""
+        if ruleset.version == self._ruleset.version and ruleset.source == self._ruleset.source:
+            return False
+        if self.snapshots is not None:
+            try:
+                with self.snapshots.lock():
+                    # Recorded with the rules file's signature: siblings and
+                    # restarts keep this ruleset until the file is edited
+                    ruleset = self.snapshots.publish(ruleset, self._signatures(ruleset.value_files))
+            except OSError as e:
+                logger.error("Could not store ruleset snapshot in %s: %s", self.snapshots.directory, e)
+        RULES_RELOADS.labels(result="loaded").inc()
+        self._ruleset = ruleset
+        logger.info("Loaded ruleset %s (%d rules) from %s", ruleset.version, len(ruleset.rules), ruleset.source)
+        return True
+
+    async def watch(self, interval: float) -> None:
+        """Poll the rules file for changes off the event loop until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception:
+                logger.exception("Rules reload failed")
 
     def get_rules(self) -> list[EmailRule]:
         """Return all rules as Pydantic models."""
-        raw_rules = self._load_rules()
-        result = []
-        for rule in raw_rules:
-            result.append(
-                EmailRule(
-                    name=rule["name"],
-                    category=rule["category"],
-                    priority=rule["priority"],
-                    actions=rule["actions"],
-                    conditions=rule["conditions"],
-                    description=rule.get("description", ""),
-                )
-            )
-        return result
+        return list(self._ruleset.models)
 
     def classify(
-        self, email: EmailClassifyRequest, dry_run: bool = False
+        self,
+        email: EmailClassifyRequest,
+        dry_run: bool = False,
+        ruleset: CompiledRuleset | None = None,
+        sender: SenderStats | None = None,
+        body_scan: BodyScan | None = None,
+        record: bool = True,
     ) -> EmailClassifyResponse:
-        """Classify an email using Tier 1 rules."""
-        rules = self._load_rules()
+        """Classify an email using Tier 1 rules.
+
+        Pass a ruleset snapshot to evaluate several emails against the same
+        rules even if a reload happens in between. Pass the sender's history
+        when it was looked up (with counters from Redis); otherwise sender
+        conditions only know whether the sender is in the in-memory filter.
+        A body streamed by the caller comes as a closed body_scan, whose
+        context (built with the same ruleset and sender) is used as is.
+        With record=False (backfills of old mail) the near-duplicate cluster
+        is looked up without adding the email to the live index.
+        """
+        if ruleset is None:
+            ruleset = self._ruleset
+        if sender is None and self.sender_history is not None:
+            sender = self.sender_history.stats(email)
+        started = time.perf_counter()
+        result, rule_name = self._classify(email, dry_run, ruleset, sender, body_scan)
+        if self.near_duplicates is not None:
+            # Dry runs look up the cluster without adding to the index
+            duplicate = self.near_duplicates.check(email, record=record and not dry_run)
+            if duplicate is not None:
+                result.cluster_id = duplicate.cluster_id
+                result.duplicate_of = duplicate.duplicate_of
+        result.ruleset_version = ruleset.version
+        result.ruleset_revision = ruleset.revision
+        CLASSIFICATION_DURATION.observe(time.perf_counter() - started)
+        CLASSIFICATIONS.labels(category=result.category.value, rule=rule_name or "none").inc()
+        return result
+
+    def _classify(
+        self,
+        email: EmailClassifyRequest,
+        dry_run: bool,
+        ruleset: CompiledRuleset,
+        sender: SenderStats | None,
+        body_scan: BodyScan | None = None,
+    ) -> tuple[EmailClassifyResponse, str | None]:
+        """First-match evaluation. Returns the response and the name of the matching rule."""
+        if body_scan is not None:
+            ctx = body_scan.ctx
+        else:
+            ctx = EmailContext(email, ruleset, sender)
+            if ruleset.scans_body and email.body:
+                # Reads the body only until the first matching rule is certain
+                scan_body(ctx, email.body, email.body_content_type == EmailBodyType.HTML)
         summary = self._make_email_summary(email)
 
-        for rule in rules:
-            match, reasoning = self._evaluate_rule(rule, email)
+        evaluate_rule = self._evaluate_rule
+        if self.profiler.enabled:
+            self.profiler.begin(ruleset)
+            evaluate_rule = self._evaluate_rule_profiled
+
+        for rule in ruleset.rule_index.candidates(ctx):
+            match, reasoning = evaluate_rule(rule, ctx)
             if match:
+                if self.profiler.enabled:
+                    self.profiler.record_first_match(rule.index)
                 return EmailClassifyResponse(
-                    category=EmailCategory(rule["category"]),
-                    priority=EmailPriority(rule["priority"]),
-                    actions=[EmailAction(a) for a in rule["actions"]],
+                    category=rule.category,
+                    priority=rule.priority,
+                    actions=list(rule.actions),
                     confidence=0.85,
                     tier_used=1,
                     reasoning=reasoning,
                     dry_run=dry_run,
                     email=summary,
-                )
+                ), rule.name
+
+        # No rule matched → Tier 1.5: labels of the most similar known emails
+        if self.knn is not None:
+            neighbours = self.knn.query(email)
+            if neighbours is not None:
+                return EmailClassifyResponse(
+                    category=neighbours.category,
+                    priority=neighbours.priority,
+                    actions=neighbours.actions,
+                    confidence=round(0.5 + 0.3 * neighbours.vote_share * neighbours.similarity, 3),
+                    tier_used=1,
+                    knn_used=True,
+                    reasoning=(
+                        f"Nearest examples: {neighbours.neighbours} of {neighbours.k} similar emails "
+                        f"labeled {neighbours.category.value} (similarity {neighbours.similarity:.2f})"
+                    ),
+                    dry_run=dry_run,
+                    email=summary,
+                ), "knn"
 
-        # No rule matched → uncategorized
+        # Nothing similar either → uncategorized
         return EmailClassifyResponse(
             category=EmailCategory.UNCATEGORIZED,
             priority=EmailPriority.MEDIUM,
@@ -93,7 +329,7 @@ class EmailClassifier:
             reasoning="No classification rule matched",
             dry_run=dry_run,
             email=summary,
-        )
+        ), None
 
     @staticmethod
     def _make_email_summary(email: EmailClassifyRequest) -> EmailSummary:
@@ -107,84 +343,59 @@ class EmailClassifier:
         )
 
     def _evaluate_rule(
-        self, rule: dict, email: EmailClassifyRequest
+        self,
+        rule: CompiledRule,
+        ctx: EmailContext,
+        evaluate_condition: Callable[[CompiledCondition, EmailContext], tuple[bool, str]] | None = None,
     ) -> tuple[bool, str]:
         """Evaluate a single rule against an email. Returns (matched, reasoning)."""
-        conditions = rule.get("conditions", {})
-        match_type = conditions.get("match_type", "any")
-        sub_rules = conditions.get("rules", [])
-
-        if not sub_rules:
+        if not rule.conditions:
             return False, ""
 
-        results = []
+        evaluate_condition = evaluate_condition or self._evaluate_condition
         matched_reasons = []
 
-        for sub_rule in sub_rules:
-            matched, reason = self._evaluate_condition(sub_rule, email)
-            results.append(matched)
+        for condition in rule.conditions:
+            matched, reason = evaluate_condition(condition, ctx)
             if matched:
                 matched_reasons.append(reason)
+            elif rule.match_all:
+                return False, ""
+            # "any" keeps evaluating: every matching condition goes into the reasoning
 
-        if match_type == "all":
-            overall_match = all(results)
-        else:  # "any"
-            overall_match = any(results)
-
-        if overall_match:
-            reasoning = f"Rule '{rule['name']}': {'; '.join(matched_reasons)}"
+        if matched_reasons:
+            reasoning = f"Rule '{rule.name}': {'; '.join(matched_reasons)}"
             return True, reasoning
 
         return False, ""
 
     def _evaluate_condition(
-        self, condition: dict, email: EmailClassifyRequest
+        self, condition: CompiledCondition, ctx: EmailContext
     ) -> tuple[bool, str]:
         """Evaluate a single condition against an email field."""
-        field = condition.get("field", "")
-        operator = condition.get("operator", "")
-        values = condition.get("values", [])
-
-        field_value = self._get_field_value(field, email)
-
-        if operator == "contains_any":
-            field_lower = field_value.lower()
-            for value in values:
-                if value.lower() in field_lower:
-                    return True, f"{field} contains '{value}'"
-            return False, ""
+        return condition.match(ctx)
 
-        elif operator == "not_contains_any":
-            field_lower = field_value.lower()
-            for value in values:
-                if value.lower() in field_lower:
-                    return False, ""
-            return True, f"{field} does not contain blocked patterns"
-
-        elif operator == "equals":
-            for value in values:
-                if field_value.lower() == value.lower():
-                    return True, f"{field} equals '{value}'"
-            return False, ""
+    def _evaluate_rule_profiled(
+        self, rule: CompiledRule, ctx: EmailContext
+    ) -> tuple[bool, str]:
+        """_evaluate_rule with per-rule and per-condition timing fed to the profiler."""
+        started = time.perf_counter_ns()
+        matched, reasoning = self._evaluate_rule(rule, ctx, self._evaluate_condition_profiled)
+        self.profiler.record_rule(rule.index, matched, time.perf_counter_ns() - started)
+        return matched, reasoning
 
-        elif operator == "not_equals":
-            for value in values:
-                if field_value.lower() == value.lower():
-                    return False, ""
-            return True, f"{field} is not in excluded values"
+    def _evaluate_condition_profiled(
+        self, condition: CompiledCondition, ctx: EmailContext
+    ) -> tuple[bool, str]:
+        started = time.perf_counter_ns()
+        matched, reason = self._evaluate_condition(condition, ctx)
+        self.profiler.record_condition(condition.key, matched, time.perf_counter_ns() - started)
+        return matched, reason
 
-        else:
-            logger.warning("Unknown operator: %s", operator)
-            return False, ""
 
-    def _get_field_value(self, field: str, email: EmailClassifyRequest) -> str:
-        """Extract a field value from the email as a string."""
-        field_map = {
-            "from_address": email.from_address,
-            "from_name": email.from_name,
-            "subject": email.subject,
-            "body_preview": email.body_preview,
-            "account": email.account.value,
-            "importance": email.importance.value,
-        }
-        return field_map.get(field, "")
+def file_signature(path: Path) -> tuple[int, int]:
+    try:
+        stat = path.stat()
+    except OSError:
+        return _MISSING
+    return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,381 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import httpx
+
+from app.metrics import GRAPH_MESSAGES
+from app.models.email import EmailAccount, EmailClassifyRequest, EmailImportance
+
+logger = logging.getLogger(__name__)
+
+# Only what EmailClassifyRequest needs, keeping delta pages small
+MESSAGE_FIELDS = "id,subject,from,sender,bodyPreview,receivedDateTime,hasAttachments,importance,isDraft"
+TOKEN_SCOPE = "offline_access Mail.Read"
+
+EmailBatchHandler = Callable[[list[EmailClassifyRequest]], Awaitable[None]]
+
+
+class GraphError(Exception):
+    """Raised for Graph or token endpoint responses the poller cannot recover from."""
+
+
+class GraphStateStore:
+    """Delta links, rotated refresh tokens and handled message ids per account,
+    kept in one JSON file.
+
+    Written atomically, in a worker thread, after every handled page and
+    completed delta round, so a restart continues where the last successful
+    round ended. Only the process holding the flock on `<path>.lock` (see
+    claim()) may use the file: uvicorn workers share it, and two pollers
+    would race on refresh-token rotation and handle every message twice.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._state: dict[str, dict] = {}
+        self._lock_file = None
+        self._write_lock = asyncio.Lock()
+        self._load()
+
+    def claim(self) -> bool:
+        """Take the state file for this process unless another one holds it.
+
+        Returns True while this process holds it. A newly taken file is read
+        again, as the previous holder may have changed it since.
+        """
+        if self._lock_file is not None:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.path.with_name(f"{self.path.name}.lock"), "a+b")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self._load()
+        return True
+
+    def release(self) -> None:
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def get(self, account: EmailAccount, key: str) -> str | None:
+        return self._state.get(account.value, {}).get(key)
+
+    async def set(self, account: EmailAccount, key: str, value: str | None) -> None:
+        entry = self._state.setdefault(account.value, {})
+        if value is None:
+            entry.pop(key, None)
+        else:
+            entry[key] = value
+        await self._save()
+
+    def seen(self, account: EmailAccount) -> dict[str, float]:
+        """Ids of messages already handed to the handler, with the time they were."""
+        return self._state.get(account.value, {}).get("seen_messages", {})
+
+    async def mark_seen(self, account: EmailAccount, message_ids: list[str], max_age_seconds: float) -> None:
+        """Add handled message ids, forgetting those handled more than max_age_seconds ago."""
+        now = time.time()
+        seen = {i: at for i, at in self.seen(account).items() if now - at < max_age_seconds}
+        seen.update(dict.fromkeys(message_ids, now))
+        self._state.setdefault(account.value, {})["seen_messages"] = seen
+        await self._save()
+
+    def _load(self) -> None:
+        if self.path.exists():
+            try:
+                self._state = json.loads(self.path.read_text())
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error("Ignoring unreadable Graph state file %s: %s", self.path, e)
+
+    async def _save(self) -> None:
+        async with self._write_lock:
+            # Copied on the event loop: mailboxes polled concurrently keep changing it
+            state = {account: dict(entry) for account, entry in self._state.items()}
+            for entry in state.values():
+                if "seen_messages" in entry:
+                    entry["seen_messages"] = dict(entry["seen_messages"])
+            await asyncio.to_thread(self._write, state)
+
+    def _write(self, state: dict[str, dict]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_text(json.dumps(state, indent=2))
+        os.chmod(tmp, 0o600)  # holds refresh tokens
+        os.replace(tmp, self.path)
+
+
+class GraphTokenProvider:
+    """Access tokens for one mailbox via the OAuth refresh-token grant.
+
+    Microsoft rotates refresh tokens; the newest one is stored in the state
+    file and preferred over the configured one on the next start.
+    """
+
+    def __init__(
+        self,
+        http: httpx.AsyncClient,
+        token_url: str,
+        client_id: str,
+        client_secret: str,
+        account: EmailAccount,
+        refresh_token: str,
+        state: GraphStateStore,
+    ):
+        self.http = http
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.account = account
+        self.state = state
+        self.configured_refresh_token = refresh_token
+        self.reload()
+
+    def reload(self) -> None:
+        """Start over from the newest stored refresh token (e.g. after another process polled)."""
+        self.refresh_token = self.state.get(self.account, "refresh_token") or self.configured_refresh_token
+        self._access_token: str | None = None
+        self._expires_at = 0.0
+
+    async def token(self, force_refresh: bool = False) -> str:
+        if force_refresh or self._access_token is None or time.monotonic() >= self._expires_at:
+            await self._refresh()
+        return self._access_token
+
+    async def _refresh(self) -> None:
+        response = await self.http.post(
+            self.token_url,
+            data={
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "grant_type": "refresh_token",
+                "refresh_token": self.refresh_token,
+                "scope": TOKEN_SCOPE,
+            },
+        )
+        if response.status_code != 200:
+            raise GraphError(
+                f"Token refresh for {self.account.value} failed with {response.status_code}: {response.text[:200]}"
+            )
+        payload = response.json()
+        self._access_token = payload["access_token"]
+        # Renew a minute early so a token never expires mid-request
+        self._expires_at = time.monotonic() + int(payload.get("expires_in", 3600)) - 60
+        rotated = payload.get("refresh_token")
+        if rotated and rotated != self.refresh_token:
+            self.refresh_token = rotated
+            await self.state.set(self.account, "refresh_token", rotated)
+
+
+@dataclass
+class GraphMailbox:
+    account: EmailAccount
+    tokens: GraphTokenProvider
+
+
+class GraphMailPoller:
+    """Polls the inbox of each mailbox with Graph delta queries.
+
+    The first round for a mailbox starts a delta sync limited to the last
+    initial_sync_hours; every later round replays the stored deltaLink, so
+    only new or changed messages are transferred. Each page of messages is
+    handed to `handler` as one batch, and the deltaLink is stored only after
+    every page of a round was handled. Only the inbox is synced, so sent
+    items never show up.
+
+    Delta rounds also return messages whose state changed (read, flagged,
+    categorised). Handled ids are remembered in the state file for
+    seen_hours, and messages received before that window are not new
+    either, so a changed message is never handed over a second time. A crash
+    between handling a page and recording it re-delivers that page only.
+
+    Every uvicorn worker runs a poller, but only the one that claims the
+    state file polls; the others retry each interval and take over if it
+    stops.
+    """
+
+    def __init__(
+        self,
+        mailboxes: list[GraphMailbox],
+        state: GraphStateStore,
+        handler: EmailBatchHandler,
+        http: httpx.AsyncClient,
+        graph_base: str = "https://graph.microsoft.com/v1.0",
+        interval: float = 60.0,
+        page_size: int = 50,
+        initial_sync_hours: float = 24.0,
+        seen_hours: float = 7 * 24.0,
+    ):
+        self.mailboxes = mailboxes
+        self.state = state
+        self.handler = handler
+        self.http = http
+        self.graph_base = graph_base.rstrip("/")
+        self.interval = interval
+        self.page_size = page_size
+        self.initial_sync_hours = initial_sync_hours
+        # Every message of the initial sync must stay known for as long as it can show up
+        self.seen_hours = max(seen_hours, initial_sync_hours)
+        self._task: asyncio.Task | None = None
+        self._polling = False
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.state.release()
+        await self.http.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            if await self._claim():
+                await self.poll_all()
+            await asyncio.sleep(self.interval)
+
+    async def _claim(self) -> bool:
+        try:
+            claimed = await asyncio.to_thread(self.state.claim)
+        except OSError as e:
+            logger.error("Could not lock Graph state file %s: %s", self.state.path, e)
+            return False
+        if claimed and not self._polling:
+            logger.info("Polling Graph mailboxes in this process")
+            for mailbox in self.mailboxes:
+                mailbox.tokens.reload()
+        self._polling = claimed
+        return claimed
+
+    async def poll_all(self) -> int:
+        """One delta round for every mailbox. Returns the number of emails handled."""
+        results = await asyncio.gather(*(self.poll(m) for m in self.mailboxes), return_exceptions=True)
+        handled = 0
+        for mailbox, result in zip(self.mailboxes, results):
+            if isinstance(result, BaseException):
+                logger.error("Polling %s mailbox failed: %s", mailbox.account.value, result)
+            else:
+                handled += result
+        return handled
+
+    async def poll(self, mailbox: GraphMailbox) -> int:
+        url = self.state.get(mailbox.account, "delta_link") or self._initial_url()
+        handled = 0
+        restarted = False
+        while True:
+            response = await self._get(mailbox, url)
+            if response.status_code == 410 and not restarted:
+                # Sync state expired on the server side: start a fresh round
+                logger.warning("Delta token for %s expired, restarting sync", mailbox.account.value)
+                await self.state.set(mailbox.account, "delta_link", None)
+                url = self._initial_url()
+                restarted = True
+                continue
+            if response.status_code != 200:
+                raise GraphError(f"Delta query failed with {response.status_code}: {response.text[:200]}")
+
+            page = response.json()
+            emails = self._new_emails(mailbox.account, page.get("value", []))
+            if emails:
+                await self.handler(emails)
+                await self.state.mark_seen(
+                    mailbox.account, [e.message_id for e in emails if e.message_id], self.seen_hours * 3600
+                )
+                handled += len(emails)
+                GRAPH_MESSAGES.labels(account=mailbox.account.value).inc(len(emails))
+
+            next_link = page.get("@odata.nextLink")
+            if next_link:
+                url = next_link
+                continue
+            delta_link = page.get("@odata.deltaLink")
+            if delta_link:
+                await self.state.set(mailbox.account, "delta_link", delta_link)
+            if handled:
+                logger.info("Fetched %d new emails for %s", handled, mailbox.account.value)
+            return handled
+
+    def _new_emails(self, account: EmailAccount, messages: list[dict]) -> list[EmailClassifyRequest]:
+        seen = self.state.seen(account)
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=self.seen_hours)
+        emails = []
+        for message in messages:
+            if "@removed" in message or message.get("isDraft") or message.get("id") in seen:
+                continue
+            email = to_email_request(message, account)
+            received_at = email.received_at
+            if received_at is not None:
+                if received_at.tzinfo is None:
+                    received_at = received_at.replace(tzinfo=timezone.utc)
+                if received_at < cutoff:
+                    # An old message that was read, flagged or moved back into the inbox
+                    continue
+            emails.append(email)
+        return emails
+
+    def _initial_url(self) -> str:
+        since = datetime.now(timezone.utc) - timedelta(hours=self.initial_sync_hours)
+        params = httpx.QueryParams(
+            {
+                "$select": MESSAGE_FIELDS,
+                "$filter": f"receivedDateTime ge {since.strftime('%Y-%m-%dT%H:%M:%SZ')}",
+            }
+        )
+        return f"{self.graph_base}/me/mailFolders/inbox/messages/delta?{params}"
+
+    async def _get(self, mailbox: GraphMailbox, url: str) -> httpx.Response:
+        """GET with auth, one token refresh on 401 and Retry-After on throttling."""
+        refreshed = False
+        for _ in range(5):
+            token = await mailbox.tokens.token(force_refresh=refreshed)
+            response = await self.http.get(
+                url,
+                headers={
+                    "Authorization": f"Bearer {token}",
+                    "Prefer": f"odata.maxpagesize={self.page_size}",
+                },
+            )
+            if response.status_code == 401 and not refreshed:
+                refreshed = True
+                continue
+            if response.status_code in (429, 503, 504):
+                delay = float(response.headers.get("Retry-After", 5))
+                logger.warning("Graph throttled %s, retrying in %.0fs", mailbox.account.value, delay)
+                await asyncio.sleep(delay)
+                continue
+            return response
+        raise GraphError(f"Giving up on {url} after repeated throttling")
+
+
+def to_email_request(message: dict, account: EmailAccount) -> EmailClassifyRequest:
+    """Same mapping the n8n "Classify Email" node applies to trigger output."""
+    sender = (message.get("from") or message.get("sender") or {}).get("emailAddress") or {}
+    importance = (message.get("importance") or "normal").lower()
+    return EmailClassifyRequest(
+        from_address=sender.get("address") or "",
+        from_name=sender.get("name") or "",
+        subject=message.get("subject") or "",
+        body_preview=message.get("bodyPreview") or "",
+        received_at=message.get("receivedDateTime") or None,
+        has_attachments=bool(message.get("hasAttachments")),
+        importance=importance if importance in EmailImportance._value2member_map_ else EmailImportance.NORMAL,
+        account=account,
+        message_id=message.get("id") or "",
+    )
@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable
+
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from app.metrics import (
+    INGEST_DEAD_LETTERS,
+    INGEST_LAG,
+    INGEST_MESSAGES,
+    INGEST_OLDEST_AGE,
+    INGEST_PENDING,
+    INGEST_QUEUE_DEPTH,
+)
+from app.models.email import EmailClassifyRequest
+
+logger = logging.getLogger(__name__)
+
+Entry = tuple[bytes, dict[bytes, bytes]]
+
+# How long a consumer's XREADGROUP waits server-side for new entries
+DEFAULT_BLOCK_MS = 1000
+
+
+class IngestQueueFull(Exception):
+    """Raised when the stream already holds max_length unprocessed emails."""
+
+
+class IngestQueue:
+    """Emails waiting for classification, in a Redis Stream read by one consumer group.
+
+    Entries are deleted once acknowledged, so the stream length is the
+    backlog: emails not yet read plus those read but not acknowledged. Emails
+    that fail too often go to a separate dead-letter stream with the reason.
+    Blocking reads go through read_client when given: its socket timeout must
+    be longer than the consumers' block time.
+    """
+
+    def __init__(
+        self,
+        client: Redis,
+        stream: str = "lm:ingest",
+        group: str = "classifiers",
+        dead_letter_stream: str = "lm:ingest:dead",
+        max_length: int = 100000,
+        dead_letter_max_length: int = 10000,
+        read_client: Redis | None = None,
+    ):
+        self.client = client
+        self.read_client = read_client or client
+        self.stream = stream
+        self.group = group
+        self.dead_letter_stream = dead_letter_stream
+        self.max_length = max_length
+        self.dead_letter_max_length = dead_letter_max_length
+
+    async def ensure_group(self) -> None:
+        try:
+            await self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def append(self, email: EmailClassifyRequest) -> str:
+        """Queue an email. Returns its entry id; raises IngestQueueFull or RedisError."""
+        # Refusing beats trimming: n8n retries a refused email, a trimmed one is lost
+        if await self.client.xlen(self.stream) >= self.max_length:
+            raise IngestQueueFull(f"Ingest queue holds {self.max_length} emails")
+        entry_id = await self.client.xadd(self.stream, {"email": email.model_dump_json()})
+        return entry_id.decode()
+
+    async def read(self, consumer: str, count: int, block_ms: int) -> list[Entry]:
+        """Entries never delivered to any consumer of the group."""
+        response = await self.read_client.xreadgroup(
+            self.group, consumer, {self.stream: ">"}, count=count, block=block_ms
+        )
+        return response[0][1] if response else []
+
+    async def claim_idle(self, consumer: str, min_idle_ms: int, count: int) -> list[tuple[Entry, int]]:
+        """Take over entries a consumer read but did not acknowledge within min_idle_ms
+        (it failed, or its process died). Returns (entry, earlier deliveries) pairs."""
+        pending = await self.client.xpending_range(self.stream, self.group, "-", "+", count, idle=min_idle_ms)
+        if not pending:
+            return []
+        deliveries = {p["message_id"]: p["times_delivered"] for p in pending}
+        claimed = await self.client.xclaim(self.stream, self.group, consumer, min_idle_ms, list(deliveries))
+        found = {entry_id for entry_id, fields in claimed if fields}
+        # Pending entries deleted from the stream have nothing left to process
+        gone = [entry_id for entry_id in deliveries if entry_id not in found]
+        if gone:
+            await self.client.xack(self.stream, self.group, *gone)
+        return [((entry_id, fields), deliveries[entry_id]) for entry_id, fields in claimed if fields]
+
+    async def ack(self, entry_id: bytes) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        await pipe.execute()
+
+    async def dead_letter(self, entry: Entry, reason: str, deliveries: int) -> None:
+        entry_id, fields = entry
+        pipe = self.client.pipeline(transaction=False)
+        pipe.xadd(
+            self.dead_letter_stream,
+            {**fields, "entry_id": entry_id, "reason": reason, "deliveries": deliveries},
+            maxlen=self.dead_letter_max_length,
+            approximate=True,
+        )
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        await pipe.execute()
+
+    async def stats(self) -> dict:
+        """Backlog figures for the status endpoint and the gauges."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.xlen(self.stream)
+        pipe.xlen(self.dead_letter_stream)
+        pipe.xinfo_groups(self.stream)
+        pipe.xrange(self.stream, count=1)
+        length, dead_letters, groups, oldest = await pipe.execute()
+        group = next((g for g in groups if g["name"].decode() == self.group), None)
+        oldest_age = 0.0
+        if oldest:
+            # Entry ids start with the enqueue time in milliseconds
+            oldest_age = max(0.0, time.time() - int(oldest[0][0].split(b"-")[0]) / 1000)
+        return {
+            "length": length,
+            "pending": group["pending"] if group else 0,
+            # Entries not yet delivered to any consumer (None if Redis cannot tell)
+            "lag": group.get("lag") if group else length,
+            "consumers": group["consumers"] if group else 0,
+            "oldest_age_seconds": round(oldest_age, 3),
+            "dead_letters": dead_letters,
+        }
+
+    async def remove_idle_consumers(self, idle_ms: int) -> int:
+        """Forget consumers of earlier processes that hold no pending entries."""
+        removed = 0
+        for consumer in await self.client.xinfo_consumers(self.stream, self.group):
+            if consumer["pending"] == 0 and consumer["idle"] >= idle_ms:
+                await self.client.xgroup_delconsumer(self.stream, self.group, consumer["name"])
+                removed += 1
+        return removed
+
+
+class IngestWorkerPool:
+    """Consumers of the ingest stream in this process, plus one housekeeping task.
+
+    Each consumer reads new entries and awaits handler() for every email,
+    acknowledging it on success. Failed entries stay pending; the
+    housekeeping task claims entries that have been pending for claim_idle
+    seconds (failures, or entries of a process that died) and retries them,
+    until max_deliveries attempts have been made; then they go to the
+    dead-letter stream. Entries that are not valid emails go there directly.
+    It also refreshes the queue gauges. Since a crash may come between
+    handling and acknowledging, an email can be handled twice; the
+    classification cache makes the second time a no-op.
+    """
+
+    def __init__(
+        self,
+        queue: IngestQueue,
+        handler: Callable[[EmailClassifyRequest], Awaitable[object]],
+        consumers: int = 2,
+        batch_size: int = 10,
+        block_ms: int = DEFAULT_BLOCK_MS,
+        claim_idle: float = 60.0,
+        max_deliveries: int = 5,
+        monitor_interval: float = 15.0,
+        retry_delay: float = 5.0,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.consumers = consumers
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle = claim_idle
+        self.max_deliveries = max_deliveries
+        self.monitor_interval = monitor_interval
+        self.retry_delay = retry_delay
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self._last_errors: dict[bytes, str] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    async def start(self) -> None:
+        try:
+            await self.queue.ensure_group()
+        except RedisError as e:
+            # Consumers create it once Redis is reachable
+            logger.warning("Could not create ingest consumer group: %s", e)
+        self._stopping = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._consume(f"{self.name}-{i}")) for i in range(self.consumers)]
+        self._tasks.append(asyncio.create_task(self._housekeeping()))
+        logger.info("Started %d ingest consumers as %s", self.consumers, self.name)
+
+    async def stop(self) -> None:
+        """Let consumers finish their current entries, then stop."""
+        self._stopping.set()
+        if not self._tasks:
+            return
+        # A consumer blocked in XREADGROUP returns within block_ms
+        _, running = await asyncio.wait(self._tasks, timeout=self.block_ms / 1000 + 5)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        self._tasks = []
+
+    async def _consume(self, consumer: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                entries = await self.queue.read(consumer, self.batch_size, self.block_ms)
+            except RedisError as e:
+                if isinstance(e, ResponseError) and "NOGROUP" in str(e):
+                    # Redis restarted without persistence, or the stream was deleted
+                    await self._ensure_group()
+                    continue
+                logger.warning("Reading the ingest stream failed, retrying in %.0fs: %s", self.retry_delay, e)
+                await self._sleep(self.retry_delay)
+                continue
+            for entry in entries:
+                await self.process(entry, deliveries=1)
+
+    async def _ensure_group(self) -> None:
+        try:
+            await self.queue.ensure_group()
+        except RedisError as e:
+            logger.warning("Could not create ingest consumer group, retrying in %.0fs: %s", self.retry_delay, e)
+            await self._sleep(self.retry_delay)
+
+    async def process(self, entry: Entry, deliveries: int) -> bool:
+        """Handle one entry. Returns True if it was acknowledged or dead-lettered."""
+        entry_id, fields = entry
+        try:
+            try:
+                email = EmailClassifyRequest.model_validate_json(fields[b"email"])
+            except (KeyError, ValidationError) as e:
+                await self._dead_letter(entry, f"Invalid entry: {e}", deliveries)
+                return True
+            try:
+                await self.handler(email)
+            except Exception as e:
+                logger.warning("Ingested email %s failed (attempt %d): %s", entry_id.decode(), deliveries, e)
+                INGEST_MESSAGES.labels(result="failed").inc()
+                self._last_errors[entry_id] = f"{type(e).__name__}: {e}"
+                return False
+            await self.queue.ack(entry_id)
+        except RedisError as e:
+            # Still pending, so it is retried after claim_idle
+            logger.warning("Could not acknowledge ingested email %s: %s", entry_id.decode(), e)
+            return False
+        self._last_errors.pop(entry_id, None)
+        INGEST_MESSAGES.labels(result="classified").inc()
+        return True
+
+    async def _dead_letter(self, entry: Entry, reason: str, deliveries: int) -> None:
+        await self.queue.dead_letter(entry, reason, deliveries)
+        self._last_errors.pop(entry[0], None)
+        INGEST_MESSAGES.labels(result="dead_lettered").inc()
+        logger.error("Moved ingested email %s to the dead-letter stream: %s", entry[0].decode(), reason)
+
+    async def retry_idle(self) -> int:
+        """Retry or dead-letter entries pending for longer than claim_idle. Returns how many."""
+        claimed = await self.queue.claim_idle(f"{self.name}-retry", int(self.claim_idle * 1000), 100)
+        for entry, deliveries in claimed:
+            if deliveries >= self.max_deliveries:
+                reason = self._last_errors.get(entry[0], "unacknowledged")
+                await self._dead_letter(entry, f"Failed {deliveries} times, last: {reason}", deliveries)
+            else:
+                INGEST_MESSAGES.labels(result="retried").inc()
+                await self.process(entry, deliveries + 1)
+        return len(claimed)
+
+    async def update_metrics(self) -> dict:
+        stats = await self.queue.stats()
+        INGEST_QUEUE_DEPTH.set(stats["length"])
+        INGEST_PENDING.set(stats["pending"])
+        if stats["lag"] is not None:
+            INGEST_LAG.set(stats["lag"])
+        INGEST_OLDEST_AGE.set(stats["oldest_age_seconds"])
+        INGEST_DEAD_LETTERS.set(stats["dead_letters"])
+        return stats
+
+    async def _housekeeping(self) -> None:
+        last_cleanup = 0.0
+        while not self._stopping.is_set():
+            try:
+                await self.retry_idle()
+                await self.update_metrics()
+                if time.monotonic() - last_cleanup >= 3600:
+                    await self.queue.remove_idle_consumers(idle_ms=24 * 3600 * 1000)
+                    last_cleanup = time.monotonic()
+            except RedisError as e:
+                logger.warning("Ingest queue housekeeping failed: %s", e)
+            except Exception:
+                logger.exception("Ingest queue housekeeping failed")
+            await self._sleep(min(self.monitor_interval, self.claim_idle))
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,304 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from app.models.email import EmailAction, EmailCategory, EmailClassifyRequest, EmailPriority
+from app.services.vectorizer import HashingVectorizer
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = list(EmailCategory)
+PRIORITIES = list(EmailPriority)
+
+VECTORS_FILE = "vectors.npy"
+LABELS_FILE = "labels.npy"
+META_FILE = "index.json"
+LOCK_FILE = "index.lock"
+
+# labels.npy columns
+_CATEGORY, _PRIORITY, _NOTIFY = range(3)
+
+
+@dataclass
+class KnnMatch:
+    category: EmailCategory
+    priority: EmailPriority
+    actions: list[EmailAction]
+    similarity: float
+    vote_share: float
+    neighbours: int
+    k: int
+
+
+class KnnIndex:
+    """Labeled example emails searched by cosine similarity ("Tier 1.5").
+
+    Saved vectors live in one float32 matrix that is memory-mapped from
+    `path/vectors.npy` at startup, stored column-major (dim x n): query
+    vectors are sparse, so scoring only reads the rows of the columns the
+    query uses, which keeps a query at a few milliseconds at 100k examples.
+    Examples added since the last save sit in a small in-memory segment;
+    save() merges both into new files and maps them again.
+
+    The directory is shared by all uvicorn workers. save() holds an exclusive
+    flock and appends this process's new examples to what is on disk, which
+    may include other workers' examples, and bumps the revision in
+    `index.json`; load() reads under a shared flock. A worker picks up its
+    siblings' saves with reload_if_changed().
+    """
+
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        dim: int = 256,
+        k: int = 7,
+        min_similarity: float = 0.6,
+    ):
+        self.path = Path(path) if path is not None else None
+        self.vectorizer = HashingVectorizer(dim)
+        self.k = k
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._base_columns = np.empty((dim, 0), dtype=np.float32)
+        self._base_labels = np.empty((0, 3), dtype=np.int16)
+        self._extra_vectors = np.empty((64, dim), dtype=np.float32)
+        self._extra_labels = np.empty((64, 3), dtype=np.int16)
+        self._extra_count = 0
+        # Revision of the saved files that _base holds; 0 for none
+        self._revision = 0
+        # Views swapped on every change, so queries never need the lock
+        self._base: tuple[np.ndarray, np.ndarray] = (self._base_columns, self._base_labels)
+        self._extra: tuple[np.ndarray, np.ndarray] = (self._extra_vectors[:0], self._extra_labels[:0])
+
+    @property
+    def dim(self) -> int:
+        return self.vectorizer.dim
+
+    def __len__(self) -> int:
+        return len(self._base[1]) + len(self._extra[1])
+
+    @property
+    def dirty(self) -> bool:
+        return self._extra_count > 0
+
+    @property
+    def revision(self) -> str:
+        """Identifies the examples queries see: the saved revision, the same in
+        every worker, plus this process's unsaved examples if there are any."""
+        unsaved = len(self._extra[1])
+        if not unsaved:
+            return str(self._revision)
+        return f"{self._revision}+{os.getpid()}.{unsaved}"
+
+    def load(self) -> "KnnIndex":
+        """Map the saved index, if there is one. Returns self."""
+        if self.path is None:
+            return self
+        if not (self.path / VECTORS_FILE).exists():
+            logger.info("No kNN index at %s, starting empty", self.path)
+            return self
+        with self._file_lock(fcntl.LOCK_SH):
+            saved = self._read_saved()
+        if saved is None:
+            return self
+        revision, columns, labels = saved
+        with self._lock:
+            self._base_columns, self._base_labels = columns, labels
+            self._revision = revision
+            self._publish()
+        logger.info("Loaded kNN index revision %d with %d examples from %s", revision, len(labels), self.path)
+        return self
+
+    def saved_revision(self) -> int:
+        """Revision of the files on disk (0 if there are none)."""
+        try:
+            return json.loads((self.path / META_FILE).read_bytes())["revision"]
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Unreadable kNN index metadata in %s: %s", self.path, e)
+            return 0
+
+    def reload_if_changed(self) -> bool:
+        """Map the files again if another worker saved since. Returns True if reloaded."""
+        if self.path is None or self.dirty or self.saved_revision() == self._revision:
+            return False
+        self.load()
+        return True
+
+    def add(
+        self,
+        email: EmailClassifyRequest,
+        category: EmailCategory,
+        priority: EmailPriority,
+        actions: list[EmailAction],
+    ) -> None:
+        vector = self.vectorizer.transform_one(email)
+        label = (
+            CATEGORIES.index(category),
+            PRIORITIES.index(priority),
+            EmailAction.NOTIFY_TELEGRAM in actions,
+        )
+        with self._lock:
+            if self._extra_count == len(self._extra_vectors):
+                self._extra_vectors = np.concatenate([self._extra_vectors, np.empty_like(self._extra_vectors)])
+                self._extra_labels = np.concatenate([self._extra_labels, np.empty_like(self._extra_labels)])
+            self._extra_vectors[self._extra_count] = vector
+            self._extra_labels[self._extra_count] = label
+            self._extra_count += 1
+            self._publish()
+
+    def examples(self) -> tuple[np.ndarray, np.ndarray]:
+        """All example vectors as an (n, dim) array and their (n, 3) labels."""
+        (base_columns, base_labels), (extra_vectors, extra_labels) = self._base, self._extra
+        if not len(extra_labels):
+            return base_columns.T, base_labels
+        return np.concatenate([base_columns.T, extra_vectors]), np.concatenate([base_labels, extra_labels])
+
+    def query(self, email: EmailClassifyRequest) -> KnnMatch | None:
+        """Majority label of the k most similar examples, or None if even the
+        closest one is below min_similarity."""
+        (base_columns, base_labels), (extra_vectors, extra_labels) = self._base, self._extra
+        if not len(base_labels) and not len(extra_labels):
+            return None
+        query = self.vectorizer.transform_one(email)
+        used = np.flatnonzero(query)
+        if not len(used):
+            return None
+
+        similarities = np.zeros(len(base_labels), dtype=np.float32)
+        scratch = np.empty_like(similarities)
+        for column in used:
+            np.multiply(base_columns[column], query[column], out=scratch)
+            similarities += scratch
+        if len(extra_labels):
+            similarities = np.concatenate([similarities, extra_vectors @ query])
+            labels = np.concatenate([base_labels, extra_labels])
+        else:
+            labels = base_labels
+        k = min(self.k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top_similarities = similarities[top]
+        if top_similarities.max() < self.min_similarity:
+            return None
+
+        top_labels = labels[top]
+        weights = np.clip(top_similarities, 0.0, None)
+        votes = np.bincount(top_labels[:, _CATEGORY], weights=weights, minlength=len(CATEGORIES))
+        category = int(votes.argmax())
+        winners = top_labels[:, _CATEGORY] == category
+        priority_votes = np.bincount(
+            top_labels[winners, _PRIORITY], weights=weights[winners], minlength=len(PRIORITIES)
+        )
+        notify = weights[winners] @ top_labels[winners, _NOTIFY] * 2 >= weights[winners].sum()
+        return KnnMatch(
+            category=CATEGORIES[category],
+            priority=PRIORITIES[int(priority_votes.argmax())],
+            actions=[EmailAction.NOTIFY_TELEGRAM if notify else EmailAction.SKIP],
+            similarity=float(top_similarities[winners].max()),
+            vote_share=float(votes[category] / votes.sum()) if votes.sum() else 0.0,
+            neighbours=int(winners.sum()),
+            k=k,
+        )
+
+    def save(self) -> bool:
+        """Append new examples to the saved index and map the new files. Returns True if written."""
+        if self.path is None:
+            return False
+        with self._lock:
+            count = self._extra_count
+            if not count:
+                return False
+            new_vectors = self._extra_vectors[:count].copy()
+            new_labels = self._extra_labels[:count].copy()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._file_lock(fcntl.LOCK_EX):
+            # Start from the files, not from _base: siblings may have saved since
+            saved = self._read_saved() if (self.path / VECTORS_FILE).exists() else None
+            if saved is None:
+                saved = (self.saved_revision(), self._base_columns[:, :0], self._base_labels[:0])
+            revision, columns, labels = saved
+            columns = np.concatenate([columns, new_vectors.T], axis=1)
+            labels = np.concatenate([labels, new_labels])
+            revision += 1
+            for name, array in ((VECTORS_FILE, columns), (LABELS_FILE, labels)):
+                tmp = self.path / f".{name}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp, self.path / name)
+            tmp = self.path / f".{META_FILE}.{os.getpid()}.tmp"
+            tmp.write_text(json.dumps({"revision": revision}))
+            os.replace(tmp, self.path / META_FILE)
+            mapped = np.load(self.path / VECTORS_FILE, mmap_mode="r")
+
+        with self._lock:
+            # Examples added while writing stay in the in-memory segment
+            # (copied into new arrays: running queries may still hold views of the old ones)
+            remaining = self._extra_count - count
+            capacity = max(64, 2 * remaining)
+            extra_vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            extra_labels = np.empty((capacity, 3), dtype=np.int16)
+            extra_vectors[:remaining] = self._extra_vectors[count : self._extra_count]
+            extra_labels[:remaining] = self._extra_labels[count : self._extra_count]
+            self._extra_vectors, self._extra_labels = extra_vectors, extra_labels
+            self._extra_count = remaining
+            self._base_columns = mapped
+            self._base_labels = labels
+            self._revision = revision
+            self._publish()
+        logger.info("Saved kNN index revision %d with %d examples to %s", revision, len(labels), self.path)
+        return True
+
+    async def autosave(self, interval: float) -> None:
+        """Every interval seconds, save new examples or pick up other workers'
+        saves, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.dirty:
+                    await asyncio.to_thread(self.save)
+                else:
+                    await asyncio.to_thread(self.reload_if_changed)
+            except Exception:
+                logger.exception("Syncing kNN index failed")
+
+    @contextmanager
+    def _file_lock(self, operation: int) -> Iterator[None]:
+        with open(self.path / LOCK_FILE, "a+b") as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_saved(self) -> tuple[int, np.ndarray, np.ndarray] | None:
+        """The saved revision, vectors (mapped) and labels, or None if unusable. Call under _file_lock."""
+        try:
+            columns = np.load(self.path / VECTORS_FILE, mmap_mode="r")
+            labels = np.load(self.path / LABELS_FILE)
+        except (OSError, ValueError) as e:
+            logger.error("Could not read kNN index at %s, ignoring it: %s", self.path, e)
+            return None
+        if columns.ndim != 2 or columns.shape[0] != self.dim or columns.shape[1] != len(labels):
+            logger.error(
+                "kNN index at %s has shape %s, expected (%d, n); ignoring it",
+                self.path,
+                columns.shape,
+                self.dim,
+            )
+            return None
+        return self.saved_revision(), columns, labels
+
+    def _publish(self) -> None:
+        self._base = (self._base_columns, self._base_labels)
+        self._extra = (self._extra_vectors[: self._extra_count], self._extra_labels[: self._extra_count])
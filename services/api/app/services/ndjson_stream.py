@@ -0,0 +1,167 @@
+import json
+import logging
+import time
+from typing import Iterable, Iterator
+
+from pydantic import ValidationError
+
+from app.models.email import EmailClassifyBatchItem, EmailClassifyRequest
+from app.services.email_classifier import EmailClassifier
+from app.services.sender_history import SenderStats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_LINE_BYTES = 1024 * 1024
+# Read size of the offline CLIs
+CHUNK_SIZE = 64 * 1024
+
+
+class NdjsonLineSplitter:
+    """Split a byte stream into lines while buffering at most max_line_bytes.
+
+    An over-long line is discarded up to its newline and reported as None, so
+    a single broken record cannot grow memory without bound.
+    """
+
+    def __init__(self, max_line_bytes: int = DEFAULT_MAX_LINE_BYTES):
+        self.max_line_bytes = max_line_bytes
+        self._buffer = bytearray()
+        self._overflow = False
+
+    def feed(self, chunk: bytes) -> Iterator[bytes | None]:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                self._append(chunk[start:])
+                return
+            self._append(chunk[start:end])
+            yield from self._take()
+            start = end + 1
+
+    def close(self) -> Iterator[bytes | None]:
+        """Flush a trailing line without newline."""
+        if self._buffer or self._overflow:
+            yield from self._take()
+
+    def _append(self, data: bytes) -> None:
+        if self._overflow:
+            return
+        if len(self._buffer) + len(data) > self.max_line_bytes:
+            self._overflow = True
+            self._buffer.clear()
+        else:
+            self._buffer += data
+
+    def _take(self) -> Iterator[bytes | None]:
+        if self._overflow:
+            self._overflow = False
+            yield None
+        elif self._buffer.strip():
+            yield bytes(self._buffer)
+        self._buffer.clear()
+
+
+def read_lines(chunks: Iterable[bytes], max_line_bytes: int = DEFAULT_MAX_LINE_BYTES) -> Iterator[bytes | None]:
+    """All lines of a chunked byte stream, over-long ones as None."""
+    splitter = NdjsonLineSplitter(max_line_bytes)
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
+
+
+# A parsed line: the email, or the error that replaces its result
+ParsedLine = EmailClassifyRequest | str
+
+
+class NdjsonClassificationStream:
+    """Classify NDJSON email records one line at a time against one ruleset snapshot.
+
+    Each output line mirrors an EmailClassifyBatchItem; summary() reports the
+    totals and throughput once the input is exhausted. feed() parses and
+    classifies in one go; callers that look up sender counters in between
+    use parse() and classify().
+    """
+
+    def __init__(self, classifier: EmailClassifier, max_line_bytes: int = DEFAULT_MAX_LINE_BYTES):
+        self.classifier = classifier
+        self.ruleset = classifier.ruleset
+        self.splitter = NdjsonLineSplitter(max_line_bytes)
+        self.processed = 0
+        self.failed = 0
+        self._started = time.perf_counter()
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Classify every complete line in chunk and return their NDJSON results."""
+        return self.classify(self.parse(chunk))
+
+    def close(self) -> bytes:
+        return self.classify(self.parse(None))
+
+    def parse(self, chunk: bytes | None) -> list[ParsedLine]:
+        """Validate the complete lines in chunk (None: the trailing line at the end of input)."""
+        lines = self.splitter.feed(chunk) if chunk is not None else self.splitter.close()
+        return [self._parse_line(line) for line in lines]
+
+    def classify(self, parsed: list[ParsedLine], senders: list[SenderStats | None] | None = None) -> bytes:
+        """NDJSON results of parsed lines; senders, if given, holds the looked-up stats per line."""
+        if senders is None:
+            senders = [None] * len(parsed)
+        return b"".join(self._classify_line(line, sender) for line, sender in zip(parsed, senders))
+
+    def classify_lines(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            output = self.feed(chunk)
+            if output:
+                yield output
+        output = self.close()
+        if output:
+            yield output
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self._started
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "elapsed_seconds": round(elapsed, 3),
+            "emails_per_second": round(self.processed / elapsed, 1) if elapsed > 0 else 0.0,
+            "ruleset_version": self.ruleset.version,
+        }
+
+    def _parse_line(self, line: bytes | None) -> ParsedLine:
+        if line is None:
+            return f"Line exceeds {self.splitter.max_line_bytes} bytes"
+        try:
+            return EmailClassifyRequest.model_validate_json(line)
+        except ValidationError as e:
+            return format_validation_error(e)
+
+    def _classify_line(self, line: ParsedLine, sender: SenderStats | None) -> bytes:
+        index = self.processed
+        self.processed += 1
+        if isinstance(line, str):
+            item = EmailClassifyBatchItem(index=index, error=line)
+        else:
+            try:
+                result = self.classifier.classify(line, ruleset=self.ruleset, sender=sender, record=False)
+            except Exception as e:
+                logger.exception("Stream line %d failed", index)
+                item = EmailClassifyBatchItem(index=index, error=f"Classification failed: {e}")
+            else:
+                item = EmailClassifyBatchItem(index=index, result=result)
+
+        if item.error is not None:
+            self.failed += 1
+        return item.model_dump_json(exclude_none=True).encode() + b"\n"
+
+
+def summary_line(summary: dict) -> bytes:
+    return json.dumps({"summary": summary}).encode() + b"\n"
+
+
+def format_validation_error(e: ValidationError) -> str:
+    """Flatten a ValidationError into one line for per-item error fields."""
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in err['loc']) or 'email'}: {err['msg']}"
+        for err in e.errors()
+    )
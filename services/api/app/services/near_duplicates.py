@@ -0,0 +1,172 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable
+
+from app.models.email import EmailClassifyRequest
+
+FINGERPRINT_BITS = 64
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Counts are accumulated in one byte per bit position
+MAX_FEATURES = 255
+
+# Runs of at least two letters: digits split tokens and are dropped, so
+# timestamps, counters, job ids and host numbers (pve01/pve02) don't change
+# the features of otherwise identical alerts
+_WORD_RE = re.compile(r"[^\W\d_]{2,}")
+# Date words change between otherwise identical reports, like digits do
+_VOLATILE_TOKENS = frozenset(
+    "mon tue wed thu fri sat sun jan feb mar apr may jun jul aug sep oct nov dec "
+    "mo di mi do fr sa so mär mai okt dez am pm utc cet cest".split()
+)
+
+# Byte value -> 8 bytes holding its bits (least significant first), so adding
+# int.from_bytes() of the expanded hashes counts set bits per position at once
+_EXPAND = [bytes((b >> j) & 1 for j in range(8)) for b in range(256)]
+
+
+def features(text: str) -> set[str]:
+    """Distinct lowercased words of text, without digits and date words."""
+    return set(_WORD_RE.findall(text.lower())) - _VOLATILE_TOKENS
+
+
+@lru_cache(maxsize=65536)
+def _feature_counts(feature: str) -> int:
+    """Hash bits of feature, one byte per bit position, ready to be summed."""
+    digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+    return int.from_bytes(b"".join([_EXPAND[b] for b in digest]), "little")
+
+
+@lru_cache(maxsize=MAX_FEATURES + 1)
+def _majority_table(feature_count: int) -> bytes:
+    """bytes.translate table: per-bit count -> "1" if most features set the bit, else "0"."""
+    return bytes(ord("1") if 2 * c > feature_count else ord("0") for c in range(256))
+
+
+def simhash(text: str) -> int | None:
+    """64-bit SimHash over the features of text (None if it has none)."""
+    words = features(text)
+    if not words:
+        return None
+    if len(words) > MAX_FEATURES:
+        words = set(sorted(words)[:MAX_FEATURES])
+
+    counts = sum(map(_feature_counts, words)).to_bytes(FINGERPRINT_BITS, "little")
+    # counts[i] belongs to bit i; reverse so bit 0 is the last binary digit
+    return int(counts.translate(_majority_table(len(words)))[::-1], 2)
+
+
+def email_fingerprint(email: EmailClassifyRequest) -> int | None:
+    return simhash(f"{email.subject}\n{email.body_preview}")
+
+
+@dataclass
+class NearDuplicate:
+    cluster_id: str
+    duplicate_of: str | None
+
+
+@dataclass
+class _Cluster:
+    fingerprint: int
+    cluster_id: str
+    first_message: str
+    last_seen: float
+
+
+class NearDuplicateIndex:
+    """Recent email fingerprints, searched for near-duplicates by Hamming distance.
+
+    The 64-bit fingerprint is split into BANDS bands; two fingerprints within
+    max_distance < BANDS bits of each other agree on at least one band
+    exactly, so a lookup only compares against the few entries sharing a band
+    value. Only the first email of each cluster is stored; later duplicates
+    refresh its last_seen. Clusters unseen for window_seconds expire, and the
+    least recently seen are evicted beyond max_entries.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 6 * 3600,
+        max_entries: int = 50000,
+        max_distance: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance must be below {BANDS} for banded lookup")
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.clock = clock
+        self._clusters: OrderedDict[str, _Cluster] = OrderedDict()
+        self._bands: list[dict[int, dict[str, _Cluster]]] = [{} for _ in range(BANDS)]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    def check(self, email: EmailClassifyRequest, record: bool = True) -> NearDuplicate | None:
+        """Find the cluster of email. With record=True, a new cluster is created
+        (or the matched one refreshed); dry runs pass record=False."""
+        fingerprint = email_fingerprint(email)
+        if fingerprint is None:
+            return None
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            match = self._nearest(fingerprint)
+            if match is not None:
+                if record:
+                    match.last_seen = now
+                    self._clusters.move_to_end(match.cluster_id)
+                return NearDuplicate(match.cluster_id, match.first_message or match.cluster_id)
+
+            cluster_id = f"{fingerprint:016x}"
+            if record:
+                self._add(_Cluster(fingerprint, cluster_id, email.message_id, now))
+            return NearDuplicate(cluster_id, None)
+
+    def _nearest(self, fingerprint: int) -> _Cluster | None:
+        best, best_distance = None, self.max_distance + 1
+        for band, buckets in enumerate(self._bands):
+            bucket = buckets.get((fingerprint >> (band * BAND_BITS)) & BAND_MASK)
+            if not bucket:
+                continue
+            for cluster in bucket.values():
+                distance = (cluster.fingerprint ^ fingerprint).bit_count()
+                if distance < best_distance:
+                    best, best_distance = cluster, distance
+        return best
+
+    def _add(self, cluster: _Cluster) -> None:
+        # Same fingerprint as an expired-but-not-yet-evicted cluster cannot
+        # happen: _nearest would have matched it at distance 0
+        self._clusters[cluster.cluster_id] = cluster
+        for band, buckets in enumerate(self._bands):
+            value = (cluster.fingerprint >> (band * BAND_BITS)) & BAND_MASK
+            buckets.setdefault(value, {})[cluster.cluster_id] = cluster
+        while len(self._clusters) > self.max_entries:
+            self._remove(next(iter(self._clusters.values())))
+
+    def _expire(self, now: float) -> None:
+        while self._clusters:
+            oldest = next(iter(self._clusters.values()))
+            if now - oldest.last_seen <= self.window_seconds:
+                return
+            self._remove(oldest)
+
+    def _remove(self, cluster: _Cluster) -> None:
+        del self._clusters[cluster.cluster_id]
+        for band, buckets in enumerate(self._bands):
+            value = (cluster.fingerprint >> (band * BAND_BITS)) & BAND_MASK
+            bucket = buckets[value]
+            del bucket[cluster.cluster_id]
+            if not bucket:
+                del buckets[value]
@@ -0,0 +1,49 @@
+import os
+import socket
+import uuid
+
+from redis.asyncio import Redis
+from redis.exceptions import WatchError
+
+
+class RedisLease:
+    """A Redis key that names the one process doing a job across workers.
+
+    The holder calls renew() well within ttl; if it dies, the key expires
+    and the next renew() of another process takes over. Checks of the holder
+    run in a WATCH transaction, so a lease that changed hands is never
+    extended or deleted by its previous holder.
+    """
+
+    def __init__(self, client: Redis, key: str, ttl: float):
+        self.client = client
+        self.key = key
+        self.ttl_ms = int(ttl * 1000)
+        self.token = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}".encode()
+        self.held = False
+
+    async def renew(self) -> bool:
+        """Take the lease if it is free or extend it if held. Returns whether it is held."""
+        if await self.client.set(self.key, self.token, nx=True, px=self.ttl_ms):
+            self.held = True
+        else:
+            self.held = await self._if_held(lambda pipe: pipe.pexpire(self.key, self.ttl_ms))
+        return self.held
+
+    async def release(self) -> None:
+        if self.held:
+            await self._if_held(lambda pipe: pipe.delete(self.key))
+            self.held = False
+
+    async def _if_held(self, command) -> bool:
+        async with self.client.pipeline(transaction=True) as pipe:
+            await pipe.watch(self.key)
+            if await pipe.get(self.key) != self.token:
+                return False
+            pipe.multi()
+            command(pipe)
+            try:
+                await pipe.execute()
+            except WatchError:
+                return False
+        return True
@@ -0,0 +1,112 @@
+import heapq
+from itertools import product
+from typing import TYPE_CHECKING, Iterator
+
+from app.models.email import EmailAccount, EmailImportance
+
+if TYPE_CHECKING:
+    from app.services.ruleset import CompiledRule, EmailContext
+
+# Fields with a small closed set of values: candidate lists are precomputed for
+# every combination, so filtering on them costs a single dict lookup per email.
+ENUM_FIELDS: dict[str, tuple[str, ...]] = {
+    "account": tuple(a.value for a in EmailAccount),
+    "importance": tuple(i.value for i in EmailImportance),
+}
+
+
+def sender_domain(address_lower: str) -> str:
+    return address_lower.rpartition("@")[2]
+
+
+def sender_address(value_lower: str) -> str:
+    """Bare address of a sender field: "Name <a@b.de>" -> "a@b.de"."""
+    start = value_lower.rfind("<")
+    if start != -1:
+        end = value_lower.find(">", start)
+        if end != -1:
+            value_lower = value_lower[start + 1 : end]
+    return value_lower.strip()
+
+
+class RuleIndex:
+    """Pre-partitions rules by discriminating fields so an email is only
+    evaluated against rules that can possibly match it.
+
+    Only match_type "all" rules are partitioned – every one of their conditions
+    must hold, so an `equals`/`not_equals` on account or importance, or an
+    `equals`/`address_in`/`domain_in` on from_address (which pin the sender
+    domain), rules them out for emails with other values. Candidates are returned in ruleset order,
+    which keeps first-match semantics unchanged.
+    """
+
+    def __init__(self, rules: "tuple[CompiledRule, ...]" = ()):
+        self.rules = rules
+        general: dict[tuple[str, ...], list[int]] = {key: [] for key in product(*ENUM_FIELDS.values())}
+        by_domain: dict[str, dict[tuple[str, ...], list[int]]] = {}
+
+        for rule in rules:
+            if not rule.conditions:
+                continue  # can never match
+            allowed, domains = _constraints(rule)
+            keys = [key for key in general if all(v in a for v, a in zip(key, allowed))]
+            if domains is None:
+                for key in keys:
+                    general[key].append(rule.index)
+            else:
+                for domain in domains:
+                    per_key = by_domain.setdefault(domain, {})
+                    for key in keys:
+                        per_key.setdefault(key, []).append(rule.index)
+
+        self._general = {key: tuple(indices) for key, indices in general.items()}
+        self._by_domain = {
+            domain: {key: tuple(indices) for key, indices in per_key.items()}
+            for domain, per_key in by_domain.items()
+        }
+
+    def candidates(self, ctx: "EmailContext") -> Iterator["CompiledRule"]:
+        """Rules that may match the email in ctx, in evaluation order."""
+        key = tuple(ctx.field(name) for name in ENUM_FIELDS)
+        general = self._general.get(key, ())
+        specific = ()
+        if self._by_domain:
+            per_key = self._by_domain.get(ctx.sender("from_address")[1])
+            if per_key:
+                specific = per_key.get(key, ())
+
+        rules = self.rules
+        if not specific:
+            return (rules[i] for i in general)
+        return (rules[i] for i in heapq.merge(general, specific))
+
+
+def _constraints(rule: "CompiledRule") -> tuple[list[set[str]], set[str] | None]:
+    """Values of each ENUM_FIELDS entry the rule can match, and the sender domains it is pinned to."""
+    allowed = [set(values) for values in ENUM_FIELDS.values()]
+    domains: set[str] | None = None
+    if not rule.match_all:
+        return allowed, domains
+
+    positions = {name: i for i, name in enumerate(ENUM_FIELDS)}
+    for cond in rule.conditions:
+        position = positions.get(cond.field)
+        if position is not None:
+            if cond.operator == "equals":
+                allowed[position] &= set(cond.values_lower)
+            elif cond.operator == "not_equals":
+                allowed[position] -= set(cond.values_lower)
+        elif cond.field == "from_address":
+            pinned: set[str] | None = None
+            if cond.operator == "equals":
+                # Parsed like EmailContext.sender, so "Foo <x@y.de>" is filed under y.de
+                addresses = [sender_address(v) for v in cond.values_lower]
+                if all("@" in a for a in addresses):
+                    pinned = {sender_domain(a) for a in addresses}
+            elif cond.operator == "address_in":
+                pinned = {sender_domain(v) if "@" in v else "" for v in cond.value_set}
+            elif cond.operator == "domain_in":
+                pinned = set(cond.value_set)
+            if pinned is not None:
+                domains = pinned if domains is None else domains & pinned
+    return allowed, domains
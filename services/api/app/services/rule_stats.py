@@ -0,0 +1,112 @@
+import threading
+from datetime import datetime, timezone
+
+from app.models.email import EmailRuleConditionStats, EmailRuleStats, EmailRuleStatsResponse
+from app.services.ruleset import CompiledRuleset
+
+
+class _Counters:
+    __slots__ = ("evaluations", "matches", "total_ns")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.total_ns = 0
+
+
+class RuleProfiler:
+    """Per-rule and per-condition evaluation counters for the classifier.
+
+    Only fed while enabled, so the normal request path pays nothing. Counters
+    are keyed by rule/condition index and reset automatically when a different
+    ruleset version is evaluated.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, version: str | None = None) -> None:
+        with self._lock:
+            self.version = version
+            self.since = datetime.now(timezone.utc)
+            self.emails = 0
+            self._rules: dict[int, _Counters] = {}
+            self._first_matches: dict[int, int] = {}
+            self._conditions: dict[tuple[int, int], _Counters] = {}
+
+    def begin(self, ruleset: CompiledRuleset) -> None:
+        """Called once per classified email."""
+        if ruleset.version != self.version:
+            self.reset(ruleset.version)
+        with self._lock:
+            self.emails += 1
+
+    def record_rule(self, rule_index: int, matched: bool, elapsed_ns: int) -> None:
+        with self._lock:
+            self._add(self._rules, rule_index, matched, elapsed_ns)
+
+    def record_first_match(self, rule_index: int) -> None:
+        with self._lock:
+            self._first_matches[rule_index] = self._first_matches.get(rule_index, 0) + 1
+
+    def record_condition(self, key: tuple[int, int], matched: bool, elapsed_ns: int) -> None:
+        with self._lock:
+            self._add(self._conditions, key, matched, elapsed_ns)
+
+    @staticmethod
+    def _add(table: dict, key, matched: bool, elapsed_ns: int) -> None:
+        counters = table.get(key)
+        if counters is None:
+            counters = table[key] = _Counters()
+        counters.evaluations += 1
+        counters.matches += matched
+        counters.total_ns += elapsed_ns
+
+    def snapshot(self, ruleset: CompiledRuleset) -> EmailRuleStatsResponse:
+        """Stats for every rule of ruleset, in evaluation order (zeros if never evaluated)."""
+        same_version = ruleset.version == self.version
+        rules = []
+        with self._lock:
+            for rule in ruleset.rules:
+                counters = self._rules.get(rule.index) if same_version else None
+                conditions = []
+                for condition in rule.conditions:
+                    cond_counters = self._conditions.get(condition.key) if same_version else None
+                    conditions.append(
+                        EmailRuleConditionStats(
+                            index=condition.key[1],
+                            field=condition.field,
+                            operator=condition.operator,
+                            **_counter_fields(cond_counters),
+                        )
+                    )
+                rules.append(
+                    EmailRuleStats(
+                        name=rule.name,
+                        category=rule.category,
+                        first_matches=self._first_matches.get(rule.index, 0) if same_version else 0,
+                        conditions=conditions,
+                        **_counter_fields(counters),
+                    )
+                )
+            return EmailRuleStatsResponse(
+                enabled=self.enabled,
+                ruleset_version=ruleset.version,
+                since=self.since,
+                emails=self.emails if same_version else 0,
+                rules=rules,
+            )
+
+
+def _counter_fields(counters: _Counters | None) -> dict:
+    if counters is None:
+        return {"evaluations": 0, "matches": 0, "total_ms": 0.0, "avg_us": 0.0}
+    return {
+        "evaluations": counters.evaluations,
+        "matches": counters.matches,
+        "total_ms": round(counters.total_ns / 1e6, 3),
+        "avg_us": round(counters.total_ns / counters.evaluations / 1e3, 2) if counters.evaluations else 0.0,
+    }
+
@@ -0,0 +1,472 @@
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable
+
+from pydantic import ValidationError
+
+from app.models.email import (
+    EmailAction,
+    EmailBodyType,
+    EmailCategory,
+    EmailClassifyRequest,
+    EmailPriority,
+    EmailRule,
+)
+from app.services.aho_corasick import AhoCorasick
+from app.services.body_scan import BODY_FIELD, body_hits
+from app.services.rule_index import RuleIndex, sender_address, sender_domain
+from app.services.sender_history import SenderStats
+
+logger = logging.getLogger(__name__)
+
+# CompiledRuleset.source of rules compiled from the rules file
+FILE_SOURCE = "config_file"
+
+
+class RulesetError(Exception):
+    """Raised when a rules document cannot be compiled into a usable ruleset."""
+
+
+# Operators answered from the per-field keyword automaton instead of substring loops
+KEYWORD_OPERATORS = frozenset({"contains_any", "not_contains_any"})
+# Operators answered by hash lookups on the parsed sender address
+SET_OPERATORS = frozenset({"domain_in", "address_in", "domain_suffix_in"})
+# Operators answered from the sender history, which is kept for from_address only
+HISTORY_OPERATORS = frozenset({"sender_known", "sender_seen_count_gte"})
+
+
+@dataclass(frozen=True)
+class CompiledCondition:
+    """A single rule condition with lowercased values and a bound matcher."""
+
+    field: str
+    operator: str
+    values: tuple[str, ...]
+    values_lower: tuple[str, ...]
+    matcher: Callable[["CompiledCondition", "EmailContext"], tuple[bool, str]]
+    key: tuple[int, int] = (-1, -1)  # (rule index, condition index) in the ruleset
+    value_set: frozenset[str] = frozenset()  # normalised values of the set operators
+    patterns: tuple[re.Pattern, ...] = ()  # compiled values of "regex"
+    threshold: int = 0  # value of sender_seen_count_gte
+
+    def match(self, ctx: "EmailContext") -> tuple[bool, str]:
+        """Match against the email held by ctx. Returns (matched, reason)."""
+        return self.matcher(self, ctx)
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    name: str
+    category: EmailCategory
+    priority: EmailPriority
+    actions: tuple[EmailAction, ...]
+    match_all: bool
+    conditions: tuple[CompiledCondition, ...]
+    index: int = 0  # position in the ruleset, i.e. evaluation order
+
+
+@dataclass(frozen=True)
+class CompiledRuleset:
+    """Immutable, ready-to-evaluate snapshot of the rules file.
+
+    The classifier swaps the whole object on reload, so a request always sees
+    one consistent version of the rules.
+    """
+
+    rules: tuple[CompiledRule, ...]
+    models: tuple[EmailRule, ...]
+    version: str
+    loaded_at: datetime
+    # One automaton per email field over every contains_any/not_contains_any keyword;
+    # payloads are ((rule index, condition index), value index)
+    automata: dict[str, AhoCorasick[tuple[tuple[int, int], int]]] = field(default_factory=dict)
+    rule_index: RuleIndex = field(default_factory=RuleIndex)
+    # Files referenced by "values_file", watched for changes like the rules file
+    value_files: tuple[Path, ...] = ()
+    source: str = FILE_SOURCE  # where the rules came from, reported by GET /rules
+    # Increases with every version published to a shared snapshot store; 0 without one
+    revision: int = 0
+    # Some condition needs per-sender counters, which cost a Redis lookup per email
+    uses_sender_counts: bool = False
+    # Some condition reads the full body, which is then scanned while it arrives
+    scans_body: bool = False
+
+    @classmethod
+    def empty(cls) -> "CompiledRuleset":
+        return cls(rules=(), models=(), version="empty", loaded_at=datetime.now(timezone.utc))
+
+
+class EmailContext:
+    """Per-email evaluation state: lowercased fields and keyword hits, each computed once.
+
+    sender_stats is what the sender history knows about the sender (None
+    without one), looked up before evaluation because it may need Redis.
+    """
+
+    __slots__ = ("email", "ruleset", "sender_stats", "_fields", "_hits", "_senders")
+
+    def __init__(
+        self, email: EmailClassifyRequest, ruleset: CompiledRuleset, sender_stats: SenderStats | None = None
+    ):
+        self.email = email
+        self.ruleset = ruleset
+        self.sender_stats = sender_stats
+        self._fields: dict[str, str] = {}
+        self._hits: dict[str, dict[tuple[int, int], int]] = {}
+        self._senders: dict[str, tuple[str, str]] = {}
+
+    def field(self, name: str) -> str:
+        """Lowercased value of an email field ("" for unknown fields)."""
+        value = self._fields.get(name)
+        if value is None:
+            value = _get_field_value(name, self.email).lower()
+            self._fields[name] = value
+        return value
+
+    def sender(self, name: str = "from_address") -> tuple[str, str]:
+        """(address, domain) parsed from a field, e.g. ("a@b.de", "b.de") for "A <a@B.de>"."""
+        parsed = self._senders.get(name)
+        if parsed is None:
+            address = sender_address(self.field(name))
+            parsed = (address, sender_domain(address) if "@" in address else "")
+            self._senders[name] = parsed
+        return parsed
+
+    def keyword_hits(self, name: str) -> dict[tuple[int, int], int]:
+        """Map of condition key -> index of its first listed keyword found in the field.
+
+        The field is scanned once by the ruleset's automaton; every keyword
+        condition on that field is answered from the result. The body is
+        scanned in chunks instead of lowercasing a copy of it.
+        """
+        hits = self._hits.get(name)
+        if hits is None:
+            automaton = self.ruleset.automata.get(name)
+            if name == BODY_FIELD:
+                html_body = self.email.body_content_type == EmailBodyType.HTML
+                hits = body_hits(automaton, self.email.body, html_body)
+            else:
+                hits = {}
+                if automaton is not None:
+                    for key, value_index in automaton.iter_matches(self.field(name)):
+                        previous = hits.get(key)
+                        if previous is None or value_index < previous:
+                            hits[key] = value_index
+            self._hits[name] = hits
+        return hits
+
+    def set_keyword_hits(self, name: str, hits: dict[tuple[int, int], int]) -> None:
+        """Use hits found elsewhere (e.g. while a body was streamed) for a field."""
+        self._hits[name] = hits
+
+
+def _get_field_value(field: str, email: EmailClassifyRequest) -> str:
+    """Extract a field value from the email as a string."""
+    field_map = {
+        "from_address": email.from_address,
+        "from_name": email.from_name,
+        "subject": email.subject,
+        "body_preview": email.body_preview,
+        "account": email.account.value,
+        "importance": email.importance.value,
+    }
+    return field_map.get(field, "")
+
+
+def _match_contains_any(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    value_index = ctx.keyword_hits(cond.field).get(cond.key)
+    if value_index is not None:
+        return True, f"{cond.field} contains '{cond.values[value_index]}'"
+    return False, ""
+
+
+def _match_not_contains_any(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    if cond.key in ctx.keyword_hits(cond.field):
+        return False, ""
+    return True, f"{cond.field} does not contain blocked patterns"
+
+
+def _match_equals(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    field_lower = ctx.field(cond.field)
+    for value, value_lower in zip(cond.values, cond.values_lower):
+        if field_lower == value_lower:
+            return True, f"{cond.field} equals '{value}'"
+    return False, ""
+
+
+def _match_not_equals(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    if ctx.field(cond.field) in cond.values_lower:
+        return False, ""
+    return True, f"{cond.field} is not in excluded values"
+
+
+def _match_domain_in(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    domain = ctx.sender(cond.field)[1]
+    if domain and domain in cond.value_set:
+        return True, f"{cond.field} domain is '{domain}'"
+    return False, ""
+
+
+def _match_address_in(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    address = ctx.sender(cond.field)[0]
+    if address and address in cond.value_set:
+        return True, f"{cond.field} is '{address}'"
+    return False, ""
+
+
+def _match_domain_suffix_in(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    # One set lookup per label boundary: mail.shop.example.com checks
+    # mail.shop.example.com, shop.example.com, example.com and com
+    suffix = ctx.sender(cond.field)[1]
+    while suffix:
+        if suffix in cond.value_set:
+            return True, f"{cond.field} domain ends with '{suffix}'"
+        suffix = suffix.partition(".")[2]
+    return False, ""
+
+
+def _match_regex(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    text = ctx.field(cond.field)
+    for value, pattern in zip(cond.values, cond.patterns):
+        if pattern.search(text):
+            return True, f"{cond.field} matches /{value}/"
+    return False, ""
+
+
+def _match_sender_known(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    stats = ctx.sender_stats
+    if stats is not None and stats.known:
+        return True, "sender is known"
+    return False, ""
+
+
+def _match_sender_seen_count_gte(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    stats = ctx.sender_stats
+    if stats is not None and stats.count >= cond.threshold:
+        return True, f"sender seen {stats.count} times before"
+    return False, ""
+
+
+def _match_unknown(cond: CompiledCondition, ctx: EmailContext) -> tuple[bool, str]:
+    return False, ""
+
+
+OPERATORS: dict[str, Callable[[CompiledCondition, EmailContext], tuple[bool, str]]] = {
+    "contains_any": _match_contains_any,
+    "not_contains_any": _match_not_contains_any,
+    "equals": _match_equals,
+    "not_equals": _match_not_equals,
+    "domain_in": _match_domain_in,
+    "address_in": _match_address_in,
+    "domain_suffix_in": _match_domain_suffix_in,
+    "regex": _match_regex,
+    "sender_known": _match_sender_known,
+    "sender_seen_count_gte": _match_sender_seen_count_gte,
+}
+
+
+@lru_cache(maxsize=4096)
+def _compile_regex(pattern: str) -> re.Pattern:
+    """Compiled patterns are shared across reloads, so unchanged rules are not recompiled."""
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def _normalize_set_value(operator: str, value: str) -> str:
+    value = value.strip().lower()
+    if operator == "address_in":
+        return sender_address(value)
+    # "@example.com", ".example.com" and "example.com." all mean example.com
+    return value.lstrip("@.").rstrip(".")
+
+
+class _ValueFiles:
+    """Reads the files rules reference via "values_file", each once per compile.
+
+    Files hold one value per line; blank lines and lines starting with '#'
+    are ignored. Relative paths are resolved against the rules file's
+    directory.
+    """
+
+    def __init__(self, base_dir: Path | None):
+        self.base_dir = base_dir
+        self.contents: dict[Path, bytes] = {}
+        self._values: dict[Path, tuple[str, ...]] = {}
+
+    def read(self, rule_name: str, reference: str) -> tuple[str, ...]:
+        path = Path(reference)
+        if not path.is_absolute():
+            if self.base_dir is None:
+                raise RulesetError(f"Rule '{rule_name}': values_file '{reference}' needs a rules directory")
+            path = self.base_dir / path
+        values = self._values.get(path)
+        if values is None:
+            try:
+                raw = path.read_bytes()
+                text = raw.decode()
+            except (OSError, UnicodeDecodeError) as e:
+                raise RulesetError(f"Rule '{rule_name}': cannot read values_file '{reference}': {e}") from e
+            values = tuple(
+                line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")
+            )
+            self.contents[path] = raw
+            self._values[path] = values
+        return values
+
+
+def _compile_condition(
+    rule_name: str, condition: dict, key: tuple[int, int], value_files: _ValueFiles
+) -> CompiledCondition:
+    if not isinstance(condition, dict):
+        raise RulesetError(f"Rule '{rule_name}': conditions must be objects, got {condition!r}")
+    raw_values = condition.get("values", [])
+    if not isinstance(raw_values, list):
+        raise RulesetError(f"Rule '{rule_name}': values must be a list, got {raw_values!r}")
+    operator = condition.get("operator", "")
+    field_name = condition.get("field", "")
+    matcher = OPERATORS.get(operator)
+    if matcher is None:
+        # As before compilation: the condition never matches, the rest of the file still loads
+        logger.warning("Rule '%s': unknown operator %r, condition never matches", rule_name, operator)
+        return CompiledCondition(
+            field=field_name, operator=operator, values=(), values_lower=(), matcher=_match_unknown, key=key
+        )
+    values = tuple(str(v) for v in raw_values)
+    if "values_file" in condition:
+        values += value_files.read(rule_name, str(condition["values_file"]))
+
+    value_set: frozenset[str] = frozenset()
+    if operator in SET_OPERATORS:
+        value_set = frozenset(filter(None, (_normalize_set_value(operator, v) for v in values)))
+    patterns: tuple[re.Pattern, ...] = ()
+    if operator == "regex":
+        try:
+            patterns = tuple(_compile_regex(v) for v in values)
+        except re.error as e:
+            raise RulesetError(f"Rule '{rule_name}': invalid regex: {e}") from e
+    if field_name == BODY_FIELD and operator not in KEYWORD_OPERATORS:
+        raise RulesetError(f"Rule '{rule_name}': {BODY_FIELD} only supports contains_any and not_contains_any")
+    threshold = 0
+    if operator in HISTORY_OPERATORS:
+        if field_name != "from_address":
+            raise RulesetError(f"Rule '{rule_name}': {operator} only applies to from_address")
+        if operator == "sender_seen_count_gte":
+            try:
+                (threshold,) = (int(v) for v in values)
+            except ValueError as e:
+                raise RulesetError(f"Rule '{rule_name}': {operator} needs exactly one integer value") from e
+            if threshold < 1:
+                # 0 would match every email, whether the sender was ever seen or not
+                raise RulesetError(f"Rule '{rule_name}': {operator} needs a value of at least 1")
+
+    return CompiledCondition(
+        field=field_name,
+        operator=operator,
+        values=values,
+        values_lower=tuple(v.lower() for v in values),
+        matcher=matcher,
+        key=key,
+        value_set=value_set,
+        patterns=patterns,
+        threshold=threshold,
+    )
+
+
+def _build_automata(
+    rules: list[CompiledRule],
+) -> dict[str, AhoCorasick[tuple[tuple[int, int], int]]]:
+    patterns: dict[str, list[tuple[str, tuple[tuple[int, int], int]]]] = {}
+    for rule in rules:
+        for cond in rule.conditions:
+            if cond.operator in KEYWORD_OPERATORS:
+                field_patterns = patterns.setdefault(cond.field, [])
+                for value_index, value_lower in enumerate(cond.values_lower):
+                    field_patterns.append((value_lower, (cond.key, value_index)))
+    return {name: AhoCorasick(p) for name, p in patterns.items()}
+
+
+def compile_ruleset(
+    data: dict, version: str, base_dir: str | Path | None = None, source: str = FILE_SOURCE
+) -> CompiledRuleset:
+    """Validate a parsed rules document and compile it into a CompiledRuleset.
+
+    base_dir resolves relative values_file references. When the document
+    references any, their contents are folded into the version.
+    """
+    if not isinstance(data, dict):
+        raise RulesetError("Rules document must be a JSON object")
+
+    value_files = _ValueFiles(Path(base_dir) if base_dir is not None else None)
+    rules = []
+    models = []
+    for rule_index, raw in enumerate(data.get("rules", [])):
+        if not isinstance(raw, dict):
+            raise RulesetError(f"Rule entries must be objects, got {raw!r}")
+        try:
+            model = EmailRule(
+                name=raw["name"],
+                category=raw["category"],
+                priority=raw["priority"],
+                actions=raw["actions"],
+                conditions=raw["conditions"],
+                description=raw.get("description", ""),
+            )
+        except (KeyError, TypeError, ValidationError) as e:
+            raise RulesetError(f"Invalid rule '{raw.get('name', '?')}': {e}") from e
+
+        conditions = model.conditions
+        if not isinstance(conditions.get("rules", []), list):
+            raise RulesetError(f"Rule '{model.name}': conditions.rules must be a list")
+        rules.append(
+            CompiledRule(
+                name=model.name,
+                category=model.category,
+                priority=model.priority,
+                actions=tuple(model.actions),
+                match_all=conditions.get("match_type", "any") == "all",
+                conditions=tuple(
+                    _compile_condition(model.name, c, (rule_index, i), value_files)
+                    for i, c in enumerate(conditions.get("rules", []))
+                ),
+                index=rule_index,
+            )
+        )
+        models.append(model)
+
+    if value_files.contents:
+        version = ruleset_version(b"\0".join([version.encode(), *value_files.contents.values()]))
+    return CompiledRuleset(
+        rules=tuple(rules),
+        models=tuple(models),
+        version=version,
+        loaded_at=datetime.now(timezone.utc),
+        automata=_build_automata(rules),
+        rule_index=RuleIndex(tuple(rules)),
+        value_files=tuple(value_files.contents),
+        source=source,
+        uses_sender_counts=any(
+            cond.operator == "sender_seen_count_gte" for rule in rules for cond in rule.conditions
+        ),
+        scans_body=any(
+            cond.field == BODY_FIELD and cond.operator in KEYWORD_OPERATORS for rule in rules for cond in rule.conditions
+        ),
+    )
+
+
+def ruleset_version(raw: bytes) -> str:
+    """Content hash of a rules document, used as its version identifier."""
+    return hashlib.sha256(raw).hexdigest()[:12]
+
+
+def parse_ruleset(raw: bytes, version: str | None = None, base_dir: str | Path | None = None) -> CompiledRuleset:
+    """Parse and compile the raw bytes of a rules file. Raises RulesetError."""
+    try:
+        data = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise RulesetError(f"Invalid JSON in rules file: {e}") from e
+    return compile_ruleset(data, version=version or ruleset_version(raw), base_dir=base_dir)
@@ -0,0 +1,130 @@
+import dataclasses
+import fcntl
+import json
+import logging
+import os
+import pickle
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from app.services.ruleset import FILE_SOURCE, CompiledRuleset
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "current.json"
+LOCK_FILE = "ruleset.lock"
+
+Signature = tuple[tuple[int, int], ...]
+
+
+@dataclass(frozen=True)
+class SnapshotMeta:
+    revision: int
+    version: str
+    file: str
+    value_files: tuple[Path, ...]
+    # (mtime_ns, size) of the rules file and its values files when the
+    # snapshot was published; None for snapshots of older releases
+    signature: Signature | None
+    # CompiledRuleset.source: rules published from elsewhere (Baserow) stay
+    # current until the rules file changes
+    source: str = FILE_SOURCE
+
+
+class RulesetSnapshotStore:
+    """Compiled rulesets shared by all uvicorn workers through one directory.
+
+    The first worker that sees a new rules version compiles it and writes the
+    pickled CompiledRuleset as `ruleset-<revision>.pkl`; siblings unpickle that
+    file instead of compiling themselves, so start-up cost does not grow with
+    the number of workers (each still holds its own copy in memory). Revisions only ever increase and are bumped only when
+    the content version changes. Writers hold an exclusive flock on
+    `ruleset.lock`; readers need no lock because files are replaced atomically.
+    """
+
+    def __init__(self, directory: str | Path, keep: int = 2):
+        self.directory = Path(directory)
+        self.keep = keep
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """Exclusive lock across processes; hold it while checking and publishing."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / LOCK_FILE, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def meta(self) -> SnapshotMeta | None:
+        try:
+            data = json.loads((self.directory / META_FILE).read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error("Unreadable ruleset snapshot metadata in %s: %s", self.directory, e)
+            return None
+        signature = data.get("signature")
+        return SnapshotMeta(
+            revision=data["revision"],
+            version=data["version"],
+            file=data["file"],
+            value_files=tuple(Path(p) for p in data.get("value_files", [])),
+            signature=tuple(tuple(s) for s in signature) if signature is not None else None,
+            source=data.get("source", FILE_SOURCE),
+        )
+
+    def load(self, meta: SnapshotMeta) -> CompiledRuleset:
+        with open(self.directory / meta.file, "rb") as f:
+            return pickle.load(f)
+
+    def publish(self, ruleset: CompiledRuleset, signature: Signature, replace: bool = False) -> CompiledRuleset:
+        """Store ruleset and return it with its revision. Call while holding lock().
+
+        A ruleset whose version is already stored keeps that revision (only
+        the signature is updated), so identical content never bumps it;
+        replace=True rewrites it anyway, for a snapshot that failed to load.
+        """
+        meta = self.meta()
+        if meta is not None and meta.version == ruleset.version and not replace:
+            stored = dataclasses.replace(ruleset, revision=meta.revision)
+            if meta.signature != signature or meta.source != ruleset.source:
+                self._write_meta(dataclasses.replace(meta, signature=signature, source=ruleset.source))
+            return stored
+
+        revision = (meta.revision if meta is not None else 0) + 1
+        stored = dataclasses.replace(ruleset, revision=revision)
+        name = f"ruleset-{revision:06d}.pkl"
+        tmp = self.directory / f".{name}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.directory / name)
+        self._write_meta(SnapshotMeta(revision, ruleset.version, name, ruleset.value_files, signature, ruleset.source))
+        self._prune(revision)
+        logger.info("Published ruleset %s as revision %d", ruleset.version, revision)
+        return stored
+
+    def _write_meta(self, meta: SnapshotMeta) -> None:
+        data = {
+            "revision": meta.revision,
+            "version": meta.version,
+            "file": meta.file,
+            "value_files": [str(p) for p in meta.value_files],
+            "signature": [list(s) for s in meta.signature] if meta.signature is not None else None,
+            "source": meta.source,
+        }
+        tmp = self.directory / f".{META_FILE}.tmp"
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, self.directory / META_FILE)
+
+    def _prune(self, revision: int) -> None:
+        # Older snapshots may still be mapped by a sibling; unlinking is safe on POSIX
+        for path in self.directory.glob("ruleset-*.pkl"):
+            try:
+                if int(path.stem.split("-")[1]) <= revision - self.keep:
+                    path.unlink()
+            except (ValueError, OSError):
+                continue
@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.metrics import CACHE_REQUESTS, SENDER_HISTORY_UPDATES
+from app.models.email import EmailCategory, EmailClassifyRequest
+from app.services.rule_index import sender_address
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size set membership test with false positives but no false negatives.
+
+    Memory is bits / 8 bytes whatever the number of items added; past the
+    capacity it was sized for, the false-positive rate rises instead. The bit
+    layout matches Redis GETBIT/SETBIT (bit 0 is the most significant bit of
+    byte 0), so a Redis string can hold a copy shared by several processes.
+    """
+
+    def __init__(self, bits: int, hashes: int, data: bytes | None = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+        if len(self.data) != (bits + 7) // 8:
+            raise ValueError(f"Expected {(bits + 7) // 8} bytes for {bits} bits, got {len(self.data)}")
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        """Smallest filter with at most error_rate false positives after `capacity` items."""
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        bits = (bits + 7) // 8 * 8
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        return cls(bits, hashes)
+
+    def positions(self, item: str) -> list[int]:
+        # Double hashing: two 64-bit halves of one digest give all k positions
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item: str) -> bool:
+        """Add item. Returns False if it was (probably) present already."""
+        data = self.data
+        added = False
+        for position in self.positions(item):
+            mask = 0x80 >> (position & 7)
+            if not data[position >> 3] & mask:
+                data[position >> 3] |= mask
+                added = True
+        return added
+
+    def __contains__(self, item: str) -> bool:
+        data = self.data
+        return all(data[p >> 3] & (0x80 >> (p & 7)) for p in self.positions(item))
+
+    def merge(self, data: bytes) -> None:
+        """OR in the bits of another filter with the same size."""
+        if len(data) != len(self.data):
+            raise ValueError(f"Cannot merge {len(data)} bytes into a {len(self.data)}-byte filter")
+        merged = int.from_bytes(self.data, "big") | int.from_bytes(data, "big")
+        self.data[:] = merged.to_bytes(len(self.data), "big")
+
+    def approximate_count(self) -> int:
+        """Estimated number of distinct items added, from the share of set bits."""
+        set_bits = min(int.from_bytes(self.data, "big").bit_count(), self.bits - 1)
+        return round(-self.bits / self.hashes * math.log(1 - set_bits / self.bits))
+
+
+@dataclass(frozen=True)
+class SenderStats:
+    """What is known about the sender of an email before it is classified."""
+
+    known: bool = False
+    # Emails from this sender classified before (0 if not looked up)
+    count: int = 0
+    first_seen: datetime | None = None
+    last_category: str | None = None
+
+
+UNKNOWN_SENDER = SenderStats()
+
+
+class SenderHistory:
+    """Known-correspondent index for the sender_known and sender_seen_count_gte conditions.
+
+    Membership is answered by a Bloom filter in memory, so asking about a
+    sender costs a few hashes and no I/O; per-sender counters (first seen,
+    count, last category) live in Redis hashes that expire after ttl_seconds
+    without mail. record() never blocks: updates are queued and written by a
+    background task in one pipeline per batch, together with the filter bits
+    in a shared Redis string. Every sync_interval the shared bits are merged
+    back, so senders recorded by sibling workers (or before a restart) become
+    known here too. Redis errors only delay updates; they never fail a request.
+    """
+
+    def __init__(
+        self,
+        bloom: BloomFilter,
+        client: Redis | None = None,
+        prefix: str = "lm:sender",
+        ttl_seconds: int = 400 * 24 * 3600,
+        flush_interval: float = 1.0,
+        sync_interval: float = 60.0,
+        batch_size: int = 500,
+        max_pending: int = 20000,
+        backoff_seconds: float = 30.0,
+    ):
+        self.bloom = bloom
+        self.client = client
+        self.prefix = prefix
+        # Size in the key: a filter resized by configuration starts afresh
+        self.bloom_key = f"{prefix}:bloom:{bloom.bits}:{bloom.hashes}"
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.backoff_seconds = backoff_seconds
+        self._pending: deque[tuple[str, str, str]] = deque()
+        self._task: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
+        self._unavailable_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None and time.monotonic() >= self._unavailable_until
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def key_for(self, address: str) -> str:
+        return f"{self.prefix}:{address}"
+
+    def stats(self, email: EmailClassifyRequest) -> SenderStats:
+        """Membership only, from the in-memory filter."""
+        address = _address(email)
+        return SenderStats(known=True) if address and address in self.bloom else UNKNOWN_SENDER
+
+    async def lookup(self, email: EmailClassifyRequest) -> SenderStats:
+        """Membership plus the Redis counters of a known sender.
+
+        Senders the filter has never seen are answered without a round trip.
+        """
+        address = _address(email)
+        if not address or address not in self.bloom:
+            CACHE_REQUESTS.labels(cache="sender_history", result="miss").inc()
+            return UNKNOWN_SENDER
+        if not self.enabled:
+            return SenderStats(known=True)
+        try:
+            raw = await self.client.hgetall(self.key_for(address))
+        except RedisError as e:
+            CACHE_REQUESTS.labels(cache="sender_history", result="error").inc()
+            self._back_off(e)
+            return SenderStats(known=True)
+        return _counted_stats(raw)
+
+    async def lookup_many(self, emails: list[EmailClassifyRequest]) -> list[SenderStats]:
+        """lookup() for every email, with one pipelined round trip for the known senders."""
+        addresses = [_address(email) for email in emails]
+        results: list[SenderStats | None] = [None] * len(emails)
+        known = []
+        for i, address in enumerate(addresses):
+            if address and address in self.bloom:
+                known.append(i)
+            else:
+                CACHE_REQUESTS.labels(cache="sender_history", result="miss").inc()
+                results[i] = UNKNOWN_SENDER
+        if known and self.enabled:
+            pipe = self.client.pipeline(transaction=False)
+            for i in known:
+                pipe.hgetall(self.key_for(addresses[i]))
+            try:
+                raws = await pipe.execute()
+            except RedisError as e:
+                CACHE_REQUESTS.labels(cache="sender_history", result="error").inc(len(known))
+                self._back_off(e)
+            else:
+                for i, raw in zip(known, raws):
+                    results[i] = _counted_stats(raw)
+        return [stats or SenderStats(known=True) for stats in results]
+
+    def record(self, email: EmailClassifyRequest, category: EmailCategory) -> bool:
+        """Add a classified email to the history. Returns False if the Redis update was dropped."""
+        address = _address(email)
+        if not address:
+            return False
+        self.bloom.add(address)
+        if not self.running:
+            return False
+        if len(self._pending) >= self.max_pending:
+            SENDER_HISTORY_UPDATES.labels(result="dropped").inc()
+            return False
+        self._pending.append((address, category.value, datetime.now(timezone.utc).isoformat()))
+        return True
+
+    async def start(self) -> None:
+        if self.client is None:
+            raise RuntimeError("SenderHistory needs a Redis client before it can start")
+        await self.sync()
+        logger.info("Sender history: about %d known senders", self.bloom.approximate_count())
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write whatever is still queued, then stop the background task."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        last_sync = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if time.monotonic() - last_sync >= self.sync_interval:
+                await self.sync()
+                last_sync = time.monotonic()
+
+    async def flush(self) -> None:
+        """Write queued updates to Redis, one pipeline per batch."""
+        while self._pending and self.enabled:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            pipe = self.client.pipeline(transaction=False)
+            for address, category, seen_at in batch:
+                for position in self.bloom.positions(address):
+                    pipe.setbit(self.bloom_key, position, 1)
+                key = self.key_for(address)
+                pipe.hsetnx(key, "first_seen", seen_at)
+                pipe.hincrby(key, "count", 1)
+                pipe.hset(key, mapping={"last_category": category, "last_seen": seen_at})
+                pipe.expire(key, self.ttl_seconds)
+            try:
+                await pipe.execute()
+            except RedisError as e:
+                # Put the batch back; the filter bits are idempotent and a
+                # repeated count beats a lost one
+                self._pending.extendleft(reversed(batch))
+                self._back_off(e)
+                return
+            SENDER_HISTORY_UPDATES.labels(result="written").inc(len(batch))
+
+    async def sync(self) -> None:
+        """Merge the shared filter into the local one (seeding it if Redis lost it)."""
+        if not self.enabled:
+            return
+        try:
+            shared = await self.client.get(self.bloom_key)
+            if shared is None:
+                await self.client.set(self.bloom_key, bytes(self.bloom.data), nx=True)
+                return
+        except RedisError as e:
+            self._back_off(e)
+            return
+        try:
+            self.bloom.merge(shared)
+        except ValueError as e:
+            logger.error("Ignoring shared sender filter %s: %s", self.bloom_key, e)
+
+    def _back_off(self, error: Exception) -> None:
+        logger.warning("Sender history unavailable, bypassing Redis for %.0fs: %s", self.backoff_seconds, error)
+        self._unavailable_until = time.monotonic() + self.backoff_seconds
+
+
+def _address(email: EmailClassifyRequest) -> str:
+    return sender_address(email.from_address.lower())
+
+
+def _counted_stats(raw: dict[bytes, bytes]) -> SenderStats:
+    if not raw:
+        # A false positive of the filter, or counters that expired
+        CACHE_REQUESTS.labels(cache="sender_history", result="miss").inc()
+        return SenderStats(known=True)
+    CACHE_REQUESTS.labels(cache="sender_history", result="hit").inc()
+    return _parse_stats(raw)
+
+
+def _parse_stats(raw: dict[bytes, bytes]) -> SenderStats:
+    first_seen = raw.get(b"first_seen")
+    last_category = raw.get(b"last_category")
+    return SenderStats(
+        known=True,
+        count=int(raw.get(b"count", 0)),
+        first_seen=datetime.fromisoformat(first_seen.decode()) if first_seen else None,
+        last_category=last_category.decode() if last_category else None,
+    )
@@ -0,0 +1,377 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+import httpx
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.metrics import TELEGRAM_MESSAGES
+from app.models.email import EmailAccount, EmailClassifyRequest, EmailClassifyResponse
+from app.services.redis_lease import RedisLease
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_EMOJI = {"high": "🔴", "medium": "🟡", "low": "⚪"}
+CATEGORY_LABELS = {
+    "server_alert": "Server Alert",
+    "invoice": "Rechnung",
+    "client_inquiry": "Kundenanfrage",
+    "newsletter": "Newsletter",
+    "personal": "Persönlich",
+    "spam_suspect": "Spam-Verdacht",
+    "uncategorized": "Unkategorisiert",
+}
+
+# Telegram rejects messages longer than 4096 characters
+MAX_MESSAGE_LENGTH = 4096
+# Sender and subject are cut to this many characters before escaping (which at most doubles them)
+MAX_FIELD_LENGTH = 300
+DIGEST_MAX_LINES = 15
+# Notifications of all workers, waiting for the one that sends them
+OUTBOX_KEY = "lm:telegram:outbox"
+SENDER_LEASE_KEY = "lm:telegram:sender"
+
+
+class TelegramError(Exception):
+    """Raised when the Bot API rejects a message for good (not rate limiting)."""
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class TelegramClient:
+    """Minimal async Bot API client (sendMessage only)."""
+
+    def __init__(self, token: str, api_base: str = "https://api.telegram.org", http: httpx.AsyncClient | None = None):
+        self.http = http or httpx.AsyncClient(timeout=10.0)
+        self.url = f"{api_base.rstrip('/')}/bot{token}/sendMessage"
+
+    async def send_message(self, chat_id: str, text: str, parse_mode: str = "Markdown") -> float:
+        """Send one message. Returns 0 on success, or the seconds Telegram asks
+        us to wait (HTTP 429) before retrying."""
+        response = await self.http.post(self.url, json={"chat_id": chat_id, "text": text, "parse_mode": parse_mode})
+        if response.status_code == 429:
+            return float(response.json().get("parameters", {}).get("retry_after", 1))
+        if response.status_code >= 400:
+            raise TelegramError(f"sendMessage failed with {response.status_code}: {response.text[:200]}")
+        return 0.0
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+
+@dataclass
+class _Notification:
+    key: tuple[str, str]
+    email: EmailClassifyRequest
+    result: EmailClassifyResponse
+
+
+@dataclass
+class _Digest:
+    started: float
+    items: list[_Notification] = field(default_factory=list)
+
+
+class TelegramDispatcher:
+    """Sends notify_telegram results to one chat, rate limited and coalesced.
+
+    submit() only enqueues; a background task formats and sends. Sends are
+    paced by a per-chat and a global token bucket (Telegram allows about one
+    message per second per chat and 30 per second overall) and honour
+    retry_after on 429. When more than burst_threshold notifications with the
+    same category and sender arrive within burst_window seconds, further ones
+    are collected and sent as a single digest when the window closes.
+
+    With a Redis client (several uvicorn workers), submit() only forwards to
+    a Redis list, and the worker holding the sender lease moves that list
+    into its own queue: one process paces and coalesces all notifications, so
+    the limits and digests hold for the whole deployment. If Redis fails, a
+    worker sends its own notifications instead of losing them.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        chat_id: str,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: int = 3,
+        global_rate: float = 30.0,
+        burst_threshold: int = 5,
+        burst_window: float = 60.0,
+        max_queue: int = 1000,
+        max_retries: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+        redis: Redis | None = None,
+        outbox: str = OUTBOX_KEY,
+        lease_ttl: float = 10.0,
+        poll_interval: float = 0.5,
+    ):
+        self.client = client
+        self.chat_id = chat_id
+        self.burst_threshold = burst_threshold
+        self.burst_window = burst_window
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.clock = clock
+        self._chat_bucket = TokenBucket(per_chat_rate, per_chat_burst, clock)
+        self._global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self._recent: dict[tuple[str, str], deque[float]] = {}
+        self._digests: dict[tuple[str, str], _Digest] = {}
+        self.redis = redis
+        self.outbox = outbox
+        self.poll_interval = poll_interval
+        self.lease = RedisLease(redis, SENDER_LEASE_KEY, lease_ttl) if redis is not None else None
+        self._queue: asyncio.Queue[_Notification | None] | None = None
+        # What this process sends: _queue itself without Redis, else fed from the outbox
+        self._inbox: asyncio.Queue[_Notification | None] | None = None
+        self._task: asyncio.Task | None = None
+        self._relays: list[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def submit(self, email: EmailClassifyRequest, result: EmailClassifyResponse) -> bool:
+        """Queue a notification. Returns False if it was dropped."""
+        if not self.running:
+            return False
+        if self._queue.qsize() >= self.max_queue:
+            TELEGRAM_MESSAGES.labels(result="dropped").inc()
+            return False
+        key = (result.category.value, email.from_address.lower())
+        self._queue.put_nowait(_Notification(key, email, result))
+        return True
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        if self.redis is None:
+            self._inbox = self._queue
+        else:
+            self._inbox = asyncio.Queue()
+            self._relays = [asyncio.create_task(self._forward()), asyncio.create_task(self._lead())]
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Send everything still queued (open digests included), then stop.
+
+        With Redis, this worker's notifications go to the outbox first; the
+        lease holder sends what is left in it before giving up the lease.
+        """
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        if self._relays:
+            await self._relays[0]
+            self._stopping.set()
+            await self._relays[1]
+            self._relays = []
+            self._inbox.put_nowait(None)
+        await self._task
+        self._task = None
+        await self.client.aclose()
+
+    async def _forward(self) -> None:
+        while (item := await self._queue.get()) is not None:
+            payload = json.dumps(
+                {"email": item.email.model_dump(mode="json"), "result": item.result.model_dump(mode="json")}
+            )
+            try:
+                await self.redis.rpush(self.outbox, payload)
+            except RedisError as e:
+                logger.warning("Could not queue Telegram notification in Redis, sending it here: %s", e)
+                self._inbox.put_nowait(item)
+
+    async def _lead(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if await self.lease.renew():
+                    await self._take_outbox()
+            except RedisError as e:
+                logger.warning("Telegram outbox unavailable: %s", e)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        try:
+            if self.lease.held:
+                await self._take_outbox()
+                await self.lease.release()
+        except RedisError as e:
+            logger.warning("Could not hand over the Telegram outbox: %s", e)
+
+    async def _take_outbox(self) -> None:
+        while payloads := await self.redis.lpop(self.outbox, 100):
+            for payload in payloads:
+                try:
+                    data = json.loads(payload)
+                    email = EmailClassifyRequest.model_validate(data["email"])
+                    result = EmailClassifyResponse.model_validate(data["result"])
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.error("Dropping unreadable Telegram notification: %s", e)
+                    continue
+                key = (result.category.value, email.from_address.lower())
+                self._inbox.put_nowait(_Notification(key, email, result))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                item = await asyncio.wait_for(self._inbox.get(), self._next_digest_due())
+            except asyncio.TimeoutError:
+                item = False
+            if item is None:
+                for key in list(self._digests):
+                    await self._send_digest(key)
+                return
+            if item:
+                await self._handle(item)
+            for key, digest in list(self._digests.items()):
+                if self.clock() - digest.started >= self.burst_window:
+                    await self._send_digest(key)
+
+    def _next_digest_due(self) -> float | None:
+        if not self._digests:
+            return None
+        oldest = min(d.started for d in self._digests.values())
+        return max(0.0, oldest + self.burst_window - self.clock())
+
+    async def _handle(self, item: _Notification) -> None:
+        now = self.clock()
+        digest = self._digests.get(item.key)
+        if digest is not None:
+            digest.items.append(item)
+            TELEGRAM_MESSAGES.labels(result="coalesced").inc()
+            return
+
+        recent = self._recent.setdefault(item.key, deque())
+        while recent and now - recent[0] > self.burst_window:
+            recent.popleft()
+        if len(recent) >= self.burst_threshold:
+            logger.info("Telegram burst for %s/%s, collecting a digest", *item.key)
+            self._digests[item.key] = _Digest(started=now, items=[item])
+            TELEGRAM_MESSAGES.labels(result="coalesced").inc()
+            return
+        recent.append(now)
+        if len(self._recent) > 1000:
+            self._recent = {k: v for k, v in self._recent.items() if v and now - v[-1] <= self.burst_window}
+        await self._send(format_message(item.email, item.result))
+
+    async def _send_digest(self, key: tuple[str, str]) -> None:
+        digest = self._digests.pop(key)
+        self._recent.pop(key, None)
+        if len(digest.items) == 1:
+            only = digest.items[0]
+            await self._send(format_message(only.email, only.result))
+        else:
+            await self._send(format_digest([(n.email, n.result) for n in digest.items]))
+
+    async def _send(self, text: str) -> None:
+        for attempt in range(1, self.max_retries + 1):
+            for bucket in (self._chat_bucket, self._global_bucket):
+                delay = bucket.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                bucket.take()
+            try:
+                retry_after = await self.client.send_message(self.chat_id, text)
+            except (httpx.HTTPError, TelegramError) as e:
+                logger.warning("Telegram send failed (attempt %d/%d): %s", attempt, self.max_retries, e)
+                if attempt < self.max_retries:
+                    await asyncio.sleep(2 ** (attempt - 1))
+                continue
+            if retry_after:
+                logger.warning("Telegram rate limit hit, retrying after %.1fs", retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+            TELEGRAM_MESSAGES.labels(result="sent").inc()
+            return
+        TELEGRAM_MESSAGES.labels(result="failed").inc()
+
+
+def escape_markdown(text: str) -> str:
+    for char in "_*`[":
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+def _clip(text: str, limit: int = MAX_FIELD_LENGTH) -> str:
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _join_lines(lines: list[str]) -> str:
+    """Join lines, dropping whole lines from the end beyond MAX_MESSAGE_LENGTH.
+
+    Cutting inside a line could split an escape or a *bold* entity, which
+    Telegram rejects with 400.
+    """
+    text = "\n".join(lines)
+    while len(text) > MAX_MESSAGE_LENGTH and len(lines) > 1:
+        lines = lines[:-1]
+        text = "\n".join(lines)
+    return text
+
+
+def format_message(email: EmailClassifyRequest, result: EmailClassifyResponse) -> str:
+    """Same layout the n8n "Format Telegram Message" node produces."""
+    account = "Business" if email.account == EmailAccount.BUSINESS else "Family"
+    emoji = PRIORITY_EMOJI.get(result.priority.value, "⚪")
+    category = CATEGORY_LABELS.get(result.category.value) or escape_markdown(result.category.value)
+    from_addr = escape_markdown(_clip(email.from_address))
+    from_line = f"{escape_markdown(_clip(email.from_name))} ({from_addr})" if email.from_name else from_addr
+    preview = _clip(email.body_preview, 200)
+    lines = [
+        f"📧 *Neue Email ({account})*",
+        f"*Von:* {from_line}",
+        f"*Betreff:* {escape_markdown(_clip(email.subject))}",
+        f"*Kategorie:* {emoji} {category} ({escape_markdown(result.priority.value)})",
+        "---",
+        escape_markdown(preview),
+    ]
+    return _join_lines(lines)
+
+
+def format_digest(items: list[tuple[EmailClassifyRequest, EmailClassifyResponse]]) -> str:
+    """One message summarising a burst of emails with the same category and sender."""
+    email, result = items[0]
+    emoji = PRIORITY_EMOJI.get(result.priority.value, "⚪")
+    category = CATEGORY_LABELS.get(result.category.value) or escape_markdown(result.category.value)
+    lines = [
+        f"📦 *{len(items)}× {category}* {emoji}",
+        f"*Von:* {escape_markdown(_clip(email.from_address))}",
+        "---",
+    ]
+    lines.extend(f"• {escape_markdown(_clip(e.subject))}" for e, _ in items[:DIGEST_MAX_LINES])
+    if len(items) > DIGEST_MAX_LINES:
+        lines.append(f"… und {len(items) - DIGEST_MAX_LINES} weitere")
+    return _join_lines(lines)
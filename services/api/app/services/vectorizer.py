@@ -0,0 +1,76 @@
+import hashlib
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from app.models.email import EmailClassifyRequest
+from app.services.rule_index import sender_domain
+
+# Words of two or more letters; digits are dropped so ids and dates don't
+# become features
+_WORD_RE = re.compile(r"[^\W\d_]{2,}")
+
+SUBJECT_WEIGHT = 2.0
+BODY_WEIGHT = 1.0
+DOMAIN_WEIGHT = 2.0
+
+
+@lru_cache(maxsize=131072)
+def _bucket(feature: str, dim: int) -> tuple[int, float]:
+    """Column and sign of a feature (signed hashing keeps collisions unbiased)."""
+    h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if h >> 63 else -1.0
+
+
+class HashingVectorizer:
+    """Maps emails to fixed-size, L2-normalised float32 vectors without a vocabulary.
+
+    Features are the words of subject and body_preview (subject words weigh
+    more) plus the sender domain, hashed into `dim` columns. No model and no
+    fitting, so vectors are stable across processes and restarts.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def features(self, email: EmailClassifyRequest) -> dict[int, float]:
+        """Sparse column -> value map of an email (not normalised)."""
+        columns: dict[int, float] = {}
+        dim = self.dim
+        for text, weight in ((email.subject, SUBJECT_WEIGHT), (email.body_preview, BODY_WEIGHT)):
+            for word in _WORD_RE.findall(text.lower()):
+                column, sign = _bucket(word, dim)
+                columns[column] = columns.get(column, 0.0) + sign * weight
+        domain = sender_domain(email.from_address.lower())
+        if domain:
+            column, sign = _bucket("@" + domain, dim)
+            columns[column] = columns.get(column, 0.0) + sign * DOMAIN_WEIGHT
+        return columns
+
+    def transform_one(self, email: EmailClassifyRequest) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        columns = self.features(email)
+        if columns:
+            vector[list(columns)] = list(columns.values())
+        return _normalize(vector)
+
+    def transform(self, emails: list[EmailClassifyRequest]) -> np.ndarray:
+        """(len(emails), dim) matrix, one normalised row per email."""
+        rows: list[int] = []
+        cols: list[int] = []
+        values: list[float] = []
+        for row, email in enumerate(emails):
+            columns = self.features(email)
+            rows.extend([row] * len(columns))
+            cols.extend(columns)
+            values.extend(columns.values())
+        matrix = np.zeros((len(emails), self.dim), dtype=np.float32)
+        matrix[rows, cols] = values
+        return _normalize(matrix)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
@@ -0,0 +1,170 @@
+"""Classifier benchmark: throughput and latency of EmailClassifier.classify() and
+POST /api/v1/email/classify across growing synthetic rulesets.
+
+Usage (from services/api):
+    python -m benchmarks.bench_classifier [-o bench_results.json] [--baseline old.json]
+
+With --baseline, exits non-zero if any scenario's emails/sec dropped by more
+than --tolerance compared to the baseline file.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+
+import httpx  # noqa: E402
+
+from app.models.email import EmailClassifyRequest  # noqa: E402
+from app.services.email_classifier import EmailClassifier  # noqa: E402
+from benchmarks.corpus import generate_emails, generate_ruleset  # noqa: E402
+
+# (rules, keywords) scenarios, from today's rules file size up to a large ruleset
+SCENARIOS = [(10, 100), (100, 1000), (1000, 10000)]
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(target: str, rules: int, keywords: int, latencies_ns: list[int], elapsed: float) -> dict:
+    latencies_us = sorted(ns / 1000 for ns in latencies_ns)
+    return {
+        "target": target,
+        "rules": rules,
+        "keywords": keywords,
+        "emails": len(latencies_us),
+        "emails_per_sec": round(len(latencies_us) / elapsed, 1),
+        "p50_us": round(percentile(latencies_us, 50), 1),
+        "p99_us": round(percentile(latencies_us, 99), 1),
+    }
+
+
+def bench_classify(classifier: EmailClassifier, emails: list[EmailClassifyRequest]) -> tuple[list[int], float]:
+    # Warm up lazily built state and CPU caches before measuring
+    for email in emails[:100]:
+        classifier.classify(email)
+    latencies = []
+    started = time.perf_counter()
+    for email in emails:
+        t0 = time.perf_counter_ns()
+        classifier.classify(email)
+        latencies.append(time.perf_counter_ns() - t0)
+    return latencies, time.perf_counter() - started
+
+
+async def bench_endpoint(classifier: EmailClassifier, payloads: list[dict]) -> tuple[list[int], float]:
+    from app.main import app
+    from app.routers import email as email_router
+
+    previous = email_router.classifier
+    email_router.classifier = classifier
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for payload in payloads[:50]:
+                await client.post("/api/v1/email/classify", json=payload)
+            latencies = []
+            started = time.perf_counter()
+            for payload in payloads:
+                t0 = time.perf_counter_ns()
+                response = await client.post("/api/v1/email/classify", json=payload)
+                latencies.append(time.perf_counter_ns() - t0)
+                response.raise_for_status()
+            return latencies, time.perf_counter() - started
+    finally:
+        email_router.classifier = previous
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: list[dict], baseline_path: Path, tolerance: float) -> list[str]:
+    baseline = {
+        (r["target"], r["rules"], r["keywords"]): r
+        for r in json.loads(baseline_path.read_text())["results"]
+    }
+    regressions = []
+    for result in results:
+        old = baseline.get((result["target"], result["rules"], result["keywords"]))
+        if old and result["emails_per_sec"] < old["emails_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{result['target']} rules={result['rules']}: "
+                f"{old['emails_per_sec']} -> {result['emails_per_sec']} emails/sec"
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("-n", "--emails", type=int, default=5000, help="Emails per classify() scenario")
+    parser.add_argument("--endpoint-emails", type=int, default=1000, help="Requests per endpoint scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", type=Path, help="Previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    # Per-request INFO logs would dominate the output (and the measurement)
+    logging.disable(logging.INFO)
+    payloads = list(generate_emails(args.emails, seed=args.seed))
+    emails = [EmailClassifyRequest.model_validate(p) for p in payloads]
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rules, keywords in SCENARIOS:
+            rules_path = Path(tmp) / f"rules_{rules}.json"
+            rules_path.write_text(json.dumps(generate_ruleset(rules, keywords, seed=args.seed)))
+            classifier = EmailClassifier(rules_path=rules_path)
+
+            latencies, elapsed = bench_classify(classifier, emails)
+            results.append(summarize("classify", rules, keywords, latencies, elapsed))
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+            latencies, elapsed = asyncio.run(bench_endpoint(classifier, payloads[: args.endpoint_emails]))
+            results.append(summarize("endpoint", rules, keywords, latencies, elapsed))
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Seeded synthetic email corpus and ruleset generator for benchmarks and load tests.
+
+Emails look like what the n8n poller sends for the business and family
+mailboxes: server alerts, invoices, newsletters, spam, client inquiries and
+personal mail, with the field shapes of EmailClassifyRequest.
+"""
+
+import json
+import random
+import string
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator
+
+RULES_PATH = Path(__file__).parent.parent.parent.parent / "config" / "email_rules.json"
+
+HOSTS = ["pve01", "pve02", "pbs01", "vm-services", "vm-nginx", "nas", "docker01"]
+FIRST_NAMES = ["Anna", "Max", "Lena", "Paul", "Marie", "Jonas", "Sophie", "Lukas", "Emma", "Felix"]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker"]
+COMPANIES = ["firma", "kanzlei-weber", "agentur-nord", "bau-becker", "praxis-meyer", "techstart"]
+FREEMAIL = ["gmail.com", "gmx.de", "web.de", "outlook.de", "t-online.de"]
+VENDORS = [
+    ("billing@hetzner.com", "Hetzner Online"),
+    ("noreply@aws.amazon.com", "Amazon Web Services"),
+    ("service@ionos.de", "IONOS"),
+    ("rechnung@telekom.de", "Telekom"),
+    ("invoice@stripe.com", "Stripe"),
+]
+NEWSLETTERS = [
+    ("newsletter@heise.de", "heise online"),
+    ("noreply@spotify.com", "Spotify"),
+    ("news@golem.de", "Golem.de"),
+    ("marketing@shop.example.com", "Example Shop"),
+    ("digest@medium.com", "Medium Daily Digest"),
+]
+
+
+def _server_alert(rnd: random.Random) -> dict:
+    host = rnd.choice(HOSTS)
+    sender, subject, body = rnd.choice(
+        [
+            (
+                f"pbs@{host}.local",
+                f"Backup job {rnd.randint(100, 999)} on {host} finished: OK",
+                f"Datastore backup-{rnd.randint(1, 4)} verified {rnd.randint(10, 90)} snapshots.",
+            ),
+            (
+                f"fail2ban@{host}.local",
+                f"[Fail2Ban] sshd: banned {rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}",
+                f"The IP has just been banned by Fail2Ban after {rnd.randint(3, 9)} attempts.",
+            ),
+            (
+                f"logwatch@{host}.local",
+                f"Logwatch for {host} (Linux)",
+                f"Processing Initiated: {rnd.randint(1, 28)}.{rnd.randint(1, 12)}.2026 Disk usage {rnd.randint(40, 99)}%",
+            ),
+            (
+                f"root@{host}.local",
+                f"unattended-upgrades result for {host}: SUCCESS",
+                f"Packages that were upgraded: linux-image-{rnd.randint(5, 6)}.{rnd.randint(0, 19)}",
+            ),
+            (
+                "monitoring@uptime.example.com",
+                f"ALERT: service down on {host}",
+                f"HTTP check failed with status {rnd.choice([500, 502, 503, 504])}.",
+            ),
+        ]
+    )
+    return {
+        "from_address": sender,
+        "from_name": "",
+        "subject": subject,
+        "body_preview": body,
+        "importance": rnd.choice(["normal", "high"]),
+        "account": "business",
+    }
+
+
+def _invoice(rnd: random.Random) -> dict:
+    sender, name = rnd.choice(VENDORS)
+    subject = rnd.choice(
+        [
+            f"Ihre Rechnung Nr. {rnd.randint(10000, 99999)}",
+            f"Your invoice {rnd.randint(1000, 9999)} is available",
+            f"Zahlungseingang bestätigt – Auftrag {rnd.randint(100, 999)}",
+            "Ihr Kontoauszug ist verfügbar",
+        ]
+    )
+    return {
+        "from_address": sender,
+        "from_name": name,
+        "subject": subject,
+        "body_preview": f"Guten Tag, anbei erhalten Sie Ihre Rechnung über {rnd.randint(5, 900)},{rnd.randint(0, 99):02d} EUR.",
+        "has_attachments": True,
+        "account": rnd.choice(["business", "business", "family"]),
+    }
+
+
+def _newsletter(rnd: random.Random) -> dict:
+    sender, name = rnd.choice(NEWSLETTERS)
+    return {
+        "from_address": sender,
+        "from_name": name,
+        "subject": rnd.choice(
+            ["Weekly digest", "Die Woche in der IT", "Your weekly playlist", "Neue Angebote für Sie"]
+        ),
+        "body_preview": "Hier sind die wichtigsten Themen der Woche. Abmelden | Unsubscribe",
+        "importance": "low",
+        "account": rnd.choice(["business", "family"]),
+    }
+
+
+def _spam(rnd: random.Random) -> dict:
+    return {
+        "from_address": f"{''.join(rnd.choices(string.ascii_lowercase, k=8))}@{rnd.choice(['lottery.com', 'secure-login.net', 'win-now.biz'])}",
+        "from_name": rnd.choice(["Support", "Security Team", "Winner Department"]),
+        "subject": rnd.choice(
+            ["Congratulations! You are a Winner", "Verify your account", "Konto gesperrt", "Urgent action required"]
+        ),
+        "body_preview": rnd.choice(["Click here to claim your prize", "Klicken Sie hier, um fortzufahren", "act now"]),
+        "account": rnd.choice(["business", "family"]),
+    }
+
+
+def _client_inquiry(rnd: random.Random) -> dict:
+    first, last = rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)
+    company = rnd.choice(COMPANIES)
+    return {
+        "from_address": f"{first.lower()}.{last.lower()}@{company}.de",
+        "from_name": f"{first} {last}",
+        "subject": rnd.choice(
+            ["Anfrage: AI-Beratung", "Angebot für Automatisierung", "Termin nächste Woche?", "Rückfrage zum Projekt"]
+        ),
+        "body_preview": f"Sehr geehrter Herr Müller, wir würden gerne über ein Projekt mit {rnd.randint(2, 40)} Mitarbeitern sprechen.",
+        "importance": rnd.choice(["normal", "normal", "high"]),
+        "account": "business",
+    }
+
+
+def _personal(rnd: random.Random) -> dict:
+    first = rnd.choice(FIRST_NAMES)
+    return {
+        "from_address": f"{first.lower()}{rnd.randint(1, 99)}@{rnd.choice(FREEMAIL)}",
+        "from_name": first,
+        "subject": rnd.choice(["Treffen am Wochenende?", "Fotos vom Urlaub", "Geburtstag von Oma", "Re: Abendessen"]),
+        "body_preview": "Hallo ihr Lieben, wie geht es euch? Liebe Grüße",
+        "account": "family",
+    }
+
+
+# Rough share of each kind in a real mailbox
+KINDS = [
+    (_server_alert, 0.30),
+    (_invoice, 0.10),
+    (_newsletter, 0.25),
+    (_spam, 0.05),
+    (_client_inquiry, 0.15),
+    (_personal, 0.15),
+]
+
+
+def generate_emails(count: int, seed: int = 42, start: datetime | None = None) -> Iterator[dict]:
+    """Yield count EmailClassifyRequest-shaped dicts, reproducible for a given seed."""
+    rnd = random.Random(seed)
+    makers = [maker for maker, _ in KINDS]
+    weights = [weight for _, weight in KINDS]
+    received = start or datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        email = rnd.choices(makers, weights)[0](rnd)
+        received += timedelta(seconds=rnd.randint(1, 600))
+        email.setdefault("from_name", "")
+        email.setdefault("has_attachments", False)
+        email.setdefault("importance", "normal")
+        email["received_at"] = received.isoformat()
+        email["message_id"] = f"AAMkSynthetic{seed:x}-{i:08d}"
+        yield email
+
+
+def _word(rnd: random.Random) -> str:
+    return "".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(5, 10)))
+
+
+def generate_ruleset(rule_count: int, keyword_count: int, seed: int = 42) -> dict:
+    """Build a rules document with rule_count synthetic rules and keyword_count keywords in total.
+
+    The synthetic rules use made-up keywords and rarely match, so every email
+    is evaluated against (almost) all of them – the worst case for first-match
+    evaluation. The real rules from config/email_rules.json are appended so
+    realistic emails still end up in their usual categories.
+    """
+    rnd = random.Random(seed)
+    base = json.loads(RULES_PATH.read_text())["rules"]
+    categories = ["server_alert", "invoice", "newsletter", "spam_suspect", "client_inquiry", "personal"]
+    per_rule = max(1, keyword_count // max(rule_count, 1))
+
+    rules = []
+    for i in range(rule_count):
+        conditions = [
+            {
+                "field": rnd.choice(["subject", "body_preview", "from_address", "from_name"]),
+                "operator": "contains_any",
+                "values": [_word(rnd) for _ in range(per_rule)],
+            }
+        ]
+        match_type = "any"
+        if rnd.random() < 0.2:
+            match_type = "all"
+            conditions.insert(
+                0, {"field": "account", "operator": "equals", "values": [rnd.choice(["business", "family"])]}
+            )
+        rules.append(
+            {
+                "name": f"synthetic_{i:04d}",
+                "category": rnd.choice(categories),
+                "priority": rnd.choice(["low", "medium", "high"]),
+                "actions": [rnd.choice(["notify_telegram", "skip"])],
+                "conditions": {"match_type": match_type, "rules": conditions},
+            }
+        )
+    return {"version": "synthetic", "rules": rules + base}
@@ -0,0 +1,335 @@
+"""Load generator: replays n8n "🤖 Classify Email" payloads against the API.
+
+Usage (from services/api):
+    python -m benchmarks.loadgen [--url http://host:8000] closed --concurrency 16 --requests 5000
+    python -m benchmarks.loadgen open --rate 200 --duration 30 [--storm-every 10 --storm-size 300]
+
+Without --url, requests go to the in-process ASGI app with local stand-ins
+for its downstream services (fakeredis for the classification cache and an
+in-memory sink with simulated write latency instead of Postgres). Closed
+loop keeps N requests in flight; open loop sends at a fixed arrival rate
+whatever the latency, and measures latency from each request's scheduled
+send time so a stalled server is not hidden. The storm options overlay
+Proxmox alert storms (many near-identical backup/HA alerts from one host
+within a few seconds). The JSON report goes to stdout or -o.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "loadgen")
+
+import httpx  # noqa: E402
+
+from benchmarks.bench_classifier import git_commit, percentile  # noqa: E402
+from benchmarks.corpus import HOSTS, generate_emails  # noqa: E402
+
+CLASSIFY_PATH = "/api/v1/email/classify"
+
+
+def to_n8n_payload(email: dict, rnd: random.Random) -> dict:
+    """Shape a corpus email like the n8n node's JSON.stringify(...) body.
+
+    n8n sends every key and falls back to '' for missing Graph fields (so
+    received_at is often the empty string); older workflow versions left
+    some keys out entirely.
+    """
+    payload = {
+        "from_address": email["from_address"],
+        "from_name": email.get("from_name", ""),
+        "subject": email.get("subject", ""),
+        "body_preview": email.get("body_preview", ""),
+        "received_at": email.get("received_at", ""),
+        "has_attachments": email.get("has_attachments", False),
+        "importance": email.get("importance", "normal"),
+        "account": email.get("account", "business"),
+        "message_id": email.get("message_id", ""),
+    }
+    roll = rnd.random()
+    if roll < 0.10:
+        payload["received_at"] = ""
+    elif roll < 0.15:
+        payload["body_preview"] = ""
+        payload["from_name"] = ""
+    elif roll < 0.20:
+        for key in ("from_name", "received_at", "has_attachments", "importance"):
+            payload.pop(key)
+    return payload
+
+
+def storm_payloads(count: int, rnd: random.Random, storm: int) -> list[dict]:
+    """An alert storm: one host mailing the same few alerts for many guests at once."""
+    host = rnd.choice(HOSTS)
+    now = datetime.now(timezone.utc).isoformat()
+    templates = [
+        ("Backup job failed: vm/{vm}", "ERROR: Backup of VM {vm} failed - job timeout after 7200 seconds"),
+        ("HA resource vm:{vm} in error state", "Fencing of node {host} pending, service vm:{vm} stopped"),
+        ("Disk I/O errors on {host}", "smartd detected {vm} reallocated sectors on /dev/sda"),
+    ]
+    payloads = []
+    for i in range(count):
+        subject, body = rnd.choice(templates)
+        vm = rnd.randint(100, 140)
+        payloads.append(
+            {
+                "from_address": f"root@{host}.local",
+                "from_name": f"Proxmox VE ({host})",
+                "subject": subject.format(vm=vm, host=host),
+                "body_preview": body.format(vm=vm, host=host),
+                "received_at": now,
+                "has_attachments": False,
+                "importance": "high",
+                "account": "business",
+                "message_id": f"AAMkStorm{storm:03d}-{i:06d}",
+            }
+        )
+    return payloads
+
+
+@dataclass
+class Results:
+    latencies: dict[str, list[float]] = field(default_factory=lambda: {"baseline": [], "storm": []})
+    statuses: Counter = field(default_factory=Counter)
+    dropped: int = 0
+
+    def record(self, kind: str, latency: float, status: str) -> None:
+        self.latencies[kind].append(latency)
+        self.statuses[status] += 1
+
+
+async def send(client: httpx.AsyncClient, payload: dict, kind: str, scheduled: float, results: Results) -> None:
+    try:
+        response = await client.post(CLASSIFY_PATH, json=payload)
+        status = str(response.status_code)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    results.record(kind, time.perf_counter() - scheduled, status)
+
+
+async def run_closed(client: httpx.AsyncClient, payloads: list[dict], concurrency: int, results: Results) -> None:
+    queue = iter(payloads)
+
+    async def worker() -> None:
+        for payload in queue:
+            await send(client, payload, "baseline", time.perf_counter(), results)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def open_schedule(
+    rate: float,
+    duration: float,
+    rnd: random.Random,
+    storm_every: float = 0.0,
+    storm_size: int = 0,
+    storm_duration: float = 2.0,
+) -> list[tuple[float, str]]:
+    """(send offset in seconds, kind) for every request, sorted by offset.
+
+    Baseline arrivals are a Poisson process at `rate`; every `storm_every`
+    seconds a storm adds storm_size requests spread over storm_duration.
+    """
+    schedule = []
+    t = rnd.expovariate(rate)
+    while t < duration:
+        schedule.append((t, "baseline"))
+        t += rnd.expovariate(rate)
+    if storm_every > 0 and storm_size > 0:
+        start = storm_every
+        while start < duration:
+            schedule.extend((start + storm_duration * i / storm_size, "storm") for i in range(storm_size))
+            start += storm_every
+    schedule.sort()
+    return schedule
+
+
+async def run_open(
+    client: httpx.AsyncClient,
+    schedule: list[tuple[float, str]],
+    payloads: list[dict],
+    storms: list[list[dict]],
+    max_in_flight: int,
+    results: Results,
+) -> None:
+    in_flight: set[asyncio.Task] = set()
+    baseline = itertools.cycle(payloads)
+    storm_iter = iter(p for storm in storms for p in storm)
+    started = time.perf_counter()
+    for offset, kind in schedule:
+        scheduled = started + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        payload = next(storm_iter) if kind == "storm" else next(baseline)
+        if len(in_flight) >= max_in_flight:
+            # Count instead of queueing: an open-loop client never slows down
+            results.dropped += 1
+            continue
+        task = asyncio.create_task(send(client, payload, kind, scheduled, results))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    values = sorted(s * 1000 for s in latencies)
+    return {
+        "requests": len(values),
+        "p50_ms": round(percentile(values, 50), 2),
+        "p95_ms": round(percentile(values, 95), 2),
+        "p99_ms": round(percentile(values, 99), 2),
+        "max_ms": round(values[-1], 2) if values else 0.0,
+    }
+
+
+def report(results: Results, elapsed: float, meta: dict) -> dict:
+    completed = sum(results.statuses.values())
+    errors = completed - results.statuses.get("200", 0)
+    all_latencies = results.latencies["baseline"] + results.latencies["storm"]
+    summary = {
+        "meta": meta,
+        "completed": completed,
+        "dropped": results.dropped,
+        "errors": errors,
+        "error_rate": round((errors + results.dropped) / (completed + results.dropped), 4)
+        if completed + results.dropped
+        else 0.0,
+        "throughput_rps": round(completed / elapsed, 1) if elapsed else 0.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "statuses": dict(results.statuses.most_common()),
+        "latency": latency_summary(all_latencies),
+    }
+    if results.latencies["storm"]:
+        summary["latency_baseline"] = latency_summary(results.latencies["baseline"])
+        summary["latency_storm"] = latency_summary(results.latencies["storm"])
+    return summary
+
+
+class SimulatedSink:
+    """Stand-in for the Postgres classification sink: sleeps instead of writing."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.rows = 0
+
+    async def write(self, rows: list) -> None:
+        await asyncio.sleep(self.latency)
+        self.rows += len(rows)
+
+    async def close(self) -> None:
+        pass
+
+
+class InProcessTarget:
+    """The ASGI app with stand-ins attached in place of its lifespan's Redis and Postgres."""
+
+    def __init__(self, sink_latency: float = 0.005):
+        self.sink_latency = sink_latency
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        from fakeredis import aioredis
+
+        from app.main import app
+        from app.routers import email as email_router
+
+        self.router = email_router
+        self.previous = (email_router.cache.client, email_router.writer.sink)
+        email_router.cache.client = aioredis.FakeRedis()
+        email_router.writer.sink = SimulatedSink(self.sink_latency)
+        await email_router.writer.start()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadgen")
+        return self.client
+
+    async def __aexit__(self, *exc) -> None:
+        await self.client.aclose()
+        await self.router.writer.stop()
+        self.router.cache.client, self.router.writer.sink = self.previous
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rnd = random.Random(args.seed)
+    count = args.requests if args.mode == "closed" else int(args.rate * args.duration * 1.5) + 100
+    payloads = [to_n8n_payload(e, rnd) for e in generate_emails(count, seed=args.seed)]
+
+    if args.url:
+        target = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=httpx.Limits(max_connections=None))
+    else:
+        target = InProcessTarget(args.sink_latency)
+
+    results = Results()
+    async with target as client:
+        started = time.perf_counter()
+        if args.mode == "closed":
+            await run_closed(client, payloads, args.concurrency, results)
+        else:
+            schedule = open_schedule(
+                args.rate, args.duration, rnd, args.storm_every, args.storm_size, args.storm_duration
+            )
+            storms = [
+                storm_payloads(args.storm_size, rnd, i)
+                for i in range(sum(1 for _, kind in schedule if kind == "storm") // max(args.storm_size, 1))
+            ]
+            await run_open(client, schedule, payloads, storms, args.max_in_flight, results)
+        elapsed = time.perf_counter() - started
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "in-process",
+        "mode": args.mode,
+        "seed": args.seed,
+    }
+    if args.mode == "closed":
+        meta["concurrency"] = args.concurrency
+    else:
+        meta.update(rate=args.rate, duration=args.duration, storm_every=args.storm_every, storm_size=args.storm_size)
+    return report(results, elapsed, meta)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Base URL of a running API (default: in-process app)")
+    parser.add_argument("-o", "--output", type=Path, help="JSON report file (default: stdout)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout (n8n uses 10 s)")
+    parser.add_argument("--sink-latency", type=float, default=0.005, help="Simulated DB write per batch (s)")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    closed = modes.add_parser("closed", help="Fixed number of concurrent clients")
+    closed.add_argument("--concurrency", type=int, default=16)
+    closed.add_argument("--requests", type=int, default=5000)
+
+    open_ = modes.add_parser("open", help="Fixed arrival rate, optionally with alert storms")
+    open_.add_argument("--rate", type=float, default=100.0, help="Baseline requests per second")
+    open_.add_argument("--duration", type=float, default=30.0)
+    open_.add_argument("--max-in-flight", type=int, default=1000, help="Requests beyond this are dropped")
+    open_.add_argument("--storm-every", type=float, default=0.0, help="Seconds between alert storms (0: none)")
+    open_.add_argument("--storm-size", type=int, default=300)
+    open_.add_argument("--storm-duration", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    # Per-request INFO logs would dominate the output (and the measurement)
+    logging.disable(logging.INFO)
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2, ensure_ascii=False) + "\n"
+    if args.output:
+        args.output.write_text(output)
+    else:
+        sys.stdout.write(output)
+    return 1 if result["completed"] == 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+from app.services.aho_corasick import AhoCorasick
+
+
+def test_finds_overlapping_patterns():
+    ac = AhoCorasick([("he", 1), ("she", 2), ("his", 3), ("hers", 4)])
+    assert sorted(ac.iter_matches("ushers")) == [1, 2, 4]
+
+
+def test_pattern_inside_another():
+    ac = AhoCorasick([("noreply@", "a"), ("reply", "b"), ("@", "c")])
+    assert sorted(ac.iter_matches("noreply@proxmox.local")) == ["a", "b", "c"]
+
+
+def test_no_match():
+    ac = AhoCorasick([("rechnung", 1)])
+    assert list(ac.iter_matches("invoice")) == []
+
+
+def test_empty_pattern_matches_everything():
+    ac = AhoCorasick([("", 1), ("x", 2)])
+    assert list(ac.iter_matches("")) == [1]
+
+
+def test_agrees_with_substring_search():
+    words = ["alert", "ale", "lert", "disk space", "space", "error", "err", "backup", "up"]
+    ac = AhoCorasick((w, w) for w in words)
+    for text in ["disk space alert", "backup error", "lerts", "nothing", "upalerterror"]:
+        assert set(ac.iter_matches(text)) == {w for w in words if w in text}
+
+
+def test_stream_matches_across_chunks():
+    ac = AhoCorasick([("rechnung", 1), ("fällig", 2), ("", 3)])
+    stream = ac.stream()
+    found = stream.feed("ihre rech") + stream.feed("nung ist fäl") + stream.feed("lig")
+    assert found == [3, 1, 2]
+    assert stream.feed("rechnung") == [1]
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from app.models.email import EmailClassifyRequest
+from app.services.baserow_rules import BaserowRuleProvider, row_to_rule
+from app.services.email_classifier import EmailClassifier
+from app.services.ruleset_snapshot import RulesetSnapshotStore
+
+CONFIG_PATH = Path(__file__).parent.parent.parent.parent / "config" / "email_rules.json"
+
+BASE = "http://baserow.test"
+
+
+def _row(row_id: int, name: str, keyword: str, **extra) -> dict:
+    return {
+        "id": row_id,
+        "order": f"{row_id}.00000000000000000000",
+        "name": name,
+        "category": {"id": 1, "value": "invoice", "color": "blue"},
+        "priority": {"id": 2, "value": "medium", "color": "green"},
+        "actions": [{"id": 3, "value": "notify_telegram", "color": "red"}],
+        "conditions": json.dumps(
+            {"match_type": "any", "rules": [{"field": "subject", "operator": "contains_any", "values": [keyword]}]}
+        ),
+        "description": "",
+        "active": True,
+        **extra,
+    }
+
+
+def fake_baserow() -> FastAPI:
+    """Local stand-in for the Baserow list-rows endpoint, two rows per page."""
+    app = FastAPI()
+    app.state.rows = []
+    app.state.requests = []
+    app.state.down = False
+    app.state.etag = None
+
+    @app.get("/api/database/rows/table/{table_id}/")
+    async def rows(table_id: int, request: Request):
+        app.state.requests.append(request)
+        if app.state.down:
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        assert request.headers["authorization"] == "Token secret"
+        if app.state.etag and request.headers.get("if-none-match") == app.state.etag:
+            return Response(status_code=304)
+        page = int(request.query_params.get("page", 1))
+        results = app.state.rows[(page - 1) * 2 : page * 2]
+        more = page * 2 < len(app.state.rows)
+        body = {
+            "count": len(app.state.rows),
+            "next": f"{BASE}/api/database/rows/table/{table_id}/?user_field_names=true&page={page + 1}" if more else None,
+            "results": results,
+        }
+        headers = {"ETag": app.state.etag} if app.state.etag else {}
+        return JSONResponse(body, headers=headers)
+
+    return app
+
+
+def make_provider(app: FastAPI, tmp_path) -> BaserowRuleProvider:
+    return BaserowRuleProvider(
+        EmailClassifier(rules_path=CONFIG_PATH),
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app)),
+        BASE,
+        "secret",
+        42,
+        tmp_path / "baserow_rules.json",
+    )
+
+
+def _category(provider: BaserowRuleProvider, subject: str) -> str:
+    email = EmailClassifyRequest(from_address="someone@example.org", subject=subject)
+    return provider.classifier.classify(email).category.value
+
+
+@pytest.mark.asyncio
+async def test_refresh_publishes_rows_in_table_order(tmp_path):
+    app = fake_baserow()
+    app.state.rows = [_row(1, "a", "Rechnung"), _row(2, "b", "Beleg"), _row(3, "c", "Quittung")]
+    provider = make_provider(app, tmp_path)
+
+    assert await provider.refresh() is True
+    ruleset = provider.classifier.ruleset
+    assert ruleset.source == "baserow"
+    assert [rule.name for rule in ruleset.rules] == ["a", "b", "c"]
+    assert len(app.state.requests) == 2
+    assert app.state.requests[0].query_params["user_field_names"] == "true"
+    assert _category(provider, "Quittung 7") == "invoice"
+
+    saved = json.loads((tmp_path / "baserow_rules.json").read_text())
+    assert [rule["name"] for rule in saved["rules"]] == ["a", "b", "c"]
+
+    assert await provider.refresh() is False
+    assert provider.classifier.ruleset is ruleset
+    await provider.stop()
+
+
+@pytest.mark.asyncio
+async def test_conditional_request_skips_unchanged_table(tmp_path):
+    app = fake_baserow()
+    app.state.rows = [_row(1, "a", "Rechnung")]
+    app.state.etag = '"v1"'
+    provider = make_provider(app, tmp_path)
+
+    assert await provider.refresh() is True
+    assert await provider.refresh() is False
+    assert app.state.requests[-1].headers["if-none-match"] == '"v1"'
+    await provider.stop()
+
+
+@pytest.mark.asyncio
+async def test_unchanged_table_with_values_file_is_not_recompiled(tmp_path, monkeypatch):
+    (tmp_path / "billing.txt").write_text("billing@hetzner.com\n")
+    app = fake_baserow()
+    app.state.rows = [
+        _row(
+            1,
+            "billing",
+            "Rechnung",
+            conditions=json.dumps(
+                {"match_type": "any", "rules": [{"field": "from_address", "operator": "address_in", "values_file": "billing.txt"}]}
+            ),
+        )
+    ]
+    provider = BaserowRuleProvider(
+        EmailClassifier(rules_path=tmp_path / "email_rules.json"),
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app)),
+        BASE,
+        "secret",
+        42,
+        tmp_path / "baserow_rules.json",
+    )
+    assert await provider.refresh() is True
+    ruleset = provider.classifier.ruleset
+
+    compiled = []
+    original = provider._compile
+    monkeypatch.setattr(provider, "_compile", lambda *args: compiled.append(args) or original(*args))
+    assert await provider.refresh() is False
+    assert compiled == []
+    assert provider.classifier.ruleset is ruleset
+
+    (tmp_path / "billing.txt").write_text("billing@hetzner.com\nrechnung@ionos.de\n")
+    assert await provider.refresh() is True
+    assert len(compiled) == 1
+    await provider.stop()
+
+
+@pytest.mark.asyncio
+async def test_publishing_waits_for_snapshot_lock_off_the_event_loop(tmp_path):
+    app = fake_baserow()
+    app.state.rows = [_row(1, "hetzner", "hetzner")]
+    provider = make_provider(app, tmp_path)
+    provider.classifier.snapshots = RulesetSnapshotStore(tmp_path / "snapshots")
+
+    # Another worker holds the lock while the refresh publishes
+    held, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with provider.classifier.snapshots.lock():
+            held.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    held.wait(5)
+    refresh = asyncio.create_task(provider.refresh())
+    ticks = 0
+    while ticks < 5:
+        await asyncio.sleep(0.01)
+        ticks += 1
+    assert not refresh.done()
+    release.set()
+    assert await refresh is True
+    holder.join()
+    assert _category(provider, "Hetzner") == "invoice"
+    await provider.stop()
+
+
+@pytest.mark.asyncio
+async def test_inactive_rows_are_skipped_and_invalid_table_is_rejected(tmp_path):
+    app = fake_baserow()
+    app.state.rows = [_row(1, "a", "Rechnung"), _row(2, "off", "Beleg", active=False)]
+    provider = make_provider(app, tmp_path)
+    await provider.refresh()
+    version = provider.classifier.ruleset.version
+    assert [rule.name for rule in provider.classifier.ruleset.rules] == ["a"]
+
+    app.state.rows = [_row(1, "a", "Rechnung", category={"value": "no_such_category"})]
+    assert await provider.refresh() is False
+    app.state.rows = [_row(1, "a", "Rechnung", conditions="{not json")]
+    assert await provider.refresh() is False
+    assert provider.classifier.ruleset.version == version
+    await provider.stop()
+
+
+@pytest.mark.asyncio
+async def test_unreachable_baserow_keeps_rules_file_then_snapshot(tmp_path):
+    app = fake_baserow()
+    app.state.down = True
+    provider = make_provider(app, tmp_path)
+    file_version = provider.classifier.ruleset.version
+
+    assert await provider.refresh() is False
+    assert provider.classifier.ruleset.source == "config_file"
+    assert provider.classifier.ruleset.version == file_version
+
+    app.state.down = False
+    app.state.rows = [_row(1, "a", "Rechnung")]
+    await provider.refresh()
+    await provider.stop()
+
+    # Cold start with Baserow down: the saved snapshot replaces the rules file
+    app.state.down = True
+    restarted = make_provider(app, tmp_path)
+    assert restarted.load_snapshot() is True
+    assert restarted.classifier.ruleset.source == "baserow_snapshot"
+    assert await restarted.refresh() is False
+    assert _category(restarted, "Rechnung") == "invoice"
+
+    # Once Baserow is back, the unchanged rules are marked live again
+    app.state.down = False
+    assert await restarted.refresh() is True
+    assert restarted.classifier.ruleset.source == "baserow"
+    await restarted.stop()
+
+
+def test_row_to_rule_accepts_text_columns():
+    rule = row_to_rule(
+        {
+            "name": "plain",
+            "category": "invoice",
+            "priority": "high",
+            "actions": "notify_telegram, skip",
+            "conditions": {"match_type": "all", "rules": []},
+        }
+    )
+    assert rule["actions"] == ["notify_telegram", "skip"]
+    assert rule["conditions"]["match_type"] == "all"
+    assert rule["description"] == ""
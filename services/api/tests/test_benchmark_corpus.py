@@ -0,0 +1,20 @@
+from app.models.email import EmailClassifyRequest
+from app.services.ruleset import compile_ruleset
+from benchmarks.corpus import generate_emails, generate_ruleset
+
+
+def test_corpus_is_reproducible():
+    assert list(generate_emails(50, seed=7)) == list(generate_emails(50, seed=7))
+    assert list(generate_emails(50, seed=7)) != list(generate_emails(50, seed=8))
+
+
+def test_corpus_emails_are_valid_requests():
+    for payload in generate_emails(200):
+        EmailClassifyRequest.model_validate(payload)
+
+
+def test_generated_ruleset_compiles():
+    ruleset = compile_ruleset(generate_ruleset(100, 1000), version="test")
+    keywords = sum(len(c.values) for rule in ruleset.rules[:100] for c in rule.conditions if c.operator == "contains_any")
+    assert len(ruleset.rules) == 100 + 6
+    assert keywords == 1000
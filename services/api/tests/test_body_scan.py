@@ -0,0 +1,197 @@
+import threading
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.email import EmailClassifyRequest
+from app.services.body_scan import BodyScan, BodyStream, HtmlTextStream, body_hits
+from app.services.classification_cache import ClassificationCache
+from app.services.ruleset import EmailContext, RulesetError, compile_ruleset
+
+client = TestClient(app)
+
+
+def _rule(name, category, match_type, *conditions):
+    return {
+        "name": name,
+        "category": category,
+        "priority": "low",
+        "actions": ["skip"],
+        "conditions": {"match_type": match_type, "rules": list(conditions)},
+    }
+
+
+def _cond(field, operator, *values):
+    return {"field": field, "operator": operator, "values": list(values)}
+
+
+RULESET = compile_ruleset(
+    {
+        "rules": [
+            _rule("newsletter_subject", "newsletter", "all", _cond("subject", "contains_any", "newsletter")),
+            _rule("invoice_body", "invoice", "all", _cond("body", "contains_any", "rechnungsnummer", "zahlbar bis")),
+            _rule("no_unsubscribe", "personal", "all", _cond("body", "not_contains_any", "abmelden")),
+        ]
+    },
+    version="test",
+)
+
+
+def _html_text(*chunks: str) -> str:
+    stream = HtmlTextStream()
+    return "".join(stream.feed(chunk) for chunk in chunks) + stream.close()
+
+
+def test_html_split_anywhere_gives_same_text():
+    html = (
+        "<p>Rechnung&nbsp;Nr.&#32;42</p><!-- <p>versteckt</p> -->"
+        "<script>var x = '<p>nein</p>';</script><div>F&auml;llig &amp; zahlbar</div>a < b"
+    )
+    expected = _html_text(html)
+    assert expected.split() == ["Rechnung", "Nr.", "42", "Fällig", "&", "zahlbar", "a", "<", "b"]
+    for size in (1, 2, 3, 5, 7):
+        chunks = [html[i : i + size] for i in range(0, len(html), size)]
+        assert _html_text(*chunks) == expected
+
+
+def test_overlong_tag_is_dropped_without_buffering():
+    stream = HtmlTextStream()
+    assert stream.feed("vor <img src='" + "x" * 10000) == "vor  "
+    assert stream.feed("'>nach") == "nach"
+
+
+def test_utf8_split_between_chunks():
+    keys = RULESET.automata["body"]
+    stream = BodyStream(keys)
+    data = "Zahlbar bis: sofort".encode()
+    stream.feed(data[:3])
+    stream.feed(data[3:])
+    stream.close()
+    assert stream.hits == body_hits(keys, "ZAHLBAR   BIS", html_body=False)
+    assert len(stream.hits) == 1
+
+
+def test_scan_stops_at_max_chars():
+    stream = BodyStream(RULESET.automata["body"], max_chars=10)
+    stream.feed("hallo " * 5 + "rechnungsnummer")
+    assert stream.truncated and stream.done
+    assert stream.chars == 10
+    assert stream.hits == {}
+
+
+def _matches(rule: int, scan: BodyScan) -> bool:
+    return RULESET.rules[rule].conditions[0].match(scan.ctx)[0]
+
+
+def _scan(**fields) -> BodyScan:
+    return BodyScan(EmailContext(EmailClassifyRequest(from_address="a@b.de", **fields), RULESET))
+
+
+def test_body_keyword_decides_before_end_of_body():
+    scan = _scan()
+    assert not scan.decided
+    assert not scan.feed("Sehr geehrte Damen und Herren, ")
+    assert scan.feed("Rechnungsnummer 4711")
+    scanned = scan.stream.chars
+    assert scan.feed("Bitte hier abmelden")
+    assert scan.stream.chars == scanned
+    scan.close()
+    assert _matches(1, scan)
+
+
+def test_subject_rule_decides_without_reading_body():
+    scan = _scan(subject="Unser Newsletter")
+    assert scan.decided
+    scan.feed("Rechnungsnummer 4711")
+    assert scan.stream.chars == 0
+
+
+def test_not_contains_any_needs_whole_body():
+    scan = _scan()
+    assert not scan.feed("Hallo, bis bald")
+    scan.close()
+    assert not _matches(1, scan)
+    assert _matches(2, scan)
+
+    scan = _scan()
+    scan.feed("Hier abmelden")
+    scan.close()
+    assert not _matches(2, scan)
+
+
+def test_body_only_supports_keyword_operators():
+    with pytest.raises(RulesetError):
+        compile_ruleset({"rules": [_rule("bad", "personal", "all", _cond("body", "equals", "x"))]}, version="bad")
+
+
+def test_classify_body_field(monkeypatch):
+    from app.routers import email as email_router
+
+    monkeypatch.setattr(email_router.classifier, "_ruleset", RULESET)
+    result = email_router.classifier.classify(
+        EmailClassifyRequest(
+            from_address="a@b.de",
+            body="<table><tr><td>Zahlbar</td></tr></table> bis 01.11.",
+            body_content_type="html",
+        )
+    )
+    assert result.category.value == "invoice"
+
+
+def test_json_body_is_scanned_off_the_event_loop(monkeypatch):
+    from app.routers import email as email_router
+
+    threads = []
+    original = email_router.scan_body
+
+    def scan_body(*args):
+        threads.append(threading.current_thread())
+        return original(*args)
+
+    monkeypatch.setattr(email_router.classifier, "_ruleset", RULESET)
+    monkeypatch.setattr(email_router, "scan_body", scan_body)
+    response = client.post(
+        "/api/v1/email/classify",
+        json={"from_address": "billing@hetzner.com", "body": "Text\n" * 1000 + "Rechnungsnummer 4711"},
+    )
+    assert response.status_code == 200
+    assert response.json()["category"] == "invoice"
+    assert len(threads) == 1 and threads[0].name.startswith("asyncio_")
+
+
+def test_upload_endpoint_streams_html_body(monkeypatch):
+    from app.routers import email as email_router
+
+    monkeypatch.setattr(email_router.classifier, "_ruleset", RULESET)
+    response = client.post(
+        "/api/v1/email/classify/upload",
+        params={"from_address": "billing@hetzner.com", "subject": "Ihre Rechnung"},
+        content="<html><body><p>Rechnungs<b></b>nummer: 4711</p>" + "<p>Text</p>" * 50000 + "</body></html>",
+        headers={"Content-Type": "text/html; charset=utf-8"},
+    )
+    assert response.status_code == 200
+    assert response.json()["category"] == "invoice"
+
+    response = client.post(
+        "/api/v1/email/classify/upload",
+        params={"from_address": "billing@hetzner.com", "subject": "Ihre Rechnung", "message_id": "upload-1"},
+        content="Vielen Dank\n" + "Text\n" * 50000,
+        headers={"Content-Type": "text/plain"},
+    )
+    assert response.status_code == 200
+    assert response.json()["category"] == "personal"
+
+
+def test_uploads_without_message_id_are_not_cached(monkeypatch):
+    from app.routers import email as email_router
+
+    monkeypatch.setattr(email_router.classifier, "_ruleset", RULESET)
+    monkeypatch.setattr(email_router, "cache", ClassificationCache(client=fakeredis.FakeAsyncRedis()))
+    params = {"from_address": "billing@hetzner.com", "subject": "Ihr Dokument"}
+    first = client.post("/api/v1/email/classify/upload", params=params, content="Rechnungsnummer 4711").json()
+    second = client.post("/api/v1/email/classify/upload", params=params, content="Hallo, bis bald").json()
+    assert first["category"] == "invoice"
+    assert second["category"] == "personal"
+    assert second["cached"] is False
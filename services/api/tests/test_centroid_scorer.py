@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+
+from app.cli import rescore
+from app.models.email import EmailAction, EmailCategory, EmailClassifyRequest, EmailPriority
+from app.services.centroid_scorer import CentroidScorer
+from app.services.knn_index import CATEGORIES, PRIORITIES, KnnIndex
+
+EXAMPLES = [
+    ("Backup job failed on pve", "vzdump backup failed with exit code", EmailCategory.SERVER_ALERT, EmailPriority.HIGH),
+    ("Backup job successful", "vzdump backup finished", EmailCategory.SERVER_ALERT, EmailPriority.LOW),
+    ("Backup job failed again", "vzdump backup failed, storage full", EmailCategory.SERVER_ALERT, EmailPriority.HIGH),
+    ("Ihre Rechnung Oktober", "Anbei Ihre Rechnung als PDF", EmailCategory.INVOICE, EmailPriority.MEDIUM),
+    ("Rechnung November", "Ihre Rechnung ist verfügbar", EmailCategory.INVOICE, EmailPriority.MEDIUM),
+]
+
+
+def _index(path=None) -> KnnIndex:
+    index = KnnIndex(path)
+    for subject, body, category, priority in EXAMPLES:
+        index.add(
+            EmailClassifyRequest(subject=subject, body_preview=body), category, priority, [EmailAction.SKIP]
+        )
+    return index
+
+
+def test_scores_line_up_with_enums():
+    scorer = CentroidScorer.from_index(_index())
+    scores = scorer.score(
+        [
+            EmailClassifyRequest(subject="Backup job failed", body_preview="vzdump backup failed"),
+            EmailClassifyRequest(subject="Rechnung Dezember", body_preview="Anbei Ihre Rechnung"),
+            EmailClassifyRequest(subject="Grillfest am Samstag", body_preview="Wer bringt Salat mit?"),
+            EmailClassifyRequest(),
+        ]
+    )
+    assert len(scores) == 4
+    assert [scores.category(i) for i in range(4)] == [
+        EmailCategory.SERVER_ALERT,
+        EmailCategory.INVOICE,
+        EmailCategory.UNCATEGORIZED,
+        EmailCategory.UNCATEGORIZED,
+    ]
+    # Most server alert examples are high priority
+    assert [scores.priority(i) for i in range(4)] == [
+        EmailPriority.HIGH,
+        EmailPriority.MEDIUM,
+        EmailPriority.MEDIUM,
+        EmailPriority.MEDIUM,
+    ]
+    assert scores.confidence.dtype == np.float32
+    assert scores.confidence[0] > 0.5
+    assert scores.confidence[2] == 0.0
+
+
+def test_categories_without_examples_never_win():
+    scorer = CentroidScorer.from_index(_index())
+    assert scorer.example_counts[CATEGORIES.index(EmailCategory.NEWSLETTER)] == 0
+    vectors = np.eye(scorer.vectorizer.dim, dtype=np.float32)
+    scores = scorer.score_vectors(vectors)
+    assert set(scores.categories.tolist()) <= {
+        CATEGORIES.index(EmailCategory.SERVER_ALERT),
+        CATEGORIES.index(EmailCategory.INVOICE),
+        CATEGORIES.index(EmailCategory.UNCATEGORIZED),
+    }
+    assert set(scores.priorities.tolist()) <= set(range(len(PRIORITIES)))
+
+
+def test_cli_rescores_file(tmp_path, capsys):
+    examples = tmp_path / "knn"
+    _index(examples).save()
+    source = tmp_path / "archive.ndjson"
+    source.write_text(
+        json.dumps({"subject": "Backup job failed", "message_id": "m1"})
+        + "\nnot json\n"
+        + json.dumps({"subject": "Rechnung Dezember", "message_id": "m2"})
+        + "\n"
+    )
+    target = tmp_path / "scores.ndjson"
+    assert rescore.main([str(source), "-o", str(target), "--examples", str(examples), "--batch-size", "2"]) == 0
+
+    lines = [json.loads(line) for line in target.read_text().splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert lines[0]["category"] == "server_alert"
+    assert lines[0]["message_id"] == "m1"
+    assert "error" in lines[1]
+    assert lines[2]["category"] == "invoice"
+    summary = json.loads(capsys.readouterr().err)
+    assert summary["scored"] == 2
+    assert summary["examples"] == 5
+
+
+def test_cli_without_examples_fails(tmp_path, capsys):
+    assert rescore.main([str(tmp_path / "missing.ndjson"), "--examples", str(tmp_path)]) == 1
+    assert "No labeled examples" in capsys.readouterr().err
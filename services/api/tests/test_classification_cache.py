@@ -0,0 +1,89 @@
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+from redis.exceptions import ConnectionError
+
+from app.main import app
+from app.models.email import EmailClassifyRequest
+from app.routers import email as email_router
+from app.services.classification_cache import ClassificationCache
+
+client = TestClient(app)
+
+INVOICE = {
+    "from_address": "billing@hetzner.com",
+    "subject": "Ihre Rechnung Nr. 12345",
+    "account": "business",
+    "message_id": "AAMkAGI2-invoice",
+}
+
+
+@pytest.fixture
+def redis_cache(monkeypatch):
+    cache = ClassificationCache(client=fakeredis.FakeAsyncRedis())
+    monkeypatch.setattr(email_router, "cache", cache)
+    return cache
+
+
+def test_repeat_message_id_is_served_from_cache(redis_cache, monkeypatch):
+    first = client.post("/api/v1/email/classify", json=INVOICE).json()
+    assert first["cached"] is False
+
+    def fail(*args, **kwargs):
+        raise AssertionError("rules evaluated again")
+
+    monkeypatch.setattr(email_router.classifier, "classify", fail)
+    second = client.post("/api/v1/email/classify", json=INVOICE).json()
+    assert second["cached"] is True
+    assert second["category"] == first["category"] == "invoice"
+    assert second["reasoning"] == first["reasoning"]
+
+
+def test_test_classify_bypasses_cache(redis_cache):
+    client.post("/api/v1/email/classify", json=INVOICE)
+    data = client.post("/api/v1/email/test-classify", json=INVOICE).json()
+    assert data["cached"] is False
+    assert data["dry_run"] is True
+
+
+def test_new_examples_invalidate_cached_verdicts(redis_cache, monkeypatch):
+    from app.services.knn_index import KnnIndex
+
+    monkeypatch.setattr(email_router.classifier, "knn", KnnIndex())
+    bounce = {
+        "from_address": "mailer-daemon@mail.example.de",
+        "subject": "Undelivered Mail Returned to Sender",
+        "body_preview": "Your message could not be delivered.",
+        "message_id": "AAMkAGI2-bounce",
+    }
+    assert client.post("/api/v1/email/classify", json=bounce).json()["category"] == "uncategorized"
+    client.post(
+        "/api/v1/email/examples",
+        json=[{"email": bounce, "category": "spam_suspect", "priority": "low", "actions": ["skip"]}],
+    )
+    data = client.post("/api/v1/email/classify", json=bounce).json()
+    assert data["cached"] is False
+    assert data["category"] == "spam_suspect"
+
+
+def test_fingerprint_used_without_message_id():
+    cache = ClassificationCache()
+    a = EmailClassifyRequest(from_address="a@b.de", subject="Hallo")
+    b = EmailClassifyRequest(from_address="A@B.de", subject="Hallo")
+    c = EmailClassifyRequest(from_address="a@b.de", subject="Hallo!")
+    assert cache.key_for(a, "v1") == cache.key_for(b, "v1")
+    assert cache.key_for(a, "v1") != cache.key_for(c, "v1")
+    assert cache.key_for(a, "v1") != cache.key_for(a, "v2")
+
+
+def test_redis_outage_falls_back_to_classification(monkeypatch):
+    class BrokenRedis:
+        async def get(self, key):
+            raise ConnectionError("redis down")
+
+    cache = ClassificationCache(client=BrokenRedis())
+    monkeypatch.setattr(email_router, "cache", cache)
+    response = client.post("/api/v1/email/classify", json=INVOICE)
+    assert response.status_code == 200
+    assert response.json()["cached"] is False
+    assert cache.enabled is False
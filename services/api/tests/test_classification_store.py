@@ -0,0 +1,89 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from app.models.email import EmailClassifyRequest
+from app.services.classification_store import ClassificationWriter
+from app.services.email_classifier import EmailClassifier
+
+CONFIG_PATH = Path(__file__).parent.parent.parent.parent / "config" / "email_rules.json"
+
+classifier = EmailClassifier(rules_path=CONFIG_PATH)
+
+
+class ListSink:
+    def __init__(self, failures: int = 0):
+        self.batches: list[list[tuple]] = []
+        self.failures = failures
+        self.closed = False
+
+    async def write(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        self.batches.append(list(rows))
+
+    async def close(self):
+        self.closed = True
+
+
+def _submit(writer: ClassificationWriter, count: int) -> list[bool]:
+    accepted = []
+    for i in range(count):
+        email = EmailClassifyRequest(subject=f"Rechnung {i}", message_id=f"msg-{i}")
+        accepted.append(writer.submit(email, classifier.classify(email), "v1"))
+    return accepted
+
+
+@pytest.mark.asyncio
+async def test_flushes_full_batches_immediately():
+    sink = ListSink()
+    writer = ClassificationWriter(sink, batch_size=10, flush_interval=60)
+    await writer.start()
+    _submit(writer, 25)
+    await asyncio.sleep(0.05)
+    assert [len(b) for b in sink.batches] == [10, 10]
+    await writer.stop()
+    assert [len(b) for b in sink.batches] == [10, 10, 5]
+    assert sink.closed
+
+
+@pytest.mark.asyncio
+async def test_flushes_partial_batch_after_interval():
+    sink = ListSink()
+    writer = ClassificationWriter(sink, batch_size=100, flush_interval=0.05)
+    await writer.start()
+    _submit(writer, 3)
+    await asyncio.sleep(0.15)
+    assert [len(b) for b in sink.batches] == [3]
+    row = sink.batches[0][0]
+    assert row[1] == "msg-0"
+    assert row[6] == "invoice"
+    assert row[-1] == "v1"
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_drops_when_buffer_full():
+    sink = ListSink()
+    writer = ClassificationWriter(sink, batch_size=100, flush_interval=60, max_pending=5)
+    await writer.start()
+    assert _submit(writer, 7) == [True] * 5 + [False] * 2
+    await writer.stop()
+    assert sum(len(b) for b in sink.batches) == 5
+
+
+@pytest.mark.asyncio
+async def test_retries_failed_flush():
+    sink = ListSink(failures=1)
+    writer = ClassificationWriter(sink, batch_size=2, flush_interval=0.01)
+    await writer.start()
+    _submit(writer, 2)
+    await writer.stop()
+    assert [len(b) for b in sink.batches] == [2]
+
+
+def test_submit_without_running_writer_is_noop():
+    writer = ClassificationWriter(ListSink())
+    assert _submit(writer, 1) == [False]
@@ -0,0 +1,124 @@
+import asyncio
+
+import psycopg2.extensions
+import pytest
+
+from app.connections import ConnectionPools, PoolTimeout, PostgresPool, RedisPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def cursor(self):
+        return FakeCursor()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        pass
+
+
+class FakePostgresPool(PostgresPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__("postgresql://unused", *args, **kwargs)
+        self.opened: list[FakeConnection] = []
+
+    def _connect(self):
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+
+class FailingRedisPool(RedisPool):
+    async def probe(self) -> None:
+        raise ConnectionError("redis unavailable")
+
+
+@pytest.mark.asyncio
+async def test_postgres_pool_reuses_connections():
+    pool = FakePostgresPool(max_size=2)
+    for _ in range(5):
+        await pool.run(lambda conn: None)
+    assert len(pool.opened) == 1
+    assert pool.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_postgres_pool_discards_connection_after_error():
+    pool = FakePostgresPool(max_size=2)
+
+    def fail(conn):
+        raise psycopg2.OperationalError("server closed the connection")
+
+    with pytest.raises(psycopg2.OperationalError):
+        await pool.run(fail)
+    assert pool.opened[0].closed
+    await pool.run(lambda conn: None)
+    assert len(pool.opened) == 2
+
+
+@pytest.mark.asyncio
+async def test_postgres_pool_times_out_when_saturated():
+    pool = FakePostgresPool(max_size=1, acquire_timeout=0.05)
+    async with pool.connection():
+        assert pool.in_use == 1
+        with pytest.raises(PoolTimeout):
+            async with pool.connection():
+                pass
+    assert pool.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_postgres_pool_drains_before_closing():
+    pool = FakePostgresPool(max_size=2)
+    borrowed, release = asyncio.Event(), asyncio.Event()
+
+    async def borrow():
+        async with pool.connection():
+            borrowed.set()
+            await release.wait()
+
+    task = asyncio.create_task(borrow())
+    await borrowed.wait()
+    closing = asyncio.create_task(pool.close(drain_timeout=1.0))
+    await asyncio.sleep(0.1)
+    assert not closing.done()
+    release.set()
+    await asyncio.gather(task, closing)
+    assert all(conn.closed for conn in pool.opened)
+    with pytest.raises(PoolTimeout):
+        async with pool.connection():
+            pass
+
+
+@pytest.mark.asyncio
+async def test_health_reports_cached_probe_results():
+    pools = ConnectionPools(FakePostgresPool(max_size=4), FailingRedisPool("redis://localhost:6379/0"))
+    health = pools.health()
+    assert health["postgres"]["ok"] is None
+
+    await pools.probe_all()
+    health = pools.health()
+    assert health["postgres"]["ok"] is True
+    assert health["postgres"]["max_size"] == 4
+    assert health["postgres"]["saturation"] == 0.0
+    assert health["redis"]["ok"] is False
+    assert health["redis"]["error"] == "redis unavailable"
+    await pools.stop()
@@ -1,3 +1,5 @@
+import json
+
 from fastapi.testclient import TestClient
 
 from app.main import app
@@ -7,6 +9,8 @@ client = TestClient(app)
 
 def test_classify_endpoint():
     """Test POST /api/v1/email/classify returns valid response."""
+    from app.routers import email as email_router
+
     response = client.post(
         "/api/v1/email/classify",
         json={
@@ -29,6 +33,8 @@ def test_classify_endpoint():
     assert "tier_used" in data
     assert "reasoning" in data
     assert data["dry_run"] is False
+    assert data["ruleset_version"] == email_router.classifier.ruleset.version
+    assert data["ruleset_revision"] == email_router.classifier.ruleset.revision
     # Verify email echo fields
     assert "email" in data
     assert data["email"]["from_address"] == "kunde@firma.de"
@@ -158,3 +164,183 @@ def test_health_still_works():
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json()["status"] == "ok"
+
+
+def test_classify_batch_preserves_order():
+    """Test POST /api/v1/email/classify/batch returns one result per email, in order."""
+    response = client.post(
+        "/api/v1/email/classify/batch",
+        json=[
+            {"from_address": "billing@hetzner.com", "subject": "Ihre Rechnung"},
+            {"from_address": "root@proxmox.local", "subject": "Backup Report"},
+            {"from_address": "freund@gmail.com", "subject": "Hallo", "account": "family"},
+        ],
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 3
+    assert data["failed"] == 0
+    assert [item["index"] for item in data["results"]] == [0, 1, 2]
+    assert [item["result"]["category"] for item in data["results"]] == [
+        "invoice",
+        "server_alert",
+        "personal",
+    ]
+
+
+def test_classify_batch_item_errors_do_not_fail_batch():
+    response = client.post(
+        "/api/v1/email/classify/batch",
+        json=[
+            {"subject": "Ihre Rechnung"},
+            {"subject": "Test", "account": "not-an-account"},
+            "not an email",
+            {"subject": "Test", "received_at": ""},
+        ],
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 4
+    assert data["failed"] == 2
+    items = data["results"]
+    assert items[0]["result"]["category"] == "invoice"
+    assert items[1]["result"] is None
+    assert "account" in items[1]["error"]
+    assert items[2]["result"] is None
+    assert items[3]["error"] is None
+
+
+def test_classify_batch_too_large():
+    from app.config import settings
+
+    response = client.post(
+        "/api/v1/email/classify/batch",
+        json=[{}] * (settings.CLASSIFY_BATCH_MAX_SIZE + 1),
+    )
+    assert response.status_code == 413
+
+
+def test_classify_stream_ndjson():
+    """Test POST /api/v1/email/classify/stream returns one NDJSON line per email plus a summary."""
+    body = (
+        '{"from_address": "billing@hetzner.com", "subject": "Ihre Rechnung"}\n'
+        "\n"
+        "not json\n"
+        '{"from_address": "root@proxmox.local", "subject": "Backup Report"}'
+    )
+    response = client.post(
+        "/api/v1/email/classify/stream",
+        content=body,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 4
+    assert lines[0]["result"]["category"] == "invoice"
+    assert lines[1]["index"] == 1
+    assert "error" in lines[1]
+    assert lines[2]["result"]["category"] == "server_alert"
+    assert lines[3]["summary"]["processed"] == 3
+    assert lines[3]["summary"]["failed"] == 1
+
+
+def test_rule_stats_profiling():
+    """Test /api/v1/email/rules/stats records per-rule counters while profiling is on."""
+    assert client.delete("/api/v1/email/rules/stats").status_code == 200
+    response = client.put("/api/v1/email/rules/stats/profiling", json={"enabled": True})
+    assert response.json()["enabled"] is True
+    try:
+        client.post("/api/v1/email/classify", json={"from_address": "noreply@proxmox.local", "subject": "Backup"})
+        client.post("/api/v1/email/classify", json={"from_address": "kunde@firma.de", "subject": "Anfrage"})
+    finally:
+        client.put("/api/v1/email/rules/stats/profiling", json={"enabled": False})
+
+    data = client.get("/api/v1/email/rules/stats").json()
+    assert data["emails"] == 2
+    rules = {rule["name"]: rule for rule in data["rules"]}
+    assert rules["server_alert"]["evaluations"] == 2
+    assert rules["server_alert"]["first_matches"] == 1
+    assert rules["client_inquiry_business"]["first_matches"] == 1
+    assert rules["personal_family"]["evaluations"] == 0
+    assert rules["server_alert"]["conditions"][0]["matches"] == 1
+    assert rules["server_alert"]["conditions"][0]["field"] == "from_address"
+
+    # Disabled profiling records nothing further
+    client.post("/api/v1/email/classify", json={"subject": "Backup"})
+    assert client.get("/api/v1/email/rules/stats").json()["emails"] == 2
+
+    reset = client.delete("/api/v1/email/rules/stats").json()
+    assert reset["emails"] == 0
+    assert all(rule["evaluations"] == 0 for rule in reset["rules"])
+
+
+def test_classify_marks_near_duplicates():
+    """Test repeated alerts that only differ in timestamps share a cluster."""
+    first = client.post(
+        "/api/v1/email/classify",
+        json={
+            "from_address": "root@pbs.local",
+            "subject": "Garbage collect datastore zfs-pool01 successful",
+            "body_preview": "Job ID: 4711 started Mon Oct 13 03:00:01 2026, removed 12 chunks",
+            "message_id": "gc-001",
+        },
+    ).json()
+    second = client.post(
+        "/api/v1/email/classify",
+        json={
+            "from_address": "root@pbs.local",
+            "subject": "Garbage collect datastore zfs-pool01 successful",
+            "body_preview": "Job ID: 4790 started Tue Oct 14 03:00:02 2026, removed 7 chunks",
+            "message_id": "gc-002",
+        },
+    ).json()
+    assert first["cluster_id"] is not None
+    assert first["duplicate_of"] is None
+    assert second["cluster_id"] == first["cluster_id"]
+    assert second["duplicate_of"] == "gc-001"
+
+
+def test_backfills_do_not_join_near_duplicate_index(monkeypatch):
+    """Test /classify/batch and /classify/stream leave the live near-duplicate index alone."""
+    from app.routers import email as email_router
+    from app.services.near_duplicates import NearDuplicateIndex
+
+    monkeypatch.setattr(email_router.classifier, "near_duplicates", NearDuplicateIndex())
+    email = {
+        "from_address": "root@pbs.local",
+        "subject": "Verify datastore zfs-pool02 successful",
+        "body_preview": "Job ID: 1234 started Mon Oct 13 04:00:01 2026, verified 80 snapshots",
+        "message_id": "old-001",
+    }
+    client.post("/api/v1/email/classify/batch", json=[email])
+    client.post("/api/v1/email/classify/stream", content=json.dumps(email))
+    assert len(email_router.classifier.near_duplicates) == 0
+
+    live = client.post("/api/v1/email/classify", json={**email, "message_id": "new-001"}).json()
+    assert live["duplicate_of"] is None
+
+
+def test_examples_feed_knn_tier(monkeypatch):
+    """Test POST /api/v1/email/examples makes similar unmatched emails use the kNN labels."""
+    from app.routers import email as email_router
+    from app.services.knn_index import KnnIndex
+
+    monkeypatch.setattr(email_router.classifier, "knn", KnnIndex())
+    email = {
+        "from_address": "mailer-daemon@mail.example.de",
+        "subject": "Undelivered Mail Returned to Sender",
+        "body_preview": "I'm sorry to have to inform you that your message could not be delivered.",
+    }
+    response = client.post(
+        "/api/v1/email/examples",
+        json=[{"email": email, "category": "spam_suspect", "priority": "low", "actions": ["skip"]}],
+    )
+    assert response.status_code == 200
+    assert response.json() == {"added": 1, "total": 1}
+
+    data = client.post("/api/v1/email/test-classify", json=email).json()
+    assert data["category"] == "spam_suspect"
+    assert data["tier_used"] == 1
+    assert data["knn_used"] is True
+    assert data["actions"] == ["skip"]
@@ -1,3 +1,5 @@
+import json
+import os
 from pathlib import Path
 
 from app.models.email import EmailAccount, EmailClassifyRequest, EmailImportance
@@ -257,3 +259,198 @@ class TestEdgeCases:
         assert result.email.subject == "Anfrage AI"
         assert result.email.body_preview == "Sehr geehrter Herr Müller"
         assert result.email.account == "business"
+
+
+class TestRulesReload:
+    RULES = {
+        "rules": [
+            {
+                "name": "invoice",
+                "category": "invoice",
+                "priority": "medium",
+                "actions": ["notify_telegram"],
+                "conditions": {
+                    "match_type": "any",
+                    "rules": [{"field": "subject", "operator": "contains_any", "values": ["Rechnung"]}],
+                },
+            }
+        ]
+    }
+
+    def _write(self, path, data, mtime_ns):
+        path.write_text(data if isinstance(data, str) else json.dumps(data))
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_rules_compiled_once(self, tmp_path):
+        path = tmp_path / "rules.json"
+        self._write(path, self.RULES, 1_000_000_000)
+        c = EmailClassifier(rules_path=path)
+        version = c.ruleset.version
+        assert c.reload_if_changed() is False
+        c.classify(_make_email(subject="Rechnung"))
+        assert c.ruleset.version == version
+
+    def test_reload_on_change(self, tmp_path):
+        path = tmp_path / "rules.json"
+        self._write(path, self.RULES, 1_000_000_000)
+        c = EmailClassifier(rules_path=path)
+        assert c.classify(_make_email(subject="Invoice 42")).category.value == "uncategorized"
+
+        rules = json.loads(json.dumps(self.RULES))
+        rules["rules"][0]["conditions"]["rules"][0]["values"].append("Invoice")
+        self._write(path, rules, 2_000_000_000)
+        assert c.reload_if_changed() is True
+        assert c.classify(_make_email(subject="Invoice 42")).category.value == "invoice"
+
+    def test_bad_edit_keeps_last_good_ruleset(self, tmp_path):
+        path = tmp_path / "rules.json"
+        self._write(path, self.RULES, 1_000_000_000)
+        c = EmailClassifier(rules_path=path)
+        version = c.ruleset.version
+
+        self._write(path, '{"rules": [', 2_000_000_000)
+        assert c.reload_if_changed() is False
+        assert c.ruleset.version == version
+
+        rules = json.loads(json.dumps(self.RULES))
+        rules["rules"][0]["category"] = "no_such_category"
+        self._write(path, rules, 3_000_000_000)
+        assert c.reload_if_changed() is False
+        assert c.ruleset.version == version
+        assert c.classify(_make_email(subject="Rechnung")).category.value == "invoice"
+
+    def test_malformed_condition_keeps_last_good_ruleset(self, tmp_path):
+        path = tmp_path / "rules.json"
+        self._write(path, self.RULES, 1_000_000_000)
+        c = EmailClassifier(rules_path=path)
+        version = c.ruleset.version
+
+        rules = json.loads(json.dumps(self.RULES))
+        rules["rules"][0]["conditions"]["rules"].append("subject contains Rechnung")
+        self._write(path, rules, 2_000_000_000)
+        assert c.reload_if_changed() is False
+        assert c.ruleset.version == version
+
+    def test_unknown_operator_never_matches(self, tmp_path):
+        path = tmp_path / "rules.json"
+        rules = json.loads(json.dumps(self.RULES))
+        rules["rules"][0]["conditions"]["rules"].append(
+            {"field": "subject", "operator": "starts_with", "values": ["Invoice"]}
+        )
+        self._write(path, rules, 1_000_000_000)
+        c = EmailClassifier(rules_path=path)
+        assert c.classify(_make_email(subject="Invoice 42")).category.value == "uncategorized"
+        assert c.classify(_make_email(subject="Rechnung")).category.value == "invoice"
+
+    def test_missing_file_yields_empty_ruleset(self, tmp_path):
+        c = EmailClassifier(rules_path=tmp_path / "missing.json")
+        assert c.get_rules() == []
+        assert c.classify(_make_email()).category.value == "uncategorized"
+
+
+class TestReasoning:
+    def test_reasoning_lists_first_configured_keyword(self):
+        """The reported keyword follows rule order, not position in the text."""
+        c = get_classifier()
+        email = _make_email(
+            from_address="root@proxmox.local",
+            subject="Backup error on pbs01",
+        )
+        result = c.classify(email)
+        assert result.reasoning == (
+            "Rule 'server_alert': from_address contains 'root@'; subject contains 'error'"
+        )
+
+    def test_not_contains_reasoning(self):
+        c = get_classifier()
+        email = _make_email(from_address="kunde@firma.de", subject="Anfrage")
+        result = c.classify(email)
+        assert result.reasoning == (
+            "Rule 'client_inquiry_business': account equals 'business'; "
+            "from_address does not contain blocked patterns"
+        )
+
+
+class TestSenderListOperators:
+    @staticmethod
+    def _rules(*conditions, match_type="any"):
+        return {
+            "rules": [
+                {
+                    "name": "listed",
+                    "category": "spam_suspect",
+                    "priority": "low",
+                    "actions": ["skip"],
+                    "conditions": {"match_type": match_type, "rules": list(conditions)},
+                }
+            ]
+        }
+
+    def _classifier(self, tmp_path, *conditions, **kwargs) -> EmailClassifier:
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps(self._rules(*conditions, **kwargs)))
+        return EmailClassifier(rules_path=path)
+
+    def test_domain_in(self, tmp_path):
+        c = self._classifier(
+            tmp_path, {"field": "from_address", "operator": "domain_in", "values": ["@Spam.example", "junk.test."]}
+        )
+        result = c.classify(_make_email(from_address="Offers <deals@SPAM.example>"))
+        assert result.category.value == "spam_suspect"
+        assert result.reasoning == "Rule 'listed': from_address domain is 'spam.example'"
+        assert c.classify(_make_email(from_address="a@junk.test")).category.value == "spam_suspect"
+        assert c.classify(_make_email(from_address="a@sub.spam.example")).category.value == "uncategorized"
+
+    def test_address_in(self, tmp_path):
+        c = self._classifier(tmp_path, {"field": "from_address", "operator": "address_in", "values": ["Chef@Firma.de"]})
+        assert c.classify(_make_email(from_address="chef@firma.de")).category.value == "spam_suspect"
+        assert c.classify(_make_email(from_address="buchhaltung@firma.de")).category.value == "uncategorized"
+
+    def test_domain_suffix_in(self, tmp_path):
+        c = self._classifier(
+            tmp_path, {"field": "from_address", "operator": "domain_suffix_in", "values": [".example.com"]}
+        )
+        result = c.classify(_make_email(from_address="news@mail.shop.example.com"))
+        assert result.reasoning == "Rule 'listed': from_address domain ends with 'example.com'"
+        assert c.classify(_make_email(from_address="a@example.com")).category.value == "spam_suspect"
+        assert c.classify(_make_email(from_address="a@notexample.com")).category.value == "uncategorized"
+
+    def test_regex(self, tmp_path):
+        c = self._classifier(
+            tmp_path, {"field": "subject", "operator": "regex", "values": [r"^Ticket #\d+ (opened|closed)"]}
+        )
+        result = c.classify(_make_email(subject="TICKET #4711 closed"))
+        assert result.category.value == "spam_suspect"
+        assert result.reasoning.endswith(r"subject matches /^Ticket #\d+ (opened|closed)/")
+        assert c.classify(_make_email(subject="Re: Ticket #4711 closed")).category.value == "uncategorized"
+
+    def test_invalid_regex_rejects_ruleset(self, tmp_path):
+        c = self._classifier(tmp_path, {"field": "subject", "operator": "regex", "values": ["(unclosed"]})
+        assert c.get_rules() == []
+
+    def test_values_file_and_reload(self, tmp_path):
+        lists = tmp_path / "lists"
+        lists.mkdir()
+        values_file = lists / "spam_domains.txt"
+        values_file.write_text("# known spam senders\nspam.example\n\n  junk.test  \n")
+        os.utime(values_file, ns=(1_000_000_000, 1_000_000_000))
+        c = self._classifier(
+            tmp_path,
+            {"field": "from_address", "operator": "domain_in", "values": ["inline.test"], "values_file": "lists/spam_domains.txt"},
+        )
+        assert c.ruleset.value_files == (values_file,)
+        for sender in ("a@spam.example", "a@junk.test", "a@inline.test"):
+            assert c.classify(_make_email(from_address=sender)).category.value == "spam_suspect"
+        assert c.get_rules()[0].conditions["rules"][0]["values_file"] == "lists/spam_domains.txt"
+
+        version = c.ruleset.version
+        values_file.write_text("spam.example\nnew.test\n")
+        os.utime(values_file, ns=(2_000_000_000, 2_000_000_000))
+        assert c.reload_if_changed() is True
+        assert c.ruleset.version != version
+        assert c.classify(_make_email(from_address="a@new.test")).category.value == "spam_suspect"
+        assert c.classify(_make_email(from_address="a@junk.test")).category.value == "uncategorized"
+
+        values_file.unlink()
+        assert c.reload_if_changed() is False
+        assert c.classify(_make_email(from_address="a@new.test")).category.value == "spam_suspect"
@@ -0,0 +1,226 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app.models.email import EmailAccount, EmailImportance
+from app.services.graph_poller import (
+    GraphMailbox,
+    GraphMailPoller,
+    GraphStateStore,
+    GraphTokenProvider,
+    to_email_request,
+)
+
+GRAPH = "http://graph.test/v1.0"
+TOKEN_URL = "http://login.test/common/oauth2/v2.0/token"
+RECEIVED_AT = (datetime.now(timezone.utc) - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def message(message_id: str, subject: str, **extra) -> dict:
+    return {
+        "id": message_id,
+        "subject": subject,
+        "from": {"emailAddress": {"address": "billing@hetzner.com", "name": "Hetzner"}},
+        "bodyPreview": "Anbei Ihre Rechnung",
+        "receivedDateTime": RECEIVED_AT,
+        "hasAttachments": True,
+        "importance": "normal",
+        "isDraft": False,
+        **extra,
+    }
+
+
+def fake_graph() -> FastAPI:
+    """Local stand-in for the token endpoint and the inbox delta API."""
+    app = FastAPI()
+    app.state.inbox = []  # pages served by the next delta round
+    app.state.requests = []
+    app.state.tokens = 0
+    app.state.refresh_tokens = []
+    app.state.expire_delta = False
+
+    @app.post("/common/oauth2/v2.0/token")
+    async def token(request: Request):
+        form = parse_qs((await request.body()).decode())
+        assert form["grant_type"] == ["refresh_token"]
+        app.state.refresh_tokens.append(form["refresh_token"][0])
+        app.state.tokens += 1
+        return {"access_token": f"at-{app.state.tokens}", "expires_in": 3600, "refresh_token": f"rt-{app.state.tokens}"}
+
+    @app.get("/v1.0/me/mailFolders/inbox/messages/delta")
+    async def delta(request: Request):
+        app.state.requests.append(request)
+        if request.headers.get("authorization") != f"Bearer at-{app.state.tokens}":
+            return JSONResponse({"error": {"code": "InvalidAuthenticationToken"}}, status_code=401)
+        params = request.query_params
+        if "$deltatoken" in params and app.state.expire_delta:
+            app.state.expire_delta = False
+            return JSONResponse({"error": {"code": "SyncStateNotFound"}}, status_code=410)
+        page = int(params.get("page", 0))
+        pages = app.state.inbox or [[]]
+        body = {"value": pages[page]}
+        if page + 1 < len(pages):
+            body["@odata.nextLink"] = f"{GRAPH}/me/mailFolders/inbox/messages/delta?$skiptoken=x&page={page + 1}"
+        else:
+            body["@odata.deltaLink"] = f"{GRAPH}/me/mailFolders/inbox/messages/delta?$deltatoken=d{len(app.state.requests)}"
+            app.state.inbox = []
+        return body
+
+    return app
+
+
+def make_poller(app: FastAPI, tmp_path, batches: list) -> tuple[GraphMailPoller, GraphStateStore]:
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+    state = GraphStateStore(tmp_path / "graph_state.json")
+
+    async def handler(emails):
+        batches.append(emails)
+
+    mailbox = GraphMailbox(
+        EmailAccount.FAMILY,
+        GraphTokenProvider(http, TOKEN_URL, "client", "secret", EmailAccount.FAMILY, "rt-initial", state),
+    )
+    return GraphMailPoller([mailbox], state, handler, http, graph_base=GRAPH, page_size=2), state
+
+
+@pytest.mark.asyncio
+async def test_initial_sync_pages_and_stores_delta_link(tmp_path):
+    app = fake_graph()
+    app.state.inbox = [[message("m1", "Rechnung 1"), message("m2", "Rechnung 2")], [message("m3", "Rechnung 3")]]
+    batches = []
+    poller, state = make_poller(app, tmp_path, batches)
+
+    assert await poller.poll_all() == 3
+    assert [[e.message_id for e in batch] for batch in batches] == [["m1", "m2"], ["m3"]]
+    assert all(e.account == EmailAccount.FAMILY for batch in batches for e in batch)
+
+    first = app.state.requests[0]
+    assert first.query_params["$select"].startswith("id,subject,from")
+    assert first.query_params["$filter"].startswith("receivedDateTime ge ")
+    assert first.headers["prefer"] == "odata.maxpagesize=2"
+    assert "$deltatoken" in state.get(EmailAccount.FAMILY, "delta_link")
+
+    saved = json.loads((tmp_path / "graph_state.json").read_text())
+    assert saved["family"]["refresh_token"] == "rt-1"
+    await poller.stop()
+
+
+@pytest.mark.asyncio
+async def test_next_round_uses_delta_link_and_skips_removed_and_drafts(tmp_path):
+    app = fake_graph()
+    batches = []
+    poller, state = make_poller(app, tmp_path, batches)
+    assert await poller.poll_all() == 0
+
+    app.state.inbox = [
+        [
+            message("m4", "Neue Rechnung"),
+            {"id": "m1", "@removed": {"reason": "deleted"}},
+            message("m5", "Entwurf", isDraft=True),
+        ]
+    ]
+    assert await poller.poll_all() == 1
+    assert [e.message_id for e in batches[0]] == ["m4"]
+    assert "$deltatoken" in str(app.state.requests[-1].url)
+    assert app.state.tokens == 1  # access token reused
+    await poller.stop()
+
+
+@pytest.mark.asyncio
+async def test_changed_messages_are_not_handled_again(tmp_path):
+    app = fake_graph()
+    app.state.inbox = [[message("m1", "Rechnung 1")]]
+    batches = []
+    poller, state = make_poller(app, tmp_path, batches)
+    assert await poller.poll_all() == 1
+
+    # Marked as read, and a message from last month flagged
+    app.state.inbox = [
+        [message("m1", "Rechnung 1", isRead=True), message("m0", "Alt", receivedDateTime="2020-01-01T08:00:00Z")]
+    ]
+    assert await poller.poll_all() == 0
+    await poller.stop()
+
+    # Remembered across restarts
+    restarted, _ = make_poller(app, tmp_path, batches)
+    app.state.inbox = [[message("m1", "Rechnung 1", flag={"flagStatus": "flagged"}), message("m2", "Neu")]]
+    assert await restarted.poll_all() == 1
+    assert [[e.message_id for e in batch] for batch in batches] == [["m1"], ["m2"]]
+    await restarted.stop()
+
+
+@pytest.mark.asyncio
+async def test_only_one_worker_polls_and_another_takes_over(tmp_path):
+    app = fake_graph()
+    app.state.inbox = [[message("m1", "Rechnung 1")]]
+    batches = []
+    workers = [make_poller(app, tmp_path, batches)[0] for _ in range(2)]
+    for poller in workers:
+        poller.interval = 0.01
+        await poller.start()
+        # The first worker claims the state file before the second one starts
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(0.1)
+    assert [[e.message_id for e in batch] for batch in batches] == [["m1"]]
+
+    await workers[0].stop()
+    app.state.inbox = [[message("m1", "Rechnung 1", isRead=True), message("m2", "Neu")]]
+    await asyncio.sleep(0.2)
+    await workers[1].stop()
+    assert [[e.message_id for e in batch] for batch in batches] == [["m1"], ["m2"]]
+    # The second worker went on with the refresh token the first one rotated
+    assert app.state.refresh_tokens == ["rt-initial", "rt-1"]
+
+
+@pytest.mark.asyncio
+async def test_expired_delta_token_restarts_sync(tmp_path):
+    app = fake_graph()
+    batches = []
+    poller, state = make_poller(app, tmp_path, batches)
+    await poller.poll_all()
+
+    app.state.expire_delta = True
+    app.state.inbox = [[message("m6", "Rechnung 6")]]
+    assert await poller.poll_all() == 1
+    assert "$filter" in app.state.requests[-1].query_params
+    await poller.stop()
+
+
+@pytest.mark.asyncio
+async def test_refreshes_token_after_401_and_prefers_stored_refresh_token(tmp_path):
+    app = fake_graph()
+    batches = []
+    poller, state = make_poller(app, tmp_path, batches)
+    await poller.poll_all()
+    app.state.tokens += 1  # server-side revocation: the cached access token is no longer valid
+
+    app.state.inbox = [[message("m7", "Rechnung 7")]]
+    assert await poller.poll_all() == 1
+    assert state.get(EmailAccount.FAMILY, "refresh_token") == "rt-3"
+    assert app.state.refresh_tokens == ["rt-initial", "rt-1"]
+    await poller.stop()
+
+    restarted = GraphStateStore(tmp_path / "graph_state.json")
+    provider = GraphTokenProvider(None, TOKEN_URL, "c", "s", EmailAccount.FAMILY, "rt-initial", restarted)
+    assert provider.refresh_token == "rt-3"
+
+
+def test_to_email_request_maps_graph_message():
+    email = to_email_request(message("m1", "Rechnung", importance="High"), EmailAccount.BUSINESS)
+    assert email.from_address == "billing@hetzner.com"
+    assert email.from_name == "Hetzner"
+    assert email.importance == EmailImportance.HIGH
+    assert email.has_attachments is True
+    assert email.received_at is not None
+    assert email.message_id == "m1"
+
+    bare = to_email_request({"id": "m2", "sender": {"emailAddress": {"address": "a@b.de"}}}, EmailAccount.FAMILY)
+    assert bare.from_address == "a@b.de"
+    assert bare.subject == ""
+    assert bare.received_at is None
@@ -0,0 +1,213 @@
+import asyncio
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+from app.connections import RedisPool
+from app.main import app
+from app.models.email import EmailClassifyRequest
+from app.services.ingest_queue import IngestQueue, IngestQueueFull, IngestWorkerPool
+
+client = TestClient(app)
+
+INVOICE = {
+    "from_address": "billing@hetzner.com",
+    "subject": "Ihre Rechnung Nr. 12345",
+    "account": "business",
+    "message_id": "AAMkAGI2-invoice",
+}
+
+
+class BlockingFakeRedis(fakeredis.FakeAsyncRedis):
+    """fakeredis answers XREADGROUP ... BLOCK at once; wait like Redis when nothing arrived."""
+
+    async def xreadgroup(self, *args, block=None, **kwargs):
+        response = await super().xreadgroup(*args, block=block, **kwargs)
+        if not response and block:
+            await asyncio.sleep(block / 1000)
+        return response
+
+
+class StreamServer:
+    """Answers just enough RESP for idle consumers; XREADGROUP ... BLOCK waits like Redis."""
+
+    def __init__(self):
+        self.reads = 0
+
+    async def __aenter__(self) -> str:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return "redis://127.0.0.1:%d/0" % self.server.sockets[0].getsockname()[1]
+
+    async def __aexit__(self, *exc) -> None:
+        self.server.close()
+
+    async def _serve(self, reader, writer) -> None:
+        try:
+            while line := await reader.readline():
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2].upper())
+                writer.write(await self._reply(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _reply(self, args: list[bytes]) -> bytes:
+        if args[0] == b"XREADGROUP":
+            self.reads += 1
+            await asyncio.sleep(int(args[args.index(b"BLOCK") + 1]) / 1000)
+            return b"*-1\r\n"
+        if args[0] == b"XLEN":
+            return b":0\r\n"
+        if args[0] in (b"CLIENT", b"XGROUP", b"PING"):
+            return b"+OK\r\n"
+        return b"*0\r\n"
+
+
+@pytest.fixture
+def queue():
+    return IngestQueue(BlockingFakeRedis(), max_length=5)
+
+
+def _pool(queue, handler, **kwargs) -> IngestWorkerPool:
+    kwargs.setdefault("block_ms", 10)
+    kwargs.setdefault("claim_idle", 0.001)
+    return IngestWorkerPool(queue, handler, consumers=2, **kwargs)
+
+
+async def _wait_until(condition, timeout: float = 2.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_consumers_classify_and_acknowledge(queue):
+    handled = []
+
+    async def handler(email):
+        handled.append(email.subject)
+
+    pool = _pool(queue, handler)
+    await pool.start()
+    for i in range(3):
+        await queue.append(EmailClassifyRequest(from_address="a@b.de", subject=f"Mail {i}"))
+    await _wait_until(lambda: len(handled) == 3)
+    await pool.stop()
+
+    assert sorted(handled) == ["Mail 0", "Mail 1", "Mail 2"]
+    stats = await pool.update_metrics()
+    assert stats["length"] == 0 and stats["pending"] == 0 and stats["dead_letters"] == 0
+    assert stats["consumers"] == 2
+
+
+@pytest.mark.asyncio
+async def test_failures_are_retried_then_dead_lettered(queue):
+    attempts = []
+
+    async def handler(email):
+        attempts.append(email.subject)
+        if email.subject == "kaputt" or len(attempts) == 1:
+            raise RuntimeError("Postgres down")
+
+    await queue.ensure_group()
+    await queue.append(EmailClassifyRequest(from_address="a@b.de", subject="ok"))
+    await queue.append(EmailClassifyRequest(from_address="a@b.de", subject="kaputt"))
+    pool = _pool(queue, handler, max_deliveries=3)
+    for entry in await queue.read("worker-0", 10, 10):
+        await pool.process(entry, deliveries=1)
+    assert (await queue.stats())["pending"] == 2
+
+    async def retry() -> int:
+        await asyncio.sleep(0.005)  # past claim_idle
+        return await pool.retry_idle()
+
+    assert await retry() == 2  # "ok" succeeds on its second attempt
+    assert await retry() == 1
+    assert await retry() == 1  # third delivery done: dead-lettered
+    assert attempts == ["ok", "kaputt", "ok", "kaputt", "kaputt"]
+
+    stats = await queue.stats()
+    assert stats["length"] == 0 and stats["pending"] == 0 and stats["dead_letters"] == 1
+    [(_, fields)] = await queue.client.xrange(queue.dead_letter_stream)
+    assert b"kaputt" in fields[b"email"]
+    assert fields[b"reason"] == b"Failed 3 times, last: RuntimeError: Postgres down"
+
+
+@pytest.mark.asyncio
+async def test_entries_of_a_dead_consumer_are_taken_over(queue):
+    await queue.ensure_group()
+    await queue.append(EmailClassifyRequest(from_address="a@b.de", subject="Backup Report"))
+    # Read by a process that crashed before acknowledging
+    assert len(await queue.read("old-host-1-0", 10, 10)) == 1
+
+    handled = []
+
+    async def handler(email):
+        handled.append(email.subject)
+
+    await asyncio.sleep(0.005)
+    await _pool(queue, handler).retry_idle()
+    assert handled == ["Backup Report"]
+    assert (await queue.stats())["length"] == 0
+
+
+@pytest.mark.asyncio
+async def test_invalid_entries_go_straight_to_dead_letters(queue):
+    async def handler(email):
+        raise AssertionError("handler called for an invalid entry")
+
+    await queue.ensure_group()
+    await queue.client.xadd(queue.stream, {"email": '{"account": "spam"}'})
+    pool = _pool(queue, handler)
+    [entry] = await queue.read("worker-0", 10, 10)
+    assert await pool.process(entry, deliveries=1)
+    assert (await queue.stats())["dead_letters"] == 1
+
+
+@pytest.mark.asyncio
+async def test_full_queue_refuses_new_emails(queue):
+    for i in range(5):
+        await queue.append(EmailClassifyRequest(from_address="a@b.de", subject=f"Mail {i}"))
+    with pytest.raises(IngestQueueFull):
+        await queue.append(EmailClassifyRequest(from_address="a@b.de", subject="one too many"))
+    stats = await queue.stats()
+    assert stats["length"] == 5 and stats["lag"] == 5
+    assert stats["oldest_age_seconds"] >= 0
+
+
+def test_ingest_endpoint(monkeypatch):
+    from app.routers import email as email_router
+
+    monkeypatch.setattr(email_router, "ingest", None)
+    assert client.post("/api/v1/email/ingest", json=INVOICE).status_code == 409
+
+    queue = IngestQueue(fakeredis.FakeAsyncRedis())
+    monkeypatch.setattr(email_router, "ingest", queue)
+    response = client.post("/api/v1/email/ingest", json=INVOICE)
+    assert response.status_code == 202
+    assert response.json()["queued"] is True
+    assert client.post("/api/v1/email/ingest", json={"account": "spam"}).status_code == 422
+
+    status = client.get("/api/v1/email/ingest/status").json()
+    assert status["length"] == 1
+    assert status["dead_letters"] == 0
+
+
+@pytest.mark.asyncio
+async def test_idle_consumers_outlast_the_socket_timeout(caplog):
+    server = StreamServer()
+    async with server as url:
+        redis = RedisPool(url, socket_timeout=0.2)
+        queue = IngestQueue(redis.client, read_client=redis.blocking_client(0.5, 1))
+        pool = IngestWorkerPool(queue, None, consumers=1, block_ms=500, retry_delay=5)
+        await pool.start()
+        await _wait_until(lambda: server.reads >= 3, timeout=3)
+        await pool.stop()
+        await redis.close(drain_timeout=1)
+    assert "Reading the ingest stream failed" not in caplog.text
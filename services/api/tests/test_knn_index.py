@@ -0,0 +1,117 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.models.email import EmailAction, EmailCategory, EmailClassifyRequest, EmailPriority
+from app.services.email_classifier import EmailClassifier
+from app.services.knn_index import KnnIndex
+from app.services.vectorizer import HashingVectorizer
+
+CONFIG_PATH = Path(__file__).parent.parent.parent.parent / "config" / "email_rules.json"
+
+# Bounces pass no rule: mailer-daemon@ is excluded from the catch-all account rules
+UNMATCHED = EmailClassifyRequest(
+    from_address="mailer-daemon@mail.example.de",
+    subject="Undelivered Mail Returned to Sender",
+    body_preview="This is the mail system at host mail.example.de. I'm sorry to have to inform you that your message could not be delivered.",
+)
+
+
+def _seeded_index(path=None) -> KnnIndex:
+    index = KnnIndex(path, k=3)
+    for host in ("mx1", "mx2", "mx3"):
+        email = UNMATCHED.model_copy(update={"from_address": f"mailer-daemon@{host}.example.de"})
+        index.add(email, EmailCategory.SPAM_SUSPECT, EmailPriority.LOW, [EmailAction.SKIP])
+    index.add(
+        EmailClassifyRequest(subject="Ihr Paket wurde zugestellt", body_preview="Sendungsverfolgung DHL"),
+        EmailCategory.NEWSLETTER,
+        EmailPriority.LOW,
+        [EmailAction.SKIP],
+    )
+    return index
+
+
+def test_vectorizer_rows_match_single_transform():
+    vectorizer = HashingVectorizer(dim=64)
+    emails = [UNMATCHED, EmailClassifyRequest(subject="Hallo"), EmailClassifyRequest()]
+    matrix = vectorizer.transform(emails)
+    assert matrix.shape == (3, 64)
+    for row, email in zip(matrix, emails):
+        assert np.allclose(row, vectorizer.transform_one(email))
+    assert np.isclose(np.linalg.norm(matrix[0]), 1.0)
+    assert not matrix[2].any()
+
+
+def test_query_returns_majority_label_of_similar_examples():
+    match = _seeded_index().query(UNMATCHED)
+    assert match.category == EmailCategory.SPAM_SUSPECT
+    assert match.priority == EmailPriority.LOW
+    assert match.actions == [EmailAction.SKIP]
+    assert match.neighbours == 3
+    assert match.similarity > 0.9
+
+
+def test_query_below_min_similarity_returns_none():
+    index = _seeded_index()
+    assert index.query(EmailClassifyRequest(subject="Quarterly roadmap review")) is None
+    assert KnnIndex().query(UNMATCHED) is None
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = _seeded_index(tmp_path)
+    assert index.save()
+    assert not index.dirty
+    assert not index.save()
+
+    loaded = KnnIndex(tmp_path, k=3).load()
+    assert len(loaded) == 4
+    assert isinstance(loaded._base_columns, np.memmap)
+    assert loaded.query(UNMATCHED).category == EmailCategory.SPAM_SUSPECT
+
+    loaded.add(UNMATCHED, EmailCategory.SPAM_SUSPECT, EmailPriority.HIGH, [EmailAction.NOTIFY_TELEGRAM])
+    assert len(loaded) == 5
+    assert loaded.save()
+    assert len(KnnIndex(tmp_path).load()) == 5
+
+
+def test_load_ignores_index_with_other_dimension(tmp_path):
+    _seeded_index(tmp_path).save()
+    assert len(KnnIndex(tmp_path, dim=128).load()) == 0
+
+
+def test_load_ignores_index_without_labels(tmp_path):
+    _seeded_index(tmp_path).save()
+    (tmp_path / "labels.npy").unlink()
+    assert len(KnnIndex(tmp_path).load()) == 0
+
+
+def test_workers_sharing_a_directory_keep_each_others_examples(tmp_path):
+    first, second = KnnIndex(tmp_path, k=3).load(), KnnIndex(tmp_path, k=3).load()
+    first.add(UNMATCHED, EmailCategory.SPAM_SUSPECT, EmailPriority.LOW, [EmailAction.SKIP])
+    second.add(EmailClassifyRequest(subject="Paket"), EmailCategory.NEWSLETTER, EmailPriority.LOW, [EmailAction.SKIP])
+    second.add(EmailClassifyRequest(subject="Rechnung"), EmailCategory.INVOICE, EmailPriority.LOW, [EmailAction.SKIP])
+    assert first.revision != second.revision
+    assert first.save() and second.save()
+    assert len(second) == 3
+    assert not list(tmp_path.glob("*.tmp"))
+
+    assert first.reload_if_changed()
+    assert not first.reload_if_changed()
+    assert len(first) == 3
+    assert first.revision == second.revision == "2"
+    assert len(KnnIndex(tmp_path).load()) == 3
+
+
+def test_classifier_uses_knn_only_when_no_rule_matches():
+    classifier = EmailClassifier(rules_path=CONFIG_PATH, knn=_seeded_index())
+    result = classifier.classify(UNMATCHED)
+    assert result.category.value == "spam_suspect"
+    assert result.tier_used == 1
+    assert result.knn_used
+    assert 0.5 < result.confidence <= 0.8
+    assert result.reasoning.startswith("Nearest examples: 3 of 3")
+
+    invoice = classifier.classify(EmailClassifyRequest(from_address="billing@hetzner.com", subject="Rechnung"))
+    assert invoice.category.value == "invoice"
+    assert invoice.tier_used == 1
+    assert not invoice.knn_used
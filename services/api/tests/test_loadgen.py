@@ -0,0 +1,43 @@
+import json
+import random
+
+from app.models.email import EmailClassifyRequest
+from benchmarks import loadgen
+from benchmarks.corpus import generate_emails
+
+
+def test_n8n_payloads_are_accepted_by_the_model():
+    rnd = random.Random(1)
+    payloads = [loadgen.to_n8n_payload(e, rnd) for e in generate_emails(300)]
+    assert any(p.get("received_at") == "" for p in payloads)
+    assert any("importance" not in p for p in payloads)
+    for payload in payloads + loadgen.storm_payloads(20, rnd, 0):
+        EmailClassifyRequest.model_validate(payload)
+
+
+def test_open_schedule_overlays_storms():
+    schedule = loadgen.open_schedule(50, 10, random.Random(1), storm_every=4, storm_size=100, storm_duration=1)
+    storm = [t for t, kind in schedule if kind == "storm"]
+    assert len(storm) == 200  # at 4 s and 8 s
+    assert min(storm) == 4 and max(storm) < 9
+    assert 350 < len(schedule) - len(storm) < 650
+    assert schedule == sorted(schedule)
+
+
+def test_closed_loop_in_process(tmp_path):
+    output = tmp_path / "load.json"
+    assert loadgen.main(["-o", str(output), "closed", "--concurrency", "4", "--requests", "40"]) == 0
+    report = json.loads(output.read_text())
+    assert report["completed"] == 40
+    assert report["errors"] == 0
+    assert report["statuses"] == {"200": 40}
+    assert report["latency"]["p50_ms"] <= report["latency"]["p99_ms"]
+
+
+def test_open_loop_with_storm_in_process(tmp_path):
+    output = tmp_path / "load.json"
+    args = ["open", "--rate", "50", "--duration", "0.6", "--storm-every", "0.3", "--storm-size", "20", "--storm-duration", "0.1"]
+    assert loadgen.main(["-o", str(output), *args]) == 0
+    report = json.loads(output.read_text())
+    assert report["latency_storm"]["requests"] == 20
+    assert report["error_rate"] == 0.0
@@ -0,0 +1,36 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+
+def _sample(text: str, prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_endpoint_exposes_prometheus_text():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "lm_rules_reloads_total" in response.text
+
+
+def test_classification_is_counted():
+    label = 'lm_classifications_total{category="invoice",rule="invoice"}'
+    before = _sample(client.get("/metrics").text, label)
+    client.post("/api/v1/email/classify", json={"subject": "Ihre Rechnung"})
+    text = client.get("/metrics").text
+    assert _sample(text, label) == before + 1
+    assert "lm_classification_duration_seconds_count" in text
+
+
+def test_request_latency_uses_route_template():
+    client.post("/api/v1/email/classify", json={"subject": "Test"})
+    client.get("/does-not-exist")
+    text = client.get("/metrics").text
+    assert 'route="/api/v1/email/classify"' in text
+    assert 'route="unmatched"' in text
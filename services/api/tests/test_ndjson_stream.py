@@ -0,0 +1,42 @@
+import json
+from pathlib import Path
+
+from app.cli import classify_stream
+from app.services.ndjson_stream import NdjsonLineSplitter
+
+CONFIG_PATH = Path(__file__).parent.parent.parent.parent / "config" / "email_rules.json"
+
+
+class TestLineSplitter:
+    def test_lines_split_across_chunks(self):
+        splitter = NdjsonLineSplitter()
+        lines = list(splitter.feed(b'{"a": 1}\n{"b"')) + list(splitter.feed(b": 2}\n")) + list(splitter.close())
+        assert lines == [b'{"a": 1}', b'{"b": 2}']
+
+    def test_trailing_line_without_newline(self):
+        splitter = NdjsonLineSplitter()
+        assert list(splitter.feed(b"one\ntwo")) == [b"one"]
+        assert list(splitter.close()) == [b"two"]
+
+    def test_overlong_line_is_dropped_and_reported(self):
+        splitter = NdjsonLineSplitter(max_line_bytes=8)
+        lines = list(splitter.feed(b"short\n" + b"x" * 5)) + list(splitter.feed(b"x" * 20 + b"\nok\n"))
+        assert lines == [b"short", None, b"ok"]
+
+
+def test_cli_classifies_file(tmp_path, capsys):
+    source = tmp_path / "emails.ndjson"
+    target = tmp_path / "results.ndjson"
+    source.write_text(
+        json.dumps({"from_address": "newsletter@techcrunch.com", "subject": "Daily"})
+        + "\n"
+        + json.dumps({"from_address": "winner@lottery.com", "subject": "You are a Winner"})
+        + "\n"
+    )
+    assert classify_stream.main([str(source), "-o", str(target), "--rules", str(CONFIG_PATH)]) == 0
+
+    results = [json.loads(line) for line in target.read_text().splitlines()]
+    assert [r["result"]["category"] for r in results] == ["newsletter", "spam_suspect"]
+    summary = json.loads(capsys.readouterr().err)
+    assert summary["processed"] == 2
+    assert summary["failed"] == 0
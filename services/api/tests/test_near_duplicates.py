@@ -0,0 +1,74 @@
+from app.models.email import EmailClassifyRequest
+from app.services.near_duplicates import NearDuplicateIndex, features, simhash
+
+
+def logwatch(host: str, date: str, message_id: str = "") -> EmailClassifyRequest:
+    return EmailClassifyRequest(
+        subject=f"Logwatch for {host} (Linux)",
+        body_preview=f"Processing Initiated: {date} Date Range Processed: yesterday Detail Level of Output: 0",
+        message_id=message_id,
+    )
+
+
+def test_features_ignore_digits_and_dates():
+    assert features("Backup pve01 Mon Oct 13 04:02:01 2026 OK") == {"backup", "pve", "ok"}
+
+
+def test_simhash_is_stable_and_none_for_empty_text():
+    assert simhash("Backup failed on pve01") == simhash("backup FAILED on pve02")
+    assert simhash("") is None
+    assert simhash("2026-10-13 04:02") is None
+
+
+def test_near_duplicate_joins_first_cluster():
+    index = NearDuplicateIndex()
+    first = index.check(logwatch("pve01", "Mon Oct 13 04:02:01 2026", "msg-1"))
+    second = index.check(logwatch("pve02", "Tue Oct 14 04:02:11 2026", "msg-2"))
+    assert first.duplicate_of is None
+    assert second.cluster_id == first.cluster_id
+    assert second.duplicate_of == "msg-1"
+    assert len(index) == 1
+
+
+def test_different_email_gets_new_cluster():
+    index = NearDuplicateIndex()
+    first = index.check(logwatch("pve01", "Mon Oct 13 04:02:01 2026"))
+    other = index.check(EmailClassifyRequest(subject="Ihre Rechnung", body_preview="Anbei Ihre Rechnung für Oktober"))
+    assert other.cluster_id != first.cluster_id
+    assert other.duplicate_of is None
+    assert len(index) == 2
+
+
+def test_duplicate_of_falls_back_to_cluster_id_without_message_id():
+    index = NearDuplicateIndex()
+    first = index.check(logwatch("pve01", "Mon"))
+    second = index.check(logwatch("pve02", "Tue"))
+    assert second.duplicate_of == first.cluster_id
+
+
+def test_dry_run_does_not_record():
+    index = NearDuplicateIndex()
+    assert index.check(logwatch("pve01", "Mon"), record=False).duplicate_of is None
+    assert len(index) == 0
+
+
+def test_clusters_expire_after_window():
+    now = [0.0]
+    index = NearDuplicateIndex(window_seconds=60, clock=lambda: now[0])
+    index.check(logwatch("pve01", "Mon", "msg-1"))
+    now[0] = 30
+    assert index.check(logwatch("pve02", "Tue")).duplicate_of == "msg-1"
+    now[0] = 80  # refreshed at 30, so still within the window
+    assert index.check(logwatch("pve03", "Wed")).duplicate_of == "msg-1"
+    now[0] = 200
+    assert index.check(logwatch("pve04", "Thu")).duplicate_of is None
+
+
+def test_evicts_least_recently_seen_beyond_max_entries():
+    index = NearDuplicateIndex(max_entries=2)
+    subjects = ["Ihre Rechnung", "Backup Report erfolgreich", "Newsletter Oktober Angebote"]
+    for subject in subjects:
+        index.check(EmailClassifyRequest(subject=subject))
+    assert len(index) == 2
+    assert index.check(EmailClassifyRequest(subject=subjects[0]), record=False).duplicate_of is None
+    assert index.check(EmailClassifyRequest(subject=subjects[2]), record=False).duplicate_of is not None
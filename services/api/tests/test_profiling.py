@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.profiling import RequestTimings, SamplingProfiler, phase
+
+client = TestClient(app)
+
+EMAIL = {"from_address": "billing@hetzner.com", "subject": "Ihre Rechnung", "message_id": "profiling-001"}
+
+
+def _phases(header: str) -> dict[str, float]:
+    phases = {}
+    for part in header.split(", "):
+        name, duration = part.split(";dur=")
+        phases[name] = float(duration)
+    return phases
+
+
+def test_classify_reports_server_timing():
+    response = client.post("/api/v1/email/classify", json=EMAIL)
+    assert response.status_code == 200
+    phases = _phases(response.headers["server-timing"])
+    assert list(phases) == ["validate", "cache", "rules", "dispatch", "serialize", "total"]
+    assert phases["total"] >= phases["validate"] + phases["rules"] + phases["serialize"]
+
+
+def test_other_routes_report_total_only():
+    assert _phases(client.get("/health").headers["server-timing"]).keys() == {"total"}
+
+
+def test_phase_outside_request_is_noop():
+    with phase("rules"):
+        pass
+
+
+def test_request_timings_header_format():
+    timings = RequestTimings(started=1.0)
+    timings.entered = 1.001
+    timings.add("rules", 0.0005)
+    timings.add("rules", 0.0005)
+    timings.exited = 1.003
+    assert timings.header(1.004) == "validate;dur=1.000, rules;dur=1.000, serialize;dur=1.000, total;dur=4.000"
+
+
+def _busy_classifier_work(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_sampling_profiler_collects_collapsed_stacks():
+    profiler = SamplingProfiler()
+    profiler.arm(1, interval=0.0005)
+    assert profiler.begin() is True
+    assert profiler.begin() is False  # only one request was requested
+    _busy_classifier_work(0.05)
+    profiler.end()
+
+    assert profiler.done
+    assert profiler.samples > 0
+    stack, count = profiler.collapsed().splitlines()[0].rsplit(" ", 1)
+    assert stack.endswith(":_busy_classifier_work")
+    assert int(count) > 0
+
+
+def _samplers() -> int:
+    return sum(1 for t in threading.enumerate() if t.name == "sampling-profiler")
+
+
+def test_quick_end_and_begin_leave_one_sampler():
+    profiler = SamplingProfiler()
+    profiler.arm(3, interval=0.05)
+    for _ in range(3):
+        assert profiler.begin() is True
+        assert _samplers() == 1
+        profiler.end()
+    profiler.arm(1, interval=0.0005)
+    profiler.begin()
+    assert _samplers() == 1
+    profiler.end()
+
+
+@pytest.mark.asyncio
+async def test_sampling_profiler_sees_to_thread_work_and_skips_idle_loop():
+    profiler = SamplingProfiler()
+    profiler.arm(1, interval=0.0005)
+    profiler.begin()
+    await asyncio.to_thread(_busy_classifier_work, 0.05)
+    await asyncio.sleep(0.02)
+    profiler.end()
+
+    stacks = [line.rsplit(" ", 1)[0] for line in profiler.collapsed().splitlines()]
+    assert any(stack.endswith(":_busy_classifier_work") for stack in stacks)
+    assert not any(stack.rsplit(";", 1)[-1].startswith("selectors:") for stack in stacks)
+
+
+def test_admin_profile_endpoints():
+    response = client.post("/api/v1/admin/profile", json={"requests": 2, "interval_ms": 0.5})
+    assert response.status_code == 200
+    assert response.json()["remaining"] == 2
+
+    for i in range(3):
+        client.post("/api/v1/email/classify", json={**EMAIL, "message_id": f"profiling-{i}"})
+
+    status = client.get("/api/v1/admin/profile/status").json()
+    assert (status["requested"], status["completed"], status["remaining"], status["done"]) == (2, 2, 0, True)
+    profile = client.get("/api/v1/admin/profile")
+    assert profile.status_code == 200
+    assert profile.headers["content-type"].startswith("text/plain")
+    assert profile.headers["x-profile-done"] == "true"
+
+
+def test_profile_rejects_invalid_request():
+    assert client.post("/api/v1/admin/profile", json={"requests": 0}).status_code == 422
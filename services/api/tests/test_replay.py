@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+
+from app.cli import replay
+
+CONFIG_PATH = Path(__file__).parent.parent.parent.parent / "config" / "email_rules.json"
+
+EMAILS = [
+    {"from_address": "billing@hetzner.com", "subject": "Ihre Rechnung", "message_id": "m0"},
+    {"from_address": "root@proxmox.local", "subject": "Backup Report", "message_id": "m1"},
+    {"from_address": "mailer-daemon@example.org", "subject": "Undeliverable", "message_id": "m2"},
+    {"from_address": "billing@hetzner.com", "subject": "Ihre Rechnung 2", "message_id": "m3"},
+]
+
+
+def _candidate(tmp_path) -> Path:
+    """Current rules plus a first rule that files bounces as spam_suspect."""
+    rules = json.loads(CONFIG_PATH.read_text())
+    rules["rules"].insert(
+        0,
+        {
+            "name": "bounces",
+            "category": "spam_suspect",
+            "priority": "low",
+            "actions": ["skip"],
+            "conditions": {
+                "match_type": "any",
+                "rules": [{"field": "from_address", "operator": "domain_suffix_in", "values": ["example.org"]}],
+            },
+        },
+    )
+    path = tmp_path / "candidate.json"
+    path.write_text(json.dumps(rules))
+    return path
+
+
+def _run(tmp_path, workers: int) -> dict:
+    source = tmp_path / "archive.ndjson"
+    source.write_text("\n".join(json.dumps(e) for e in EMAILS * 3) + "\nnot json\n")
+    target = tmp_path / f"report-{workers}.json"
+    args = [str(source), "-o", str(target), "--current", str(CONFIG_PATH), "--candidate", str(_candidate(tmp_path))]
+    assert replay.main(args + ["--workers", str(workers), "--chunk-size", "2", "--samples", "2"]) == 0
+    return json.loads(target.read_text())
+
+
+def test_replay_reports_transitions(tmp_path):
+    report = _run(tmp_path, workers=1)
+    assert report["records"] == 12
+    assert report["errors"] == 1
+    assert report["category_changed"] == 3
+    assert report["matrix"]["uncategorized"] == {"spam_suspect": 3}
+    assert report["matrix"]["server_alert"] == {"server_alert": 3}
+
+    (change,) = report["changes"]
+    assert (change["from"], change["to"], change["count"]) == ("uncategorized", "spam_suspect", 3)
+    assert [s["index"] for s in change["samples"]] == [2, 6]
+    assert change["samples"][0]["candidate"]["actions"] == ["skip"]
+    assert report["rulesets"]["current"]["version"] != report["rulesets"]["candidate"]["version"]
+
+
+def test_process_pool_matches_single_process(tmp_path):
+    single, pooled = _run(tmp_path, workers=1), _run(tmp_path, workers=2)
+    for key in ("records", "errors", "matrix", "changes", "action_changes"):
+        assert pooled[key] == single[key]
+
+
+def test_invalid_candidate_is_rejected(tmp_path, capsys):
+    bad = tmp_path / "bad.json"
+    bad.write_text('{"rules": [')
+    assert replay.main(["--candidate", str(bad), "--current", str(CONFIG_PATH), str(tmp_path / "x")]) == 2
+    assert "Invalid ruleset" in capsys.readouterr().err
@@ -0,0 +1,86 @@
+from app.models.email import EmailClassifyRequest
+from app.services.ruleset import EmailContext, compile_ruleset
+
+
+def _rule(name, match_type, *conditions):
+    return {
+        "name": name,
+        "category": "personal",
+        "priority": "low",
+        "actions": ["skip"],
+        "conditions": {"match_type": match_type, "rules": list(conditions)},
+    }
+
+
+def _cond(field, operator, *values):
+    return {"field": field, "operator": operator, "values": list(values)}
+
+
+RULESET = compile_ruleset(
+    {
+        "rules": [
+            _rule("any_rule", "any", _cond("account", "equals", "family")),
+            _rule("business_only", "all", _cond("account", "equals", "business")),
+            _rule("family_only", "all", _cond("account", "equals", "Family")),
+            _rule("not_low", "all", _cond("importance", "not_equals", "low")),
+            _rule("boss", "all", _cond("from_address", "equals", "chef@firma.de")),
+            _rule("boss_family", "all", _cond("account", "equals", "family"), _cond("from_address", "equals", "chef@firma.de")),
+            _rule("listed", "all", _cond("from_address", "domain_in", "@Liste.de", "liste.com")),
+            _rule("vip", "all", _cond("from_address", "address_in", "vip@liste.de")),
+            _rule("empty", "all"),
+        ]
+    },
+    version="test",
+)
+
+
+def _candidates(**fields) -> list[str]:
+    ctx = EmailContext(EmailClassifyRequest(**fields), RULESET)
+    return [rule.name for rule in RULESET.rule_index.candidates(ctx)]
+
+
+def test_account_partition():
+    assert _candidates(account="business") == ["any_rule", "business_only", "not_low"]
+    assert _candidates(account="family") == ["any_rule", "family_only", "not_low"]
+
+
+def test_importance_partition():
+    assert _candidates(account="business", importance="low") == ["any_rule", "business_only"]
+
+
+def test_sender_domain_partition_keeps_order():
+    assert _candidates(account="business", from_address="Chef@Firma.de") == [
+        "any_rule",
+        "business_only",
+        "not_low",
+        "boss",
+    ]
+    assert _candidates(account="family", from_address="chef@firma.de") == [
+        "any_rule",
+        "family_only",
+        "not_low",
+        "boss",
+        "boss_family",
+    ]
+
+
+def test_domain_in_and_address_in_partition():
+    assert _candidates(account="business", from_address="Info <info@liste.de>") == [
+        "any_rule",
+        "business_only",
+        "not_low",
+        "listed",
+        "vip",
+    ]
+    assert _candidates(account="business", from_address="info@other.de") == ["any_rule", "business_only", "not_low"]
+
+
+def test_equals_display_form_sender_is_filed_under_its_domain():
+    ruleset = compile_ruleset(
+        {"rules": [_rule("display", "all", _cond("from_address", "equals", "Chef <chef@firma.de>"))]},
+        version="test",
+    )
+    email = EmailClassifyRequest(from_address="Chef <chef@firma.de>")
+    ctx = EmailContext(email, ruleset)
+    assert [rule.name for rule in ruleset.rule_index.candidates(ctx)] == ["display"]
+    assert ruleset.rules[0].conditions[0].match(ctx)[0]
@@ -0,0 +1,132 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from app.models.email import EmailClassifyRequest
+from app.services import email_classifier
+from app.services.email_classifier import EmailClassifier
+from app.services.ruleset import compile_ruleset
+from app.services.ruleset_snapshot import RulesetSnapshotStore
+
+RULES = {
+    "rules": [
+        {
+            "name": "invoice",
+            "category": "invoice",
+            "priority": "medium",
+            "actions": ["notify_telegram"],
+            "conditions": {
+                "match_type": "any",
+                "rules": [{"field": "subject", "operator": "contains_any", "values": ["Rechnung"]}],
+            },
+        }
+    ]
+}
+
+
+def _write(path: Path, data: dict, mtime_ns: int) -> None:
+    path.write_text(json.dumps(data))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def rules_path(tmp_path) -> Path:
+    path = tmp_path / "rules.json"
+    _write(path, RULES, 1_000_000_000)
+    return path
+
+
+def test_second_worker_loads_snapshot(rules_path, tmp_path, monkeypatch):
+    store = RulesetSnapshotStore(tmp_path / "snapshots")
+    first = EmailClassifier(rules_path=rules_path, snapshots=store)
+    assert first.ruleset.revision == 1
+
+    monkeypatch.setattr(email_classifier, "parse_ruleset", lambda *a, **k: pytest.fail("ruleset was compiled"))
+    second = EmailClassifier(rules_path=rules_path, snapshots=RulesetSnapshotStore(tmp_path / "snapshots"))
+    assert (second.ruleset.version, second.ruleset.revision) == (first.ruleset.version, 1)
+
+    result = second.classify(EmailClassifyRequest(subject="Rechnung 42"))
+    assert result.category.value == "invoice"
+    assert (result.ruleset_version, result.ruleset_revision) == (first.ruleset.version, 1)
+
+
+def test_change_bumps_revision_once_for_all_workers(rules_path, tmp_path):
+    store = RulesetSnapshotStore(tmp_path / "snapshots")
+    first = EmailClassifier(rules_path=rules_path, snapshots=store)
+    second = EmailClassifier(rules_path=rules_path, snapshots=store)
+
+    os.utime(rules_path, ns=(2_000_000_000, 2_000_000_000))  # touched, same content
+    assert first.reload_if_changed() is False
+    assert second.reload_if_changed() is False
+    assert store.meta().revision == 1
+
+    changed = json.loads(json.dumps(RULES))
+    changed["rules"][0]["conditions"]["rules"][0]["values"].append("Invoice")
+    _write(rules_path, changed, 3_000_000_000)
+    assert first.reload_if_changed() is True
+    assert first.ruleset.revision == 2
+    assert second.reload_if_changed() is True
+    assert (second.ruleset.version, second.ruleset.revision) == (first.ruleset.version, 2)
+    assert second.classify(EmailClassifyRequest(subject="Invoice")).category.value == "invoice"
+    assert sorted(p.name for p in store.directory.glob("*.pkl")) == ["ruleset-000001.pkl", "ruleset-000002.pkl"]
+
+
+def test_published_ruleset_survives_restarts_until_the_file_changes(rules_path, tmp_path):
+    store = RulesetSnapshotStore(tmp_path / "snapshots")
+    first = EmailClassifier(rules_path=rules_path, snapshots=store, keep_published=True)
+    baserow = json.loads(json.dumps(RULES))
+    baserow["rules"][0]["conditions"]["rules"][0]["values"] = ["Invoice"]
+    assert first.publish(compile_ruleset(baserow, version="baserow-1", source="baserow"))
+    assert first.ruleset.revision == 2
+
+    restarted = EmailClassifier(rules_path=rules_path, snapshots=store, keep_published=True)
+    assert (restarted.ruleset.source, restarted.ruleset.revision) == ("baserow", 2)
+    assert store.meta().revision == 2
+
+    # Without Baserow (switched off), the rules file wins
+    file_only = EmailClassifier(rules_path=rules_path, snapshots=store)
+    assert (file_only.ruleset.source, file_only.ruleset.revision) == ("config_file", 3)
+
+    changed = json.loads(json.dumps(RULES))
+    changed["rules"][0]["name"] = "invoice_edited"
+    _write(rules_path, changed, 2_000_000_000)
+    assert restarted.reload_if_changed() is True
+    assert restarted.ruleset.source == "config_file"
+
+
+def test_rejected_edit_keeps_shared_revision(rules_path, tmp_path):
+    store = RulesetSnapshotStore(tmp_path / "snapshots")
+    first = EmailClassifier(rules_path=rules_path, snapshots=store)
+    rules_path.write_text('{"rules": [')
+    os.utime(rules_path, ns=(2_000_000_000, 2_000_000_000))
+    assert first.reload_if_changed() is False
+
+    second = EmailClassifier(rules_path=rules_path, snapshots=store)
+    assert (second.ruleset.version, second.ruleset.revision) == (first.ruleset.version, 1)
+    assert second.classify(EmailClassifyRequest(subject="Rechnung")).category.value == "invoice"
+
+
+def test_unusable_snapshot_is_replaced(rules_path, tmp_path):
+    store = RulesetSnapshotStore(tmp_path / "snapshots")
+    EmailClassifier(rules_path=rules_path, snapshots=store)
+    (store.directory / store.meta().file).write_bytes(b"not a pickle")
+
+    c = EmailClassifier(rules_path=rules_path, snapshots=store)
+    assert c.ruleset.revision == 2
+    assert c.classify(EmailClassifyRequest(subject="Rechnung")).category.value == "invoice"
+    assert EmailClassifier(rules_path=rules_path, snapshots=store).ruleset.revision == 2
+
+
+def _start_worker(rules_path: Path, directory: Path) -> tuple[str, int]:
+    ruleset = EmailClassifier(rules_path=rules_path, snapshots=RulesetSnapshotStore(directory)).ruleset
+    return ruleset.version, ruleset.revision
+
+
+def test_concurrent_worker_start_publishes_one_revision(rules_path, tmp_path):
+    with ProcessPoolExecutor(4) as pool:
+        results = list(pool.map(_start_worker, [rules_path] * 8, [tmp_path / "snapshots"] * 8))
+    assert len(set(results)) == 1
+    assert results[0][1] == 1
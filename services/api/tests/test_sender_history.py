@@ -0,0 +1,250 @@
+import json
+from datetime import datetime
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+from redis.exceptions import ConnectionError
+
+from app.main import app
+from app.models.email import EmailCategory, EmailClassifyRequest
+from app.services.email_classifier import EmailClassifier
+from app.services.sender_history import BloomFilter, SenderHistory, SenderStats
+
+client = TestClient(app)
+
+
+def _email(from_address: str, **kwargs) -> EmailClassifyRequest:
+    return EmailClassifyRequest(from_address=from_address, subject=kwargs.pop("subject", "Angebot"), **kwargs)
+
+
+def test_bloom_filter_sizing_and_false_positive_rate():
+    bloom = BloomFilter.for_capacity(500_000, 0.01)
+    assert bloom.hashes == 7
+    assert len(bloom.data) < 600 * 1024
+
+    small = BloomFilter.for_capacity(5000, 0.01)
+    added = [f"sender{i}@example.com" for i in range(5000)]
+    for address in added:
+        small.add(address)
+    assert all(address in small for address in added)
+    false_positives = sum(f"other{i}@example.org" in small for i in range(20000))
+    assert false_positives / 20000 < 0.02
+    assert 4500 < small.approximate_count() < 5500
+
+
+def test_bloom_filter_merge_requires_same_size():
+    a, b = BloomFilter(1024, 3), BloomFilter(1024, 3)
+    a.add("a@x.de")
+    b.add("b@x.de")
+    a.merge(bytes(b.data))
+    assert "a@x.de" in a and "b@x.de" in a
+    with pytest.raises(ValueError):
+        a.merge(bytes(16))
+
+
+@pytest.mark.asyncio
+async def test_bit_layout_matches_redis_setbit():
+    redis = fakeredis.FakeAsyncRedis()
+    bloom = BloomFilter(4096, 5)
+    bloom.add("kunde@firma.de")
+    for position in bloom.positions("kunde@firma.de"):
+        await redis.setbit("bits", position, 1)
+    assert await redis.get("bits") == bytes(bloom.data).rstrip(b"\0")
+
+
+@pytest.mark.asyncio
+async def test_record_flush_and_lookup():
+    history = SenderHistory(BloomFilter(8192, 4), client=fakeredis.FakeAsyncRedis(), flush_interval=60)
+    await history.start()
+    email = _email("Kunde <Kunde@Firma.de>")
+    assert await history.lookup(email) == SenderStats()
+
+    assert history.record(email, EmailCategory.CLIENT_INQUIRY)
+    assert history.record(_email("kunde@firma.de"), EmailCategory.INVOICE)
+    assert history.stats(email) == SenderStats(known=True)
+    await history.stop()
+
+    stats = await history.lookup(email)
+    assert stats.known and stats.count == 2
+    assert stats.last_category == "invoice"
+    assert isinstance(stats.first_seen, datetime)
+    assert await history.client.ttl(history.key_for("kunde@firma.de")) > 0
+
+
+@pytest.mark.asyncio
+async def test_lookup_many_matches_single_lookups():
+    history = SenderHistory(BloomFilter(8192, 4), client=fakeredis.FakeAsyncRedis(), flush_interval=60)
+    await history.start()
+    for address in ("a@firma.de", "a@firma.de", "b@firma.de"):
+        history.record(_email(address), EmailCategory.INVOICE)
+    await history.flush()
+    emails = [_email("a@firma.de"), _email("neu@firma.de"), _email("B <b@firma.de>")]
+    many = await history.lookup_many(emails)
+    assert many == [await history.lookup(email) for email in emails]
+    assert [stats.count for stats in many] == [2, 0, 1]
+    await history.stop()
+
+
+@pytest.mark.asyncio
+async def test_unknown_sender_needs_no_redis_round_trip():
+    class NoReads(fakeredis.FakeAsyncRedis):
+        async def hgetall(self, key):
+            raise AssertionError("Redis queried for an unknown sender")
+
+    history = SenderHistory(BloomFilter(8192, 4), client=NoReads())
+    assert await history.lookup(_email("neu@unbekannt.de")) == SenderStats()
+
+
+@pytest.mark.asyncio
+async def test_sync_shares_senders_between_workers():
+    redis = fakeredis.FakeAsyncRedis()
+    first = SenderHistory(BloomFilter(8192, 4), client=redis, flush_interval=60)
+    second = SenderHistory(BloomFilter(8192, 4), client=redis, flush_interval=60)
+    await first.start()
+    await second.start()
+    first.record(_email("kunde@firma.de"), EmailCategory.CLIENT_INQUIRY)
+    await first.stop()
+    assert not second.stats(_email("kunde@firma.de")).known
+
+    await second.sync()
+    assert second.stats(_email("kunde@firma.de")).known
+    await second.stop()
+
+    # A restarted worker starts from the shared copy
+    restarted = SenderHistory(BloomFilter(8192, 4), client=redis)
+    await restarted.sync()
+    assert restarted.stats(_email("kunde@firma.de")).known
+
+
+@pytest.mark.asyncio
+async def test_redis_outage_keeps_updates_queued():
+    class BrokenPipeline:
+        def __getattr__(self, name):
+            if name == "execute":
+                async def execute():
+                    raise ConnectionError("down")
+
+                return execute
+            return lambda *args, **kwargs: None
+
+    redis = fakeredis.FakeAsyncRedis()
+    history = SenderHistory(BloomFilter(8192, 4), client=redis, flush_interval=60)
+    await history.start()
+    history.record(_email("kunde@firma.de"), EmailCategory.CLIENT_INQUIRY)
+    pipeline, redis.pipeline = redis.pipeline, lambda **kwargs: BrokenPipeline()
+    await history.flush()
+    assert history.pending == 1
+    assert not history.enabled
+
+    redis.pipeline = pipeline
+    history._unavailable_until = 0.0
+    await history.stop()
+    assert history.pending == 0
+    assert (await history.lookup(_email("kunde@firma.de"))).count == 1
+
+
+class TestSenderConditions:
+    @staticmethod
+    def _classifier(tmp_path, condition, history=None) -> EmailClassifier:
+        path = tmp_path / "rules.json"
+        path.write_text(
+            json.dumps(
+                {
+                    "rules": [
+                        {
+                            "name": "client_inquiry_business",
+                            "category": "client_inquiry",
+                            "priority": "high",
+                            "actions": ["notify_telegram"],
+                            "conditions": {
+                                "match_type": "all",
+                                "rules": [{"field": "account", "operator": "equals", "values": ["business"]}, condition],
+                            },
+                        }
+                    ]
+                }
+            )
+        )
+        return EmailClassifier(rules_path=path, sender_history=history)
+
+    def test_sender_known_uses_the_filter(self, tmp_path):
+        history = SenderHistory(BloomFilter(8192, 4))
+        c = self._classifier(tmp_path, {"field": "from_address", "operator": "sender_known"}, history)
+        assert not c.ruleset.uses_sender_counts
+        assert c.classify(_email("kunde@firma.de")).category.value == "uncategorized"
+        history.record(_email("kunde@firma.de"), EmailCategory.CLIENT_INQUIRY)
+        result = c.classify(_email("Kunde <kunde@firma.de>"))
+        assert result.category.value == "client_inquiry"
+        assert result.reasoning == "Rule 'client_inquiry_business': account equals 'business'; sender is known"
+
+    def test_sender_seen_count_gte(self, tmp_path):
+        c = self._classifier(tmp_path, {"field": "from_address", "operator": "sender_seen_count_gte", "values": [3]})
+        assert c.ruleset.uses_sender_counts
+        email = _email("kunde@firma.de")
+        assert c.classify(email).category.value == "uncategorized"
+        assert c.classify(email, sender=SenderStats(known=True, count=2)).category.value == "uncategorized"
+        result = c.classify(email, sender=SenderStats(known=True, count=3))
+        assert result.reasoning.endswith("sender seen 3 times before")
+
+    @pytest.mark.parametrize(
+        "condition",
+        [
+            {"field": "subject", "operator": "sender_known"},
+            {"field": "from_address", "operator": "sender_seen_count_gte", "values": ["viele"]},
+            {"field": "from_address", "operator": "sender_seen_count_gte", "values": [1, 2]},
+            {"field": "from_address", "operator": "sender_seen_count_gte", "values": [0]},
+        ],
+    )
+    def test_invalid_conditions_reject_ruleset(self, tmp_path, condition):
+        assert self._classifier(tmp_path, condition).get_rules() == []
+
+
+def test_classify_records_senders_and_dry_runs_do_not(monkeypatch):
+    from app.routers import email as email_router
+
+    history = SenderHistory(BloomFilter(8192, 4))
+    monkeypatch.setattr(email_router.classifier, "sender_history", history)
+    email = {"from_address": "neukunde@firma.de", "subject": "Anfrage", "account": "business"}
+
+    client.post("/api/v1/email/test-classify", json=email)
+    assert not history.stats(_email("neukunde@firma.de")).known
+    assert client.post("/api/v1/email/classify", json=email).status_code == 200
+    assert history.stats(_email("neukunde@firma.de")).known
+
+
+def test_every_endpoint_sees_sender_counts(monkeypatch):
+    from app.routers import email as email_router
+    from app.services.ruleset import compile_ruleset
+
+    server = fakeredis.FakeServer()
+    history = SenderHistory(BloomFilter(8192, 4), client=fakeredis.FakeAsyncRedis(server=server))
+    history.bloom.add("stamm@firma.de")
+    fakeredis.FakeRedis(server=server).hset(history.key_for("stamm@firma.de"), mapping={"count": 5})
+    ruleset = compile_ruleset(
+        {
+            "rules": [
+                {
+                    "name": "regular",
+                    "category": "client_inquiry",
+                    "priority": "high",
+                    "actions": ["notify_telegram"],
+                    "conditions": {
+                        "match_type": "all",
+                        "rules": [{"field": "from_address", "operator": "sender_seen_count_gte", "values": [3]}],
+                    },
+                }
+            ]
+        },
+        version="counts",
+    )
+    monkeypatch.setattr(email_router.classifier, "sender_history", history)
+    monkeypatch.setattr(email_router.classifier, "_ruleset", ruleset)
+    email = {"from_address": "Stamm <stamm@firma.de>", "subject": "Frage", "account": "business"}
+
+    assert client.post("/api/v1/email/classify", json=email).json()["category"] == "client_inquiry"
+    assert client.post("/api/v1/email/test-classify", json=email).json()["category"] == "client_inquiry"
+    batch = client.post("/api/v1/email/classify/batch", json=[{"subject": 1}, email]).json()
+    assert batch["results"][1]["result"]["category"] == "client_inquiry"
+    stream = client.post("/api/v1/email/classify/stream", content="not json\n" + json.dumps(email))
+    assert json.loads(stream.text.splitlines()[1])["result"]["category"] == "client_inquiry"
@@ -0,0 +1,188 @@
+import asyncio
+from pathlib import Path
+
+import fakeredis
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from redis.exceptions import ConnectionError
+
+from app.models.email import EmailClassifyRequest
+from app.services.email_classifier import EmailClassifier
+from app.services.telegram_dispatcher import (
+    TelegramClient,
+    TelegramDispatcher,
+    MAX_MESSAGE_LENGTH,
+    TokenBucket,
+    format_digest,
+    format_message,
+)
+
+CONFIG_PATH = Path(__file__).parent.parent.parent.parent / "config" / "email_rules.json"
+classifier = EmailClassifier(rules_path=CONFIG_PATH)
+
+
+def fake_telegram(rate_limited: int = 0) -> FastAPI:
+    """Local stand-in for api.telegram.org that records sendMessage calls."""
+    app = FastAPI()
+    app.state.messages = []
+    app.state.rate_limited = rate_limited
+
+    @app.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        if app.state.rate_limited:
+            app.state.rate_limited -= 1
+            return JSONResponse(
+                {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.01}},
+                status_code=429,
+            )
+        app.state.messages.append(await request.json())
+        return {"ok": True, "result": {"message_id": len(app.state.messages)}}
+
+    return app
+
+
+def make_dispatcher(app: FastAPI, **kwargs) -> TelegramDispatcher:
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://telegram")
+    client = TelegramClient("123:abc", api_base="http://telegram", http=http)
+    options = {"per_chat_rate": 1000.0, "per_chat_burst": 1000, "global_rate": 1000.0}
+    options.update(kwargs)
+    return TelegramDispatcher(client, chat_id="42", **options)
+
+
+def alert(subject: str, sender: str = "root@proxmox.local") -> tuple:
+    email = EmailClassifyRequest(from_address=sender, subject=subject)
+    return email, classifier.classify(email)
+
+
+@pytest.mark.asyncio
+async def test_sends_formatted_message():
+    app = fake_telegram()
+    dispatcher = make_dispatcher(app)
+    await dispatcher.start()
+    assert dispatcher.submit(*alert("Backup failed"))
+    await dispatcher.stop()
+
+    [message] = app.state.messages
+    assert message["chat_id"] == "42"
+    assert message["parse_mode"] == "Markdown"
+    assert "*Betreff:* Backup failed" in message["text"]
+    assert "Server Alert" in message["text"]
+
+
+@pytest.mark.asyncio
+async def test_burst_is_coalesced_into_digest():
+    app = fake_telegram()
+    dispatcher = make_dispatcher(app, burst_threshold=2, burst_window=0.2)
+    await dispatcher.start()
+    for i in range(6):
+        dispatcher.submit(*alert(f"Backup {i} failed"))
+    dispatcher.submit(*alert("Backup failed", sender="other@proxmox.local"))
+    await asyncio.sleep(0.1)
+    assert len(app.state.messages) == 3  # two individual + other sender
+
+    await asyncio.sleep(0.3)
+    assert len(app.state.messages) == 4
+    digest = app.state.messages[-1]["text"]
+    assert digest.startswith("📦 *4× Server Alert*")
+    assert "• Backup 5 failed" in digest
+    await dispatcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_open_digest():
+    app = fake_telegram()
+    dispatcher = make_dispatcher(app, burst_threshold=1, burst_window=60)
+    await dispatcher.start()
+    for i in range(3):
+        dispatcher.submit(*alert(f"Backup {i} failed"))
+    await dispatcher.stop()
+    assert len(app.state.messages) == 2
+    assert app.state.messages[1]["text"].startswith("📦 *2× Server Alert*")
+
+
+@pytest.mark.asyncio
+async def test_retries_after_rate_limit():
+    app = fake_telegram(rate_limited=2)
+    dispatcher = make_dispatcher(app)
+    await dispatcher.start()
+    dispatcher.submit(*alert("Backup failed"))
+    await dispatcher.stop()
+    assert len(app.state.messages) == 1
+
+
+@pytest.mark.asyncio
+async def test_workers_share_one_sender_through_redis():
+    app = fake_telegram()
+    server = fakeredis.FakeServer()
+    workers = [
+        make_dispatcher(
+            app, burst_threshold=2, burst_window=60, redis=fakeredis.FakeAsyncRedis(server=server), poll_interval=0.01
+        )
+        for _ in range(3)
+    ]
+    for dispatcher in workers:
+        await dispatcher.start()
+    for i in range(6):
+        workers[i % 3].submit(*alert(f"Backup {i} failed"))
+    await asyncio.sleep(0.1)
+    # The limits and the burst count cover all workers, not each one
+    assert len(app.state.messages) == 2
+    assert sum(dispatcher.lease.held for dispatcher in workers) == 1
+    for dispatcher in workers:
+        await dispatcher.stop()
+    assert len(app.state.messages) == 3
+    assert app.state.messages[2]["text"].startswith("📦 *4× Server Alert*")
+
+
+@pytest.mark.asyncio
+async def test_sends_itself_when_redis_fails():
+    class BrokenRedis(fakeredis.FakeAsyncRedis):
+        async def rpush(self, *args):
+            raise ConnectionError("down")
+
+    app = fake_telegram()
+    dispatcher = make_dispatcher(app, redis=BrokenRedis(), poll_interval=0.01)
+    await dispatcher.start()
+    dispatcher.submit(*alert("Backup failed"))
+    await dispatcher.stop()
+    assert len(app.state.messages) == 1
+
+
+def test_submit_without_running_dispatcher_is_noop():
+    dispatcher = make_dispatcher(fake_telegram())
+    assert dispatcher.submit(*alert("Backup failed")) is False
+
+
+def test_token_bucket_paces_after_capacity():
+    now = [0.0]
+    bucket = TokenBucket(rate=1.0, capacity=2, clock=lambda: now[0])
+    for _ in range(2):
+        assert bucket.delay() == 0
+        bucket.take()
+    assert bucket.delay() == pytest.approx(1.0)
+    now[0] = 0.5
+    assert bucket.delay() == pytest.approx(0.5)
+
+
+def test_format_message_escapes_markdown():
+    email = EmailClassifyRequest(from_address="a_b@example.com", subject="*wichtig*", body_preview="x" * 300)
+    text = format_message(email, classifier.classify(email))
+    assert "a\\_b@example.com" in text
+    assert "\\*wichtig\\*" in text
+    assert text.endswith("x" * 200 + "...")
+
+
+def test_long_digest_is_cut_between_lines():
+    items = [
+        (email, classifier.classify(email))
+        for email in (EmailClassifyRequest(from_address="a@b.de", subject="_" * 1000 + str(i)) for i in range(20))
+    ]
+    text = format_digest(items)
+    assert len(text) <= MAX_MESSAGE_LENGTH
+    assert text.startswith("📦 *20×")
+    for line in text.splitlines():
+        # Every underscore is still escaped, none cut off from its backslash
+        assert not line.endswith("\\")
+        assert line.count("\\_") == line.count("_")